@@ -0,0 +1,181 @@
+import http.client
+import json
+import socket
+import threading
+import uuid
+from urllib.parse import quote, urlsplit
+
+
+class ServerError(Exception):
+    """The annotation server answered with an error"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+    @property
+    def rejected(self):
+        """The server refused the request itself, sending it again gives the same answer"""
+        return self.status is not None and 400 <= self.status < 500
+
+
+class AnnotationClient:
+    """Client of the annotation server over one persistent HTTP connection
+
+    Requests are serialized over a single keep-alive connection, which is
+    reopened once if the server closed it. Safe to use from worker threads.
+    """
+
+    def __init__(self, url, timeout=10.0):
+        parts = urlsplit(url if "://" in url else f"http://{url}")
+        self.url = f"{parts.scheme}://{parts.netloc}"
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        self._connection.connect()
+        self._connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def request(self, method, path, payload=None):
+        """Send a request, returns the response body as bytes"""
+        body = None if payload is None else json.dumps(payload).encode("utf-8")
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        with self._lock:
+            for attempt in (0, 1):
+                if self._connection is None:
+                    self._connect()
+                try:
+                    self._connection.request(method, path, body=body, headers=headers)
+                    response = self._connection.getresponse()
+                    data = response.read()
+                    break
+                except (http.client.HTTPException, OSError):
+                    self._connection.close()
+                    self._connection = None
+                    if attempt:
+                        raise
+        if response.status != 200:
+            try:
+                message = json.loads(data)['error']
+            except (ValueError, KeyError):
+                message = response.reason
+            raise ServerError(f"{method} {path}: {message}", response.status)
+        return data
+
+    def request_json(self, method, path, payload=None):
+        return json.loads(self.request(method, path, payload))
+
+    def list_images(self):
+        """Names of all images of the served dataset"""
+        return self.request_json("GET", "/images")['images']
+
+    def image_bytes(self, name):
+        """Encoded image file"""
+        return self.request("GET", f"/images/{quote(name)}")
+
+    def annotations(self, name):
+        """Annotation data of an image"""
+        return self.request_json("GET", f"/annotations/{quote(name)}")
+
+    def apply_ops(self, ops):
+        """Send a batch of delta operations, returns one result per operation"""
+        if not ops:
+            return []
+        return self.request_json("POST", "/ops", {'ops': ops})['results']
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class OpBatcher:
+    """Collect delta operations and send them in batches
+
+    Operations are queued on the Tk thread with `push`; a flush is scheduled
+    `delay_ms` later (or right away once `max_ops` are pending) and sends
+    all of them in one request on the "sync" lane of the task runtime.
+    `on_results(ops, results)` is called on the Tk thread with the server's
+    answer.
+
+    Every operation carries this batcher's client id and a sequence number,
+    the server skips operations it already applied. So a batch whose answer
+    was lost can be sent again without adding annotations twice. Only one
+    batch is in flight at a time, so the server sees operations in order.
+    Operations also carry the last sequence number answered when they were
+    pushed. When the server gave an add another id, it moves later
+    operations pushed before the answer arrived to that id, whether they
+    were still pending or already in flight. Connection problems and 5xx
+    answers are retried, operations the server rejects are reported with
+    `on_error` and dropped.
+    """
+
+    def __init__(self, root, tasks, client, on_results=None, on_error=None, delay_ms=300, max_ops=200,
+                 retry_ms=5000):
+        self.root = root
+        self.tasks = tasks
+        self.client = client
+        self.on_results = on_results
+        self.on_error = on_error
+        self.delay_ms = delay_ms
+        self.max_ops = max_ops
+        self.retry_ms = retry_ms
+        self.client_id = uuid.uuid4().hex
+        self.pending = []  # (sequence number, last answered sequence number, op), in push order
+        self.in_flight = None  # The batch sent and not answered yet
+        self._seq = 0
+        self._answered = 0
+        self._scheduled = None
+
+    def push(self, op):
+        self._seq += 1
+        self.pending.append((self._seq, self._answered, op))
+        if len(self.pending) >= self.max_ops:
+            self.flush()
+        else:
+            self.schedule(self.delay_ms)
+
+    def schedule(self, delay_ms):
+        if self._scheduled is None:
+            self._scheduled = self.root.after(delay_ms, self.flush)
+
+    def flush(self):
+        """Send everything pending now"""
+        if self._scheduled is not None:
+            self.root.after_cancel(self._scheduled)
+            self._scheduled = None
+        if not self.pending or self.in_flight is not None:
+            return  # Sent once the batch in flight is answered
+        batch, self.pending = self.pending, []
+        self.in_flight = batch
+        ops = [dict(op, client=self.client_id, seq=seq, acked=acked) for seq, acked, op in batch]
+        self.tasks.submit(self.client.apply_ops, ops, lane="sync",
+                          on_done=lambda results: self._sent(ops, results),
+                          on_error=lambda error: self._failed(batch, error))
+
+    def _sent(self, ops, results):
+        self.in_flight = None
+        self._answered = max(self._answered, ops[-1]['seq'])
+        for op, result in zip(ops, results):
+            if 'error' in result and self.on_error:
+                self.on_error(ServerError(f"{op['op']} on {op['image']}: {result['error']}", 400))
+        if self.on_results:
+            self.on_results(ops, results)
+        self.flush()
+
+    def _failed(self, batch, error):
+        """Keep the operations of a failed batch and retry later, in their original order"""
+        self.in_flight = None
+        if isinstance(error, ServerError) and error.rejected:
+            # Sending the batch again would be refused the same way and hold up everything after it
+            self.flush()
+        else:
+            self.pending = sorted(batch + self.pending, key=lambda item: item[0])
+            self.schedule(self.retry_ms)
+        if self.on_error:
+            self.on_error(error)
@@ -0,0 +1,352 @@
+from annotation_ids import IdAllocator
+from annotation_io import ANNOTATION_FIELDS
+from startup import lazy_import
+
+# Only the geometry needs these, parsing and serializing work without them
+np = lazy_import("numpy")
+editing = lazy_import("editing")
+smoothing = lazy_import("smoothing")
+
+# Annotation kinds of both annotators and the file field holding each
+FIELDS = dict(ANNOTATION_FIELDS, smooth_curve='smooth_curves')
+KINDS = tuple(FIELDS)
+
+# File layouts: coco_annotator.py writes annotations/<name>.json, the curve
+# editor annotations/<name>_annotations.json with differently named fields
+FORMATS = ("annotator", "curve_enh")
+FORMAT_KINDS = {
+    "annotator": ("keypoint", "curve", "bbox", "freehand"),
+    "curve_enh": ("keypoint", "curve", "smooth_curve", "bbox"),
+}
+_RESERVED = set(FIELDS.values()) | {'next_ids', 'revision'}
+
+
+def detect_format(data):
+    """Layout of parsed annotation data, "annotator" or "curve_enh" """
+    if 'image_filename' in data or 'smooth_curves' in data:
+        return "curve_enh"
+    for field, key in (('keypoints', 'x_norm'), ('curves', 'normalized_points'), ('bboxes', 'x_center')):
+        entries = data.get(field)
+        if entries and key in entries[0]:
+            return "curve_enh"
+    return "annotator"
+
+
+def tessellate_freehand(control_points, smoothing_spec):
+    """Display points of a freehand curve from its control points and smoothing spec
+
+    The spec holds the method, the spline degree (0 for no smoothing) and
+    the corner cutting iterations of "chaikin".
+    """
+    if not smoothing_spec or len(control_points) < 3 or smoothing_spec.get('degree', 3) < 1:
+        return control_points
+    # Sample densely enough that the curve looks smooth between sparse control points
+    num_points = max(len(control_points) * 8, 50)
+    return smoothing.smooth_points(control_points, smoothing_spec.get('method', 'auto'),
+                                   smoothing_spec.get('degree', 3), smoothing_spec.get('iterations', 3),
+                                   num_points=num_points)
+
+
+def _polyline_distance(points, polyline):
+    """Distance of every point to the nearest segment of a polyline"""
+    a = polyline[:-1] if len(polyline) > 1 else polyline
+    d = polyline[1:] - a if len(polyline) > 1 else np.zeros_like(a)
+    offset = points[:, None, :] - a[None]
+    t = np.clip((offset * d).sum(axis=2) / np.maximum((d * d).sum(axis=1), 1e-12), 0, 1)
+    return np.hypot(*(offset - t[..., None] * d).transpose(2, 0, 1)).min(axis=1)
+
+
+def fit_freehand(stroke, control_points, smoothing_spec, tolerance, max_rounds=12):
+    """Control points whose tessellated curve stays within `tolerance` of the stroke
+
+    The simplified points are within the tolerance of the stroke, but the
+    spline through them can swing further out in between. Where it does,
+    the stroke point furthest from the curve becomes a control point too,
+    until the curve keeps the bound or the span has no points left to add.
+    """
+    stroke = [tuple(p) for p in stroke]
+    # The simplifier keeps stroke samples, so the control points are a subsequence of the stroke
+    indices = []
+    j = 0
+    for point in control_points:
+        while j < len(stroke) and stroke[j] != tuple(point):
+            j += 1
+        if j == len(stroke):
+            return control_points
+        indices.append(j)
+    if len(indices) < 2:
+        return control_points
+
+    # Samples about a pixel apart along the stroke, tagged with the stroke segment they lie on
+    vertices = np.asarray(stroke, dtype=float)
+    segments = np.diff(vertices, axis=0)
+    counts = np.maximum(1, np.ceil(np.hypot(*segments.T)).astype(int))
+    segment = np.repeat(np.arange(len(segments)), counts)
+    fraction = (np.arange(len(segment)) - np.repeat(np.cumsum(counts) - counts, counts)) / counts[segment]
+    samples = np.vstack([vertices[segment] + segments[segment] * fraction[:, None], vertices[-1:]])
+    segment = np.append(segment, len(segments) - 1)
+
+    for _ in range(max_rounds):
+        curve = np.asarray(tessellate_freehand([stroke[i] for i in indices], smoothing_spec), dtype=float)
+        # Each span is only compared with the part of the curve around it, found by the
+        # curve sample nearest to each control point
+        nearest = np.hypot(*(curve[None] - vertices[indices][:, None]).transpose(2, 0, 1)).argmin(axis=1)
+        anchors = np.maximum.accumulate(nearest)
+        starts = np.searchsorted(segment, indices)
+        added = []
+        for span in range(len(indices) - 1):
+            inner = np.arange(indices[span] + 1, indices[span + 1])
+            if not len(inner):
+                continue
+            near = curve[anchors[max(span - 1, 0)]:anchors[min(span + 2, len(indices) - 1)] + 1]
+            if _polyline_distance(samples[starts[span]:starts[span + 1] + 1], near).max() > tolerance:
+                added.append(int(inner[np.argmax(_polyline_distance(vertices[inner], near))]))
+        if not added:
+            break
+        indices = sorted(indices + added)
+    return [stroke[i] for i in indices]
+
+
+def smooth_curve_points(control_points, smoothness):
+    """Catmull-Rom points of a curve-editor smooth curve"""
+    if len(control_points) < 3:
+        return control_points
+    layout = editing.catmull_rom_layout(control_points)
+    points = []
+    for span in range(len(layout) - 3):
+        points.extend(editing.catmull_rom_span(control_points, layout, span, smoothness))
+    return points
+
+
+class AnnotationDocument:
+    """Annotations of one image, independent of any widget
+
+    Annotations are tuples kept in one ordered id -> annotation map per kind,
+    with coordinates in pixels of a frame of `size`: the annotators use the
+    displayed image size, batch code the original size, and the default
+    (1, 1) frame holds the normalized coordinates of the files as they are.
+    With `integer_coords` loaded coordinates are truncated to whole pixels
+    the way canvas coordinates are.
+
+        keypoint      (id, x, y)
+        curve         (id, [(x, y), ...])                  closed polyline
+        bbox          (id, x1, y1, x2, y2)
+        freehand      (id, [(x, y), ...], smoothing spec)  control points
+        smooth_curve  (id, [(x, y), ...], smoothness)      control points
+
+    No Tk in here, so documents can be used from workers, worker processes
+    and the benchmark suite.
+    """
+
+    def __init__(self, size=(1, 1), integer_coords=False):
+        self.size = size
+        self.integer_coords = integer_coords
+        self.fields = {}  # Other fields of the file, e.g. the image name
+        self.annotations = {kind: {} for kind in KINDS}
+        self.ids = IdAllocator(KINDS)
+
+    def __len__(self):
+        return sum(len(annotations) for annotations in self.annotations.values())
+
+    def clear(self):
+        self.fields = {}
+        for annotations in self.annotations.values():
+            annotations.clear()
+        self.ids.reset()
+
+    # Annotations
+
+    def get(self, kind, annotation_id):
+        return self.annotations[kind].get(annotation_id)
+
+    def add(self, kind, annotation):
+        """Store an annotation whose id came from `self.ids.allocate`"""
+        self.ids.observe(kind, annotation[0])
+        self.annotations[kind][annotation[0]] = annotation
+        return annotation
+
+    def replace(self, kind, annotation):
+        """Store an edited annotation, keeping its position in the map"""
+        self.annotations[kind][annotation[0]] = annotation
+        return annotation
+
+    def remove(self, kind, annotation_id):
+        """Remove an annotation, returns it or None"""
+        return self.annotations[kind].pop(annotation_id, None)
+
+    def rename(self, kind, old_id, new_id):
+        """Give an annotation another id, returns the renamed annotation or None"""
+        annotation = self.remove(kind, old_id)
+        if annotation is None:
+            return None
+        return self.add(kind, (new_id,) + tuple(annotation[1:]))
+
+    # Serialization
+
+    def _point(self, x, y, scale=(1.0, 1.0)):
+        """Frame coordinates of a point stored relative to `scale`"""
+        x = x * self.size[0] / scale[0]
+        y = y * self.size[1] / scale[1]
+        if self.integer_coords:
+            return int(x), int(y)
+        return x, y
+
+    def _points(self, entries, scale=(1.0, 1.0), xkey='x', ykey='y'):
+        return [self._point(p[xkey], p[ykey], scale) for p in entries]
+
+    def parse(self, kind, entry, fmt="annotator", pixel_size=None):
+        """Annotation tuple of a file entry, id included
+
+        `pixel_size` is the image size that old curve editor files with pixel
+        coordinates were saved at, the frame size if not given.
+        """
+        pixels = pixel_size or self.size
+        annotation_id = entry['id']
+        if fmt == "annotator":
+            if kind == "keypoint":
+                return (annotation_id,) + self._point(entry['x'], entry['y'])
+            if kind == "bbox":
+                return (annotation_id,) + self._point(entry['x1'], entry['y1']) + self._point(entry['x2'], entry['y2'])
+            points = self._points(entry['points'])
+            if kind == "curve":
+                return annotation_id, points
+            if kind == "freehand":
+                # Older files hold already tessellated points without a smoothing spec
+                return annotation_id, points, entry.get('smoothing')
+            return annotation_id, points, entry['smoothness']
+
+        # Curve editor files, older ones store pixel coordinates
+        if kind == "keypoint":
+            if 'x_norm' in entry:
+                return (annotation_id,) + self._point(entry['x_norm'], entry['y_norm'])
+            return (annotation_id,) + self._point(entry['x'], entry['y'], pixels)
+        if kind == "bbox":
+            if 'x1' in entry:
+                return ((annotation_id,) + self._point(entry['x1'], entry['y1'], pixels)
+                        + self._point(entry['x2'], entry['y2'], pixels))
+            half_w, half_h = entry['width'] / 2, entry['height'] / 2
+            return ((annotation_id,) + self._point(entry['x_center'] - half_w, entry['y_center'] - half_h)
+                    + self._point(entry['x_center'] + half_w, entry['y_center'] + half_h))
+        if 'normalized_points' in entry:
+            points = self._points(entry['normalized_points'], xkey='x_norm', ykey='y_norm')
+        else:
+            points = self._points(entry['points'], pixels)
+        if kind == "curve":
+            return annotation_id, points
+        if kind == "smooth_curve":
+            return annotation_id, points, entry['smoothness']
+        return annotation_id, points, entry.get('smoothing')
+
+    def load(self, data, fmt=None, pixel_size=None):
+        """Replace the annotations with parsed file data, of the detected format if `fmt` is None
+
+        Ids continue after every id in the file, older files that hold an id
+        twice get the later copy renumbered.
+        """
+        self.clear()
+        if not data:
+            return self
+        fmt = fmt or detect_format(data)
+        self.fields = {k: v for k, v in data.items() if k not in _RESERVED}
+        self.ids.restore(data.get('next_ids'))
+        for kind, field in FIELDS.items():
+            for entry in data.get(field, []):
+                self.ids.observe(kind, entry['id'])
+        for kind, field in FIELDS.items():
+            annotations = self.annotations[kind]
+            for entry in data.get(field, []):
+                annotation = self.parse(kind, entry, fmt, pixel_size)
+                annotation_id = self.ids.claim(kind, annotation[0], annotations)
+                annotations[annotation_id] = (annotation_id,) + tuple(annotation[1:])
+        return self
+
+    @classmethod
+    def from_data(cls, data, size=(1, 1), fmt=None, integer_coords=False, pixel_size=None):
+        return cls(size, integer_coords).load(data, fmt, pixel_size)
+
+    def entry(self, kind, annotation, fmt="annotator"):
+        """File entry of an annotation, in coordinates normalized to the 0-1 range"""
+        width, height = self.size
+        annotation_id = annotation[0]
+        if fmt == "curve_enh":
+            if kind == "keypoint":
+                return {'id': annotation_id, 'x_norm': annotation[1] / width, 'y_norm': annotation[2] / height}
+            if kind == "bbox":
+                _, x1, y1, x2, y2 = annotation
+                return {'id': annotation_id, 'x_center': (x1 + x2) / (2 * width),
+                        'y_center': (y1 + y2) / (2 * height),
+                        'width': (x2 - x1) / width, 'height': (y2 - y1) / height}
+            points = [{'x_norm': x / width, 'y_norm': y / height} for x, y in annotation[1]]
+            entry = {'id': annotation_id, 'normalized_points': points}
+        else:
+            if kind == "keypoint":
+                return {'id': annotation_id, 'x': annotation[1] / width, 'y': annotation[2] / height}
+            if kind == "bbox":
+                _, x1, y1, x2, y2 = annotation
+                return {'id': annotation_id, 'x1': x1 / width, 'y1': y1 / height,
+                        'x2': x2 / width, 'y2': y2 / height}
+            points = [{'x': x / width, 'y': y / height} for x, y in annotation[1]]
+            entry = {'id': annotation_id, 'points': points}
+        # Control points are stored together with the smoothing used to tessellate them
+        if kind == "freehand":
+            entry['smoothing'] = annotation[2]
+        elif kind == "smooth_curve":
+            entry['smoothness'] = annotation[2]
+        return entry
+
+    def to_data(self, fmt="annotator"):
+        """File data of the document; kinds the format doesn't know are kept when there are any"""
+        data = dict(self.fields)
+        kinds = [kind for kind in KINDS if kind in FORMAT_KINDS[fmt] or self.annotations[kind]]
+        for kind in kinds:
+            data[FIELDS[kind]] = [self.entry(kind, a, fmt) for a in self.annotations[kind].values()]
+        next_ids = self.ids.state()
+        data['next_ids'] = {kind: next_ids[kind] for kind in kinds}
+        return data
+
+    # Geometry
+
+    def polyline(self, kind, annotation):
+        """Points drawn for a curve-like annotation, after smoothing"""
+        if kind == "freehand":
+            return tessellate_freehand(annotation[1], annotation[2])
+        if kind == "smooth_curve":
+            return smooth_curve_points(annotation[1], annotation[2])
+        return annotation[1]
+
+    def bounds(self, kind, annotation):
+        """(x1, y1, x2, y2) of an annotation in frame coordinates"""
+        if kind == "keypoint":
+            return annotation[1], annotation[2], annotation[1], annotation[2]
+        if kind == "bbox":
+            _, x1, y1, x2, y2 = annotation
+            return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+        points = np.asarray(self.polyline(kind, annotation), dtype=float).reshape(-1, 2)
+        return tuple(float(v) for v in (*points.min(axis=0), *points.max(axis=0)))
+
+    def keypoint_array(self):
+        """(N, 3) array of id, x, y"""
+        return np.array(list(self.annotations["keypoint"].values()), dtype=float).reshape(-1, 3)
+
+    def bbox_array(self):
+        """(N, 5) array of id, x1, y1, x2, y2"""
+        return np.array(list(self.annotations["bbox"].values()), dtype=float).reshape(-1, 5)
+
+    def rescale(self, size):
+        """Move all annotations into a frame of another size"""
+        sx, sy = size[0] / self.size[0], size[1] / self.size[1]
+
+        def point(x, y):
+            x, y = x * sx, y * sy
+            return (int(x), int(y)) if self.integer_coords else (x, y)
+
+        for kind, annotations in self.annotations.items():
+            for annotation_id, annotation in annotations.items():
+                if kind == "keypoint":
+                    annotations[annotation_id] = (annotation_id,) + point(*annotation[1:])
+                elif kind == "bbox":
+                    annotations[annotation_id] = (annotation_id,) + point(*annotation[1:3]) + point(*annotation[3:])
+                else:
+                    annotations[annotation_id] = ((annotation_id, [point(x, y) for x, y in annotation[1]])
+                                                  + tuple(annotation[2:]))
+        self.size = size
@@ -0,0 +1,49 @@
+class IdAllocator:
+    """Monotonic per-kind annotation ids for one image
+
+    Ids are never handed out twice, not even after the annotation holding
+    one was deleted, so canvas tags and list rows derived from them cannot
+    collide. The next free id of every kind is saved in the annotation file
+    so ids stay unique across sessions.
+    """
+
+    def __init__(self, kinds):
+        self.kinds = tuple(kinds)
+        self.next_ids = dict.fromkeys(self.kinds, 1)
+
+    def reset(self):
+        """Start over for a new image"""
+        self.next_ids = dict.fromkeys(self.kinds, 1)
+
+    def allocate(self, kind):
+        """Return a new id for an annotation of the given kind"""
+        annotation_id = self.next_ids[kind]
+        self.next_ids[kind] = annotation_id + 1
+        return annotation_id
+
+    def observe(self, kind, annotation_id):
+        """Make sure an existing id is never allocated again"""
+        if isinstance(annotation_id, int) and annotation_id >= self.next_ids[kind]:
+            self.next_ids[kind] = annotation_id + 1
+
+    def claim(self, kind, annotation_id, taken):
+        """Id to use for a loaded annotation, renumbering duplicates
+
+        Files written before ids were allocated this way can hold the same
+        id twice; the later copy gets a fresh id. Call `observe` for all
+        ids of the kind first so the fresh id is past every loaded one.
+        """
+        if annotation_id in taken:
+            return self.allocate(kind)
+        self.observe(kind, annotation_id)
+        return annotation_id
+
+    def state(self):
+        """Next ids as stored in the annotation file"""
+        return dict(self.next_ids)
+
+    def restore(self, state):
+        """Continue from next ids stored in an annotation file"""
+        for kind, next_id in (state or {}).items():
+            if kind in self.next_ids and isinstance(next_id, int):
+                self.next_ids[kind] = max(self.next_ids[kind], next_id)
@@ -0,0 +1,389 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from PIL import Image
+
+from annotation_ids import IdAllocator
+from instrumentation import tracer
+from startup import lazy_import
+
+array_sources = lazy_import("array_sources")
+
+# Files of these formats can hold several frames, every frame is a dataset entry
+MULTI_FRAME_EXTENSIONS = ('.tif', '.tiff', '.gif', '.webp')
+# NumPy arrays and raw binary files with a JSON sidecar, read memory-mapped, see array_sources
+ARRAY_EXTENSIONS = ('.npy', '.npz', '.raw')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png') + MULTI_FRAME_EXTENSIONS + ARRAY_EXTENSIONS
+# Modes of 16-bit and float images, displayed as mode F and windowed to 8 bits, see windowing
+HIGH_BIT_MODES = ("I", "F", "I;16", "I;16B", "I;16L", "I;16N")
+_FRAME_ENTRY = re.compile(r"(.+(?:%s))#(\d+)$" % "|".join(re.escape(e) for e in
+                                                          MULTI_FRAME_EXTENSIONS + ARRAY_EXTENSIONS),
+                          re.IGNORECASE)
+
+# Annotation file field of every annotation kind
+ANNOTATION_FIELDS = {
+    "keypoint": 'keypoints',
+    "curve": 'curves',
+    "bbox": 'bboxes',
+    "freehand": 'freehand_curves',
+}
+
+
+def find_images_dir(dataset_path):
+    """Images live in an images/ subdirectory, or directly in the dataset"""
+    images_dir = os.path.join(dataset_path, "images")
+    if not os.path.exists(images_dir):
+        images_dir = dataset_path  # Fallback to selected directory
+    return images_dir
+
+
+def frame_entry(path, frame):
+    """Dataset entry of one frame of a multi-frame file, "<path>#<frame index>" """
+    return f"{path}#{frame}"
+
+
+def split_frame(entry):
+    """(file, frame index) of a dataset entry, the frame index is None for single images"""
+    match = _FRAME_ENTRY.match(entry)
+    if match is None:
+        return entry, None
+    return match.group(1), int(match.group(2))
+
+
+def is_array_source(entry):
+    """Whether a dataset entry is read from an array file rather than by Pillow"""
+    return split_frame(entry)[0].lower().endswith(ARRAY_EXTENSIONS)
+
+
+def frame_count(path):
+    """Number of frames of an image or array file, only headers are read"""
+    try:
+        if is_array_source(path):
+            return array_sources.frame_count(path)
+        with Image.open(path) as image:
+            return getattr(image, "n_frames", 1)
+    except (OSError, ValueError):
+        return 1  # Reported when the image is opened
+
+
+def list_images(dataset_path):
+    """Sorted entries of all images in a dataset
+
+    Multi-frame files (TIFF stacks, animated GIF and WebP, stacked arrays)
+    contribute one entry per frame, see `frame_entry`.
+    """
+    images_dir = find_images_dir(dataset_path)
+    entries = []
+    for path in sorted(os.path.join(images_dir, f) for f in os.listdir(images_dir)
+                       if f.lower().endswith(IMAGE_EXTENSIONS)):
+        frames = frame_count(path) if path.lower().endswith(MULTI_FRAME_EXTENSIONS + ARRAY_EXTENSIONS) else 1
+        if frames > 1:
+            entries.extend(frame_entry(path, frame) for frame in range(frames))
+        else:
+            entries.append(path)
+    return entries
+
+
+def image_stem(entry):
+    """Name of the annotation and label files of an entry, frames get their index appended"""
+    path, frame = split_frame(entry)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return stem if frame is None else f"{stem}_frame{frame:05d}"
+
+
+def annotation_path(dataset_path, image_path):
+    """Annotation file of an image, annotations/<image name>.json"""
+    return os.path.join(dataset_path, "annotations", f"{image_stem(image_path)}.json")
+
+
+class FrameFiles:
+    """Multi-frame files kept open between frames
+
+    Seeking an open file to a nearby frame is cheap, while reopening it
+    means walking the TIFF directories or decoding the GIF from its first
+    frame again. Frames are returned as decoded copies, the open files are
+    only touched under the lock.
+    """
+
+    def __init__(self, max_files=8):
+        self.max_files = max_files
+        self._files = OrderedDict()
+        self._lock = threading.Lock()
+
+    def frame(self, path, index):
+        with self._lock:
+            image = self._files.get(path)
+            if image is None:
+                image = self._files[path] = Image.open(path)
+                while len(self._files) > self.max_files:
+                    self._files.popitem(last=False)[1].close()
+            else:
+                self._files.move_to_end(path)
+            image.seek(index)
+            return image.copy()
+
+    def close(self):
+        with self._lock:
+            for image in self._files.values():
+                image.close()
+            self._files.clear()
+
+
+frame_files = FrameFiles()
+
+
+def open_image(entry, max_size=None):
+    """PIL image of a dataset entry, frames of multi-frame files are decoded right away
+
+    Arrays are subsampled to about `max_size` (width, height) while they
+    are read, other images are returned at full size.
+    """
+    path, frame = split_frame(entry)
+    if is_array_source(path):
+        return array_sources.read_image(path, frame, *(max_size or (None, None)))[0]
+    if frame is None:
+        return Image.open(path)
+    return frame_files.frame(path, frame)
+
+
+def image_size(entry):
+    """(width, height) of a dataset entry, from the file headers"""
+    path, frame = split_frame(entry)
+    if is_array_source(path):
+        return array_sources.image_size(path, frame)
+    with Image.open(path) as image:
+        if frame is not None:
+            image.seek(frame)
+        return image.size
+
+
+def load_display_image(path, max_width=None, max_height=None):
+    """Decode an image and scale it to fit the given size
+
+    Returns (display image, original size). The image is fully decoded here
+    so that nothing is read from disk later on the Tk thread. Images of a
+    high bit depth are returned as mode F with their original values.
+    """
+    with tracer.span("decode"):
+        if isinstance(path, str) and is_array_source(path):
+            # Only the rows and columns needed at this size are read from the array
+            image, original_size = array_sources.read_image(*split_frame(path), max_width, max_height,
+                                                            keep_depth=True)
+        else:
+            image = open_image(path) if isinstance(path, str) else Image.open(path)
+            original_size = image.size
+        if max_width and max_height and max_width > 10 and max_height > 10:
+            # JPEGs can be decoded at 1/2, 1/4 or 1/8 scale, much faster for large photos
+            image.draft(image.mode, (max_width, max_height))
+        image.load()
+        if image.mode in HIGH_BIT_MODES:
+            # Resized as floats, 8-bit conversions would clip 16-bit values
+            image = image.convert("F")
+    if max_width and max_height and max_width > 10 and max_height > 10:
+        scale = min(max_width / image.width, max_height / image.height)
+        with tracer.span("resize"):
+            image = image.resize((int(image.width * scale), int(image.height * scale)), Image.LANCZOS)
+    return image, original_size
+
+
+@tracer.traced("read_annotations")
+def read_annotation_file(path):
+    """Parsed annotation file, or None if there is none yet"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+@tracer.traced("write_annotations")
+def write_annotation_file(path, data):
+    """Write an annotation file atomically
+
+    The data goes to a temporary file which then replaces the old one, so
+    concurrent readers see either the old or the new annotations in full.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def yolo_lines(data):
+    """YOLO label lines for the bounding boxes of an annotation file
+
+    Boxes are stored normalized to the image size, so no image has to be
+    opened to convert them.
+    """
+    lines = []
+    for bbox in data.get('bboxes', []):
+        x_center = (bbox['x1'] + bbox['x2']) / 2
+        y_center = (bbox['y1'] + bbox['y2']) / 2
+        width = bbox['x2'] - bbox['x1']
+        height = bbox['y2'] - bbox['y1']
+        lines.append(f"0 {x_center:.6f} {y_center:.6f} {width:.6f} {height:.6f}\n")
+    return lines
+
+
+def write_yolo_file(path, lines):
+    """Write YOLO label lines for one image"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.writelines(lines)
+    return path
+
+
+def export_yolo(dataset_path, image_path, data=None):
+    """Export the boxes of one image to yolo_annotations/, returns True if written"""
+    if data is None:
+        data = read_annotation_file(annotation_path(dataset_path, image_path))
+    lines = yolo_lines(data) if data else []
+    if not lines:
+        return False
+    write_yolo_file(os.path.join(dataset_path, "yolo_annotations", f"{image_stem(image_path)}.txt"), lines)
+    return True
+
+
+class ConflictError(Exception):
+    """The annotation file changed since it was loaded, `theirs` holds its data"""
+
+    def __init__(self, path, theirs):
+        super().__init__(f"{os.path.basename(path)} was changed by another annotator")
+        self.path = path
+        self.theirs = theirs
+
+
+def file_revision(data):
+    """Revision counter of annotation data, files without one are revision 0"""
+    if not data:
+        return 0
+    return data.get('revision', 0)
+
+
+@contextmanager
+def save_lock(path, timeout=10.0, stale_after=60.0):
+    """Hold <path>.lock while checking and replacing an annotation file
+
+    The lock file is created with O_EXCL like the leases, which also works
+    on NFS, so two annotators can't both pass the revision check before
+    either has written. A lock older than `stale_after` seconds was left by
+    a crashed writer and is broken. Raises TimeoutError if the lock can't
+    be taken within `timeout` seconds.
+    """
+    lock_path = f"{path}.lock"
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(lock_path).st_mtime > stale_after:
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                continue  # Released meanwhile
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{os.path.basename(path)} is being saved by another annotator, try again")
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
+
+
+def write_annotation_file_checked(path, data, base_revision):
+    """Write annotation data unless someone else saved since `base_revision`
+
+    This is the optimistic version check for shared datasets: the new data
+    gets the next revision, and ConflictError is raised instead of writing
+    when the file on disk no longer has the revision the edit started from.
+    The check and the write happen under `save_lock`.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with save_lock(path):
+        theirs = read_annotation_file(path)
+        if file_revision(theirs) != base_revision:
+            raise ConflictError(path, theirs)
+        data['revision'] = base_revision + 1
+        return write_annotation_file(path, data)
+
+
+def _same_entry(a, b, tolerance=2e-3):
+    """Compare annotation entries, ignoring the rounding of display coordinates"""
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(_same_entry(a[k], b[k], tolerance) for k in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(_same_entry(x, y, tolerance) for x, y in zip(a, b))
+    if isinstance(a, float) or isinstance(b, float):
+        return isinstance(a, (int, float)) and isinstance(b, (int, float)) and abs(a - b) <= tolerance
+    return a == b
+
+
+def merge_annotation_data(base, mine, theirs):
+    """Three-way merge of annotation data by annotation id
+
+    `base` is what both sides started from. Additions of both sides are
+    kept (ours are renumbered if the id was taken meanwhile) and deletions
+    win over unchanged annotations. Where both sides changed an annotation
+    our version wins, and where one side changed what the other deleted the
+    changed version is kept, whichever side it is. Returns the merged data
+    and the number of such conflicts.
+    """
+    base, theirs = base or {}, theirs or {}
+    merged = dict(theirs)
+    merged.update({key: value for key, value in mine.items() if key not in ANNOTATION_FIELDS})
+    ids = IdAllocator(ANNOTATION_FIELDS)
+    for side in (base, mine, theirs):
+        ids.restore(side.get('next_ids'))
+    conflicts = 0
+
+    for kind, field in ANNOTATION_FIELDS.items():
+        base_entries = {e['id']: e for e in base.get(field, [])}
+        my_entries = {e['id']: e for e in mine.get(field, [])}
+        their_entries = {e['id']: e for e in theirs.get(field, [])}
+        for entries in (base_entries, my_entries, their_entries):
+            for annotation_id in entries:
+                ids.observe(kind, annotation_id)
+
+        result = []
+        for annotation_id, theirs_entry in their_entries.items():
+            if annotation_id not in base_entries:
+                result.append(theirs_entry)  # Added by them
+                continue
+            base_entry = base_entries[annotation_id]
+            they_changed = not _same_entry(theirs_entry, base_entry)
+            if annotation_id not in my_entries:
+                # Deleted by us, unless they changed it in the meantime
+                if they_changed:
+                    result.append(theirs_entry)
+                    conflicts += 1
+                continue
+            i_changed = not _same_entry(my_entries[annotation_id], base_entry)
+            if i_changed and they_changed:
+                conflicts += 1
+            result.append(my_entries[annotation_id] if i_changed else theirs_entry)
+
+        for annotation_id, my_entry in my_entries.items():
+            if annotation_id in base_entries:
+                if annotation_id not in their_entries and not _same_entry(my_entry, base_entries[annotation_id]):
+                    result.append(my_entry)  # We changed what they deleted
+                    conflicts += 1
+                continue
+            if annotation_id in their_entries:
+                my_entry = dict(my_entry, id=ids.allocate(kind))
+            result.append(my_entry)  # Added by us
+
+        merged[field] = result
+    merged['next_ids'] = ids.state()
+    merged['revision'] = file_revision(theirs)
+    return merged, conflicts
@@ -0,0 +1,212 @@
+class AnnotationList:
+    """Treeview rows kept in sync with annotations, keyed by annotation id
+
+    Rows are inserted, updated and removed one at a time instead of
+    rebuilding the whole Treeview. Once a list grows beyond
+    `virtual_threshold` rows it switches to a virtualized mode where only the
+    rows in view are materialized and the scrollbar is driven by the list
+    itself, so very long lists cost the same as short ones to update.
+
+    A list can be created without a Treeview, e.g. for a tab that was not
+    built yet; it only keeps its rows until `attach` gives it one.
+    """
+
+    def __init__(self, tree=None, scrollbar=None, virtual_threshold=500):
+        self.tree = None
+        self.scrollbar = None
+        self.virtual_threshold = virtual_threshold
+        self.rows = {}  # key -> row values, in display order
+        self.key_to_iid = {}
+        self.iid_to_key = {}
+        self.virtual = False
+        self.top = 0
+        self.selected = None
+        self._order = None  # Cached list(self.rows) for windowing, rebuilt lazily
+        if tree is not None:
+            self.attach(tree, scrollbar)
+
+    def attach(self, tree, scrollbar):
+        """Show the list in a Treeview, materializing the rows kept so far"""
+        self.tree = tree
+        self.scrollbar = scrollbar
+        self.tree.bind("<<TreeviewSelect>>", self._on_select, add="+")
+        self.tree.bind("<MouseWheel>", self._on_wheel, add="+")
+        self.tree.bind("<Button-4>", lambda e: self._scroll_by(-3), add="+")
+        self.tree.bind("<Button-5>", lambda e: self._scroll_by(3), add="+")
+        self.tree.bind("<Configure>", lambda e: self.virtual and self._render_window(), add="+")
+        selected = self.selected
+        self.set_rows(self.rows)
+        if selected is not None:
+            self.select(selected)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def _insert_row(self, key, values):
+        """Materialize a row in the Treeview"""
+        iid = self.tree.insert("", "end", values=values)
+        self.key_to_iid[key] = iid
+        self.iid_to_key[iid] = key
+        return iid
+
+    def _clear_tree(self):
+        """Remove all materialized rows"""
+        self.tree.delete(*self.tree.get_children())
+        self.key_to_iid = {}
+        self.iid_to_key = {}
+
+    def clear(self):
+        """Remove all rows"""
+        self.rows = {}
+        self._order = None
+        self.selected = None
+        self.top = 0
+        if self.tree is None:
+            return
+        self._clear_tree()
+        self._set_virtual(False)
+
+    def set_rows(self, rows):
+        """Replace the list contents with (key, values) pairs"""
+        rows = dict(rows)
+        self.clear()
+        self.rows = rows
+        if self.tree is None:
+            return
+        if len(self.rows) > self.virtual_threshold:
+            self._set_virtual(True)
+        else:
+            for key, values in self.rows.items():
+                self._insert_row(key, values)
+
+    def add(self, key, values):
+        """Append a row for a new annotation"""
+        self.rows[key] = values
+        self._order = None
+        if self.tree is None:
+            return
+        if self.virtual:
+            self._render_window()
+        elif len(self.rows) > self.virtual_threshold:
+            self._set_virtual(True)
+        else:
+            self._insert_row(key, values)
+
+    def update(self, key, values):
+        """Refresh the values of one row"""
+        if key not in self.rows:
+            return
+        self.rows[key] = values
+        if self.tree is None:
+            return
+        iid = self.key_to_iid.get(key)
+        if iid is not None:
+            self.tree.item(iid, values=values)
+
+    def remove(self, key):
+        """Remove the row of a deleted annotation"""
+        if self.rows.pop(key, None) is None:
+            return
+        self._order = None
+        if self.selected == key:
+            self.selected = None
+        if self.tree is None:
+            return
+        if self.virtual:
+            self._render_window()
+            return
+        iid = self.key_to_iid.pop(key, None)
+        if iid is not None:
+            del self.iid_to_key[iid]
+            self.tree.delete(iid)
+
+    def selected_key(self):
+        """Key of the selected row, or None"""
+        return self.selected
+
+    def select(self, key):
+        """Select a row and scroll it into view"""
+        if key not in self.rows:
+            return
+        self.selected = key
+        if self.tree is None:
+            return
+        if self.virtual:
+            index = self._keys().index(key)
+            if not self.top <= index < self.top + self._visible_rows():
+                self.top = index
+            self._render_window()
+            return
+        iid = self.key_to_iid[key]
+        self.tree.selection_set(iid)
+        self.tree.see(iid)
+
+    def _on_select(self, event=None):
+        """Track the selection by key so it survives re-rendering"""
+        selection = self.tree.selection()
+        if selection and selection[0] in self.iid_to_key:
+            self.selected = self.iid_to_key[selection[0]]
+
+    # Virtualized mode
+
+    def _keys(self):
+        """Row keys in display order"""
+        if self._order is None:
+            self._order = list(self.rows)
+        return self._order
+
+    def _visible_rows(self):
+        """Number of rows that fit into the Treeview"""
+        height = self.tree.winfo_height()
+        if height > 40:
+            return max(height // 20, 1)
+        return int(self.tree.cget("height"))
+
+    def _set_virtual(self, enabled):
+        """Switch between materializing all rows and only the visible ones"""
+        if enabled == self.virtual:
+            return
+        self.virtual = enabled
+        if enabled:
+            self.scrollbar.configure(command=self._on_scrollbar)
+            self.tree.configure(yscrollcommand="")
+            self._render_window()
+        else:
+            self.scrollbar.configure(command=self.tree.yview)
+            self.tree.configure(yscrollcommand=self.scrollbar.set)
+
+    def _render_window(self):
+        """Materialize only the rows currently in view"""
+        keys = self._keys()
+        rows = self._visible_rows()
+        self.top = max(0, min(self.top, len(keys) - rows))
+        self._clear_tree()
+        for key in keys[self.top:self.top + rows]:
+            iid = self._insert_row(key, self.rows[key])
+            if key == self.selected:
+                self.tree.selection_set(iid)
+        if keys:
+            self.scrollbar.set(self.top / len(keys), min((self.top + rows) / len(keys), 1.0))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def _scroll_by(self, rows):
+        """Move the window by a number of rows"""
+        if self.virtual:
+            self.top += rows
+            self._render_window()
+            return "break"
+
+    def _on_wheel(self, event):
+        """Mouse wheel scrolling in virtualized mode"""
+        return self._scroll_by(-3 if event.delta > 0 else 3)
+
+    def _on_scrollbar(self, *args):
+        """Scrollbar commands in virtualized mode"""
+        rows = self._visible_rows()
+        if args[0] == "moveto":
+            self.top = int(float(args[1]) * len(self.rows))
+        elif args[0] == "scroll":
+            step = rows if args[2] == "pages" else 1
+            self.top += int(args[1]) * step
+        self._render_window()
@@ -0,0 +1,325 @@
+import json
+import os
+import re
+
+import numpy as np
+
+import annotation_io
+from annotation_io import ANNOTATION_FIELDS
+from dataset_index import DatasetIndex, file_stats, index_lock
+from jobs import run_chunks
+
+# Columns of the annotation index, see `annotation_stats`. Areas and lengths
+# are NaN for images without boxes or curves, so comparisons with them fail
+STAT_COLUMNS = {
+    'keypoint': np.int32, 'curve': np.int32, 'bbox': np.int32, 'freehand': np.int32,
+    'width': np.int32, 'height': np.int32,
+    'bbox_area_min': np.float32, 'bbox_area_max': np.float32, 'bbox_area_mean': np.float32,
+    'curve_length_max': np.float32, 'curve_length_total': np.float32,
+}
+# Computed from the stored columns when a query uses them
+DERIVED_COLUMNS = ("annotations", "annotated")
+COLUMNS = tuple(STAT_COLUMNS) + DERIVED_COLUMNS
+
+
+class QueryError(ValueError):
+    """A filter expression that can't be parsed or names an unknown column"""
+
+
+def annotation_stats(data):
+    """Index row of one annotation file
+
+    Counts per kind, the image size saved with the annotations, bbox areas
+    as a fraction of the image and the lengths of curves and freehand
+    control polygons in original image pixels (in normalized units when the
+    file has no image size).
+    """
+    stats = {key: _empty(dtype) for key, dtype in STAT_COLUMNS.items()}
+    if not data:
+        return stats
+    for kind, field in ANNOTATION_FIELDS.items():
+        stats[kind] = len(data.get(field, []))
+    width, height = data.get('image_width') or 0, data.get('image_height') or 0
+    stats['width'], stats['height'] = width, height
+
+    boxes = np.array([[b['x1'], b['y1'], b['x2'], b['y2']] for b in data.get('bboxes', [])],
+                     dtype=float).reshape(-1, 4)
+    if len(boxes):
+        areas = np.abs((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]))
+        stats.update(bbox_area_min=areas.min(), bbox_area_max=areas.max(), bbox_area_mean=areas.mean())
+
+    scale = np.array([width or 1, height or 1], dtype=float)
+    lengths = []
+    for field, closed in (('curves', True), ('freehand_curves', False)):
+        for curve in data.get(field, []):
+            points = np.array([(p['x'], p['y']) for p in curve['points']], dtype=float).reshape(-1, 2) * scale
+            if closed and len(points) > 2:
+                points = np.vstack([points, points[:1]])
+            lengths.append(np.hypot(*np.diff(points, axis=0).T).sum())
+    if lengths:
+        stats.update(curve_length_max=max(lengths), curve_length_total=sum(lengths))
+    return stats
+
+
+def _empty(dtype):
+    return np.nan if np.issubdtype(dtype, np.floating) else 0
+
+
+def _empty_columns(rows):
+    return {key: np.full(rows, _empty(dtype), dtype=dtype) for key, dtype in STAT_COLUMNS.items()}
+
+
+def index_chunk(dataset_path, images):
+    """Stat columns of some images, runs in a worker process
+
+    Returns the columns and (row, message) of files that couldn't be read.
+    """
+    columns = _empty_columns(len(images))
+    errors = []
+    for row, img_path in enumerate(images):
+        try:
+            with open(annotation_io.annotation_path(dataset_path, img_path), 'r') as f:
+                stats = annotation_stats(json.load(f))
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            errors.append((row, str(e)))
+            continue
+        for key, value in stats.items():
+            columns[key][row] = value
+    return columns, errors
+
+
+def index_annotations_job(job, dataset_path, images, workers=None, chunk_size=1000):
+    """Bring the annotation columns of the dataset index up to date, returns the index
+
+    Annotation files are only read again when their modification time
+    changed, many changed files are read across a process pool.
+    """
+    with index_lock:
+        index = DatasetIndex.open(dataset_path)
+        known = index.reindex([os.path.basename(p) for p in images])
+        mtimes, _ = file_stats([annotation_io.annotation_path(dataset_path, p) for p in images])
+        if 'ann_mtime' in index:
+            fresh = known & (index['ann_mtime'] == mtimes)
+        else:
+            fresh = np.zeros(len(images), dtype=bool)
+            for key, values in _empty_columns(len(images)).items():
+                index[key] = values
+        # Images without annotations have nothing to read
+        fresh |= mtimes < 0
+        index['ann_mtime'] = mtimes
+        for key, dtype in STAT_COLUMNS.items():
+            index[key][mtimes < 0] = _empty(dtype)
+
+        stale = np.flatnonzero(~fresh)
+        job.step(len(images) - len(stale))
+        chunk_rows = [stale[start:start + chunk_size] for start in range(0, len(stale), chunk_size)]
+        run_chunks(job, index_chunk, [(dataset_path, [images[i] for i in rows]) for rows in chunk_rows],
+                   lambda chunk, result: _store_chunk(job, index, images, chunk_rows[chunk], *result), workers)
+        if len(stale):
+            index.save()
+    return index
+
+
+def _store_chunk(job, index, images, rows, columns, errors):
+    for key, values in columns.items():
+        index[key][rows] = values
+    for row, message in errors:
+        # Read again next time
+        index['ann_mtime'][rows[row]] = -2
+        job.log_error(os.path.basename(images[rows[row]]), message)
+    job.step(len(rows))
+
+
+def update_row(index, name, data, mtime=None):
+    """Refresh the row of an image after its annotations were saved"""
+    rows = np.flatnonzero(index['name'] == name)
+    if not len(rows):
+        return
+    for key, value in annotation_stats(data).items():
+        index[key][rows[0]] = value
+    # A different mtime than the file's makes the next indexing run read it again
+    index['ann_mtime'][rows[0]] = -2 if mtime is None else mtime
+
+
+def column(index, name):
+    """A stored or derived column of the index"""
+    if name == "annotations":
+        return sum(index[kind].astype(np.int64) for kind in ANNOTATION_FIELDS)
+    if name == "annotated":
+        return column(index, "annotations") > 0
+    if name not in STAT_COLUMNS:
+        raise QueryError(f"Unknown column {name!r}, use one of: {', '.join(COLUMNS)}")
+    return index[name]
+
+
+# Filter expressions
+
+_TOKEN = re.compile(r"\s*(?:(\d+\.?\d*(?:[eE][-+]?\d+)?|\.\d+)|([A-Za-z_]\w*)|(<=|>=|==|!=|[<>=()+\-*/]))")
+_COMPARISONS = {
+    "<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal,
+    "==": np.equal, "=": np.equal, "!=": np.not_equal,
+}
+_ARITHMETIC = {"+": np.add, "-": np.subtract, "*": np.multiply, "/": np.true_divide}
+
+
+def tokenize(text):
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN.match(text, position)
+        if match is None:
+            raise QueryError(f"Unexpected {text[position:].strip()[:10]!r}")
+        number, name, operator = match.groups()
+        if number is not None:
+            tokens.append(("number", float(number)))
+        elif name is not None:
+            tokens.append(("keyword", name.lower()) if name.lower() in ("and", "or", "not") else ("name", name))
+        else:
+            tokens.append(("op", operator))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    """Recursive descent parser building a function of the index
+
+        expr        := and ("or" and)*
+        and         := not ("and" not)*
+        not         := "not" not | comparison
+        comparison  := sum [("<" | "<=" | ">" | ">=" | "==" | "=" | "!=") sum]
+        sum         := term (("+" | "-") term)*
+        term        := factor (("*" | "/") factor)*
+        factor      := number | column | "(" expr ")" | "-" factor
+
+    A column or sum on its own in a boolean context means "is not zero".
+    """
+
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if token[0] is None or (kind and token[0] != kind) or (value and token[1] != value):
+            return None
+        self.position += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise QueryError("Empty query")
+        node = self.expr()
+        if self.peek()[0] is not None:
+            raise QueryError(f"Unexpected {self.peek()[1]!r}")
+        return lambda index: _truth(node(index))
+
+    def expr(self):
+        node = self.conjunction()
+        while self.take("keyword", "or"):
+            left, right = node, self.conjunction()
+            node = lambda index, left=left, right=right: _truth(left(index)) | _truth(right(index))
+        return node
+
+    def conjunction(self):
+        node = self.negation()
+        while self.take("keyword", "and"):
+            left, right = node, self.negation()
+            node = lambda index, left=left, right=right: _truth(left(index)) & _truth(right(index))
+        return node
+
+    def negation(self):
+        if self.take("keyword", "not"):
+            operand = self.negation()
+            return lambda index: ~_truth(operand(index))
+        return self.comparison()
+
+    def comparison(self):
+        node = self.sum()
+        token = self.peek()
+        if token[0] == "op" and token[1] in _COMPARISONS:
+            self.position += 1
+            compare, left, right = _COMPARISONS[token[1]], node, self.sum()
+            node = lambda index: compare(left(index), right(index))
+        return node
+
+    def sum(self):
+        node = self.term()
+        while self.peek()[0] == "op" and self.peek()[1] in "+-":
+            operation, left, right = _ARITHMETIC[self.take()[1]], node, self.term()
+            node = lambda index, operation=operation, left=left, right=right: operation(left(index), right(index))
+        return node
+
+    def term(self):
+        node = self.factor()
+        while self.peek()[0] == "op" and self.peek()[1] in "*/":
+            operation, left, right = _ARITHMETIC[self.take()[1]], node, self.factor()
+            node = lambda index, operation=operation, left=left, right=right: operation(left(index), right(index))
+        return node
+
+    def factor(self):
+        token = self.take()
+        if token is None:
+            raise QueryError("Query ends too early")
+        kind, value = token
+        if kind == "number":
+            return lambda index: value
+        if kind == "name":
+            if value not in COLUMNS:
+                raise QueryError(f"Unknown column {value!r}, use one of: {', '.join(COLUMNS)}")
+            return lambda index: column(index, value)
+        if value == "(":
+            node = self.expr()
+            if not self.take("op", ")"):
+                raise QueryError("Missing )")
+            return node
+        if value == "-":
+            operand = self.factor()
+            return lambda index: -operand(index)
+        raise QueryError(f"Unexpected {value!r}")
+
+
+def _truth(values):
+    values = np.asarray(values)
+    return values if values.dtype == bool else values != 0
+
+
+def compile_query(text):
+    """Function of an index returning the mask of matching rows, e.g.
+
+        bbox > 10
+        freehand and not bbox
+        bbox_area_min * width * height < 100 or curve_length_max > 2000
+    """
+    return _Parser(text).parse()
+
+
+def run_query(index, text):
+    """Rows of the index matching a filter expression"""
+    query = compile_query(text)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mask = np.broadcast_to(query(index), (len(index),))
+    return np.flatnonzero(mask)
+
+
+def histogram(index, name, rows=None, bins=10):
+    """(label, count) pairs of a column, per value for counts and in `bins` ranges otherwise"""
+    values = column(index, name)
+    if rows is not None:
+        values = values[rows]
+    if not len(values):
+        return []
+    if values.dtype.kind == "f":
+        values = values[~np.isnan(values)]
+    if not len(values):
+        return []
+    if values.dtype.kind in "biu" and values.max() - values.min() <= 50:
+        counts = np.bincount(values.astype(np.int64) - values.min())
+        return [(str(values.min() + value), int(count)) for value, count in enumerate(counts) if count]
+    counts, edges = np.histogram(values, bins=bins)
+    return [(f"{lo:.4g} - {hi:.4g}", int(count)) for lo, hi, count in zip(edges[:-1], edges[1:], counts)]
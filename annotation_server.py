@@ -0,0 +1,385 @@
+import argparse
+import copy
+import io
+import json
+import mimetypes
+import os
+import socket
+import sys
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+import annotation_io
+from annotation_io import ANNOTATION_FIELDS
+from annotation_ids import IdAllocator
+
+
+class Conflict(Exception):
+    """The operation changes an annotation that no longer exists"""
+
+
+class StoredAnnotations:
+    """Annotations of one image held by the server, entries indexed by id
+
+    `base` is the file data the operations are applied on top of and
+    `revision` its revision, the next flush writes revision + 1.
+    """
+
+    def __init__(self, data):
+        data = data or {}
+        self.base = copy.deepcopy(data)
+        self.fields = {k: v for k, v in data.items()
+                       if k not in ANNOTATION_FIELDS.values() and k not in ('next_ids', 'revision')}
+        self.entries = {kind: {e['id']: e for e in data.get(field, [])}
+                        for kind, field in ANNOTATION_FIELDS.items()}
+        self.ids = IdAllocator(ANNOTATION_FIELDS)
+        self.ids.restore(data.get('next_ids'))
+        for kind, entries in self.entries.items():
+            for annotation_id in entries:
+                self.ids.observe(kind, annotation_id)
+        self.revision = annotation_io.file_revision(data)
+
+    def to_data(self):
+        data = dict(self.fields)
+        for kind, field in ANNOTATION_FIELDS.items():
+            data[field] = list(self.entries[kind].values())
+        data['next_ids'] = self.ids.state()
+        data['revision'] = self.revision
+        return data
+
+    def apply(self, op):
+        """Apply one delta operation, returns the id it ended up with
+
+        Adds keep the client's id when it is free so the client doesn't
+        have to rename anything; otherwise a fresh id is returned. Updates
+        of annotations that were deleted, or never added, raise Conflict:
+        only adds create annotations, so every id went through `ids`.
+        """
+        if op['op'] == "fields":
+            self.fields.update(op['fields'])
+            return None
+
+        kind = op['kind']
+        entries = self.entries[kind]
+        if op['op'] == "delete":
+            entries.pop(op['id'], None)
+            annotation_id = op['id']
+        elif op['op'] == "add":
+            entry = dict(op['entry'])
+            if entry.get('id') in entries or not isinstance(entry.get('id'), int):
+                entry['id'] = self.ids.allocate(kind)
+            self.ids.observe(kind, entry['id'])
+            entries[entry['id']] = entry
+            annotation_id = entry['id']
+        elif op['op'] == "update":
+            entry = op['entry']
+            if entry['id'] not in entries:
+                raise Conflict(f"{kind} {entry['id']} was deleted by another annotator")
+            entries[entry['id']] = entry
+            annotation_id = entry['id']
+        else:
+            raise ValueError(f"Unknown operation: {op['op']}")
+        return annotation_id
+
+
+class ClientLog:
+    """Operations of one client the server applied, by sequence number
+
+    Clients send one batch at a time in sequence order, so everything up to
+    `last_seq` was applied. A batch sent again after its answer was lost
+    gets the results of the first time instead of being applied twice.
+
+    Adds that got another id than the client's are remembered until the
+    client has seen their answer (an operation's `acked`). Until then the
+    client's operations still use its own id and are moved to the new one.
+    """
+
+    def __init__(self, keep=10000):
+        self.last_seq = 0
+        self.results = OrderedDict()
+        self.keep = keep
+        self.acked = 0
+        self.renamed = {}  # (image, kind, client's id) -> (seq of the add, id it got)
+
+    def translate(self, op):
+        """The operation with ids of adds the client didn't know were renamed replaced"""
+        acked = op.get('acked', 0)
+        if acked > self.acked:
+            self.acked = acked
+            self.renamed = {key: value for key, value in self.renamed.items() if value[0] > acked}
+        if not self.renamed:
+            return op
+
+        def server_id(annotation_id):
+            renamed = self.renamed.get((op.get('image'), op.get('kind'), annotation_id))
+            return renamed[1] if renamed is not None and renamed[0] > acked else annotation_id
+
+        if op.get('op') == "delete" and 'id' in op:
+            return dict(op, id=server_id(op['id']))
+        if op.get('op') == "update" and isinstance(op.get('entry'), dict) and 'id' in op['entry']:
+            return dict(op, entry=dict(op['entry'], id=server_id(op['entry']['id'])))
+        return op
+
+    def renamed_add(self, op, seq, annotation_id):
+        self.renamed[(op['image'], op['kind'], op['entry']['id'])] = (seq, annotation_id)
+
+    def record(self, seq, result):
+        self.last_seq = seq
+        self.results[seq] = result
+        while len(self.results) > self.keep:
+            self.results.popitem(last=False)
+
+
+class AnnotationStore:
+    """Owns the annotation files of a dataset for the server
+
+    Documents are loaded on first use and kept in memory; operations only
+    touch the in-memory index and mark the document dirty, a flusher thread
+    writes dirty documents back to their files every `flush_interval`
+    seconds. Clients never touch the files, so there is no file contention
+    no matter how many annotators are connected. Documents that are clean
+    after a flush are dropped, so memory holds what is being edited rather
+    than everything ever opened.
+
+    Annotators working on the files directly may share the dataset: files
+    are written with the revision check, and a file that changed since it
+    was loaded is merged like the annotator merges a save conflict.
+    """
+
+    def __init__(self, dataset_path, flush_interval=1.0):
+        self.dataset_path = dataset_path
+        self.image_paths = {os.path.basename(p): p for p in annotation_io.list_images(dataset_path)}
+        self.flush_interval = flush_interval
+        self.docs = {}
+        self.dirty = set()
+        self.clients = {}  # client id -> ClientLog
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()  # The flusher thread and `stop` take turns
+        self._stop = threading.Event()
+        self._flusher = None
+
+    def image_names(self):
+        # Dataset order, frames of a multi-frame file sort by number rather than as text
+        return list(self.image_paths)
+
+    def _doc(self, name):
+        """Document of an image, loaded from its file on first use"""
+        doc = self.docs.get(name)
+        if doc is None:
+            path = annotation_io.annotation_path(self.dataset_path, self.image_paths[name])
+            doc = self.docs[name] = StoredAnnotations(annotation_io.read_annotation_file(path))
+        return doc
+
+    def annotations(self, name):
+        with self.lock:
+            return self._doc(name).to_data()
+
+    def apply(self, ops):
+        """Apply a batch of operations, returns one result per operation
+
+        An operation that can't be applied gets {'image', 'error'} as its
+        result and doesn't stop the others.
+        """
+        results = []
+        with self.lock:
+            for op in ops:
+                log = self.clients.setdefault(op['client'], ClientLog()) if 'client' in op else None
+                seq = op.get('seq')
+                if log is not None and seq is not None and seq <= log.last_seq:
+                    # Sent again, answer as the first time
+                    results.append(log.results.get(seq) or {
+                        'image': op.get('image'), 'id': op.get('id', op.get('entry', {}).get('id')),
+                        'duplicate': True})
+                    continue
+                try:
+                    if op.get('image') not in self.image_paths:
+                        raise ValueError(f"Unknown image: {op.get('image')}")
+                    if log is not None:
+                        op = log.translate(op)
+                    doc = self._doc(op['image'])
+                    annotation_id = doc.apply(op)
+                    self.dirty.add(op['image'])
+                    result = {'image': op['image'], 'id': annotation_id, 'revision': doc.revision + 1}
+                    if (log is not None and seq is not None and op['op'] == "add"
+                            and 'id' in op['entry'] and annotation_id != op['entry']['id']):
+                        log.renamed_add(op, seq, annotation_id)
+                except Conflict as e:
+                    result = {'image': op.get('image'), 'error': str(e)}
+                except (KeyError, TypeError, ValueError) as e:
+                    result = {'image': op.get('image'), 'error': f"Bad operation: {e!r}"}
+                if log is not None and seq is not None:
+                    log.record(seq, result)
+                results.append(result)
+        return results
+
+    def flush(self):
+        """Write dirty documents to their annotation files, then drop the clean ones"""
+        with self.flush_lock:
+            with self.lock:
+                pending = [(name, self.docs[name], self.docs[name].to_data()) for name in self.dirty]
+                self.dirty.clear()
+            for name, doc, data in pending:
+                path = annotation_io.annotation_path(self.dataset_path, self.image_paths[name])
+                try:
+                    annotation_io.write_annotation_file_checked(path, data, doc.revision)
+                except annotation_io.ConflictError as e:
+                    self._merge(name, doc, e.theirs)
+                    continue
+                except (OSError, TimeoutError) as e:
+                    print(f"Failed to save {name}, trying again: {e}", file=sys.stderr)
+                    with self.lock:
+                        self.dirty.add(name)
+                    continue
+                with self.lock:
+                    # Later operations are based on the file just written
+                    doc.base = data
+                    doc.revision = data['revision']
+            with self.lock:
+                for name in [name for name in self.docs if name not in self.dirty]:
+                    del self.docs[name]
+
+    def _merge(self, name, doc, theirs):
+        """Someone saved the file directly, merge it with the operations applied here
+
+        The merged document replaces ours and is written by the next flush.
+        """
+        with self.lock:
+            if self.docs.get(name) is not doc:
+                return
+            merged, conflicts = annotation_io.merge_annotation_data(doc.base, doc.to_data(), theirs)
+            merged['revision'] = annotation_io.file_revision(theirs)
+            self.docs[name] = StoredAnnotations(merged)
+            self.docs[name].base = copy.deepcopy(theirs or {})
+            self.dirty.add(name)
+        if conflicts:
+            print(f"{name} was also saved directly, {conflicts} conflicting annotation(s) kept as edited here",
+                  file=sys.stderr)
+
+    def start(self):
+        """Start the background flusher"""
+        def run():
+            while not self._stop.wait(self.flush_interval):
+                self.flush()
+        self._flusher = threading.Thread(target=run, name="annotation-flusher", daemon=True)
+        self._flusher.start()
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+
+class AnnotationRequestHandler(BaseHTTPRequestHandler):
+    """JSON API of the annotation server
+
+    GET  /images               -> {"images": [names]}
+    GET  /images/<name>        -> image bytes
+    GET  /annotations/<name>   -> annotation data of an image
+    POST /ops                  -> {"ops": [...]} applied in order, {"results": [...]}
+    """
+
+    protocol_version = "HTTP/1.1"  # Keep connections alive between requests
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes, don't let Nagle hold back the body
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        self.send_json({'error': message}, status)
+
+    def image_name(self, prefix):
+        """Image name from the request path, or None if it is unknown"""
+        name = unquote(self.path[len(prefix):])
+        return name if name in self.server.store.image_paths else None
+
+    def do_GET(self):
+        store = self.server.store
+        if self.path == "/images":
+            self.send_json({'images': store.image_names()})
+        elif self.path.startswith("/images/"):
+            name = self.image_name("/images/")
+            if name is None:
+                return self.send_error_json(404, "Unknown image")
+            path = store.image_paths[name]
+            if annotation_io.split_frame(path)[1] is None and not annotation_io.is_array_source(path):
+                with open(path, 'rb') as f:
+                    body = f.read()
+                content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            else:
+                # Frames of multi-frame files and arrays are sent on their own, as full size PNG
+                buffer = io.BytesIO()
+                annotation_io.open_image(path).save(buffer, "PNG")
+                body = buffer.getvalue()
+                content_type = "image/png"
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path.startswith("/annotations/"):
+            name = self.image_name("/annotations/")
+            if name is None:
+                return self.send_error_json(404, "Unknown image")
+            self.send_json(store.annotations(name))
+        else:
+            self.send_error_json(404, "Not found")
+
+    def do_POST(self):
+        if self.path != "/ops":
+            return self.send_error_json(404, "Not found")
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            ops = json.loads(self.rfile.read(length))['ops']
+            if not isinstance(ops, list) or not all(isinstance(op, dict) for op in ops):
+                raise ValueError("'ops' must be a list of objects")
+            results = self.server.store.apply(ops)
+        except (ValueError, KeyError, TypeError) as e:
+            return self.send_error_json(400, f"Bad request: {e}")
+        self.send_json({'results': results})
+
+
+def make_server(dataset_path, host="127.0.0.1", port=8765, verbose=False):
+    """Create a server for a dataset, port 0 picks a free port"""
+    server = ThreadingHTTPServer((host, port), AnnotationRequestHandler)
+    server.daemon_threads = True
+    server.store = AnnotationStore(dataset_path)
+    server.verbose = verbose
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a dataset to annotation clients")
+    parser.add_argument("dataset", help="Dataset directory")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    server = make_server(args.dataset, args.host, args.port, args.verbose)
+    server.store.start()
+    print(f"Serving {len(server.store.image_paths)} images on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.store.stop()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import json
+import math
+import struct
+import zipfile
+
+import numpy as np
+from PIL import Image
+
+SIDECAR_SUFFIX = ".json"  # scan.raw is described by scan.raw.json
+COLOR_CHANNELS = (1, 3, 4)
+
+
+def read_sidecar(path):
+    """Header of a raw array file: {"shape": [...], "dtype": "<u2", "offset": 0, "order": "C"}"""
+    with open(path + SIDECAR_SUFFIX, 'r') as f:
+        header = json.load(f)
+    if 'shape' not in header or 'dtype' not in header:
+        raise ValueError(f"{path + SIDECAR_SUFFIX} needs at least 'shape' and 'dtype'")
+    return header
+
+
+def _npz_member(path):
+    """First array of an .npz archive, memory-mapped when it is stored uncompressed"""
+    with zipfile.ZipFile(path) as archive:
+        info = next((i for i in archive.infolist() if i.filename.endswith(".npy")), None)
+        if info is None:
+            raise ValueError(f"{path} holds no arrays")
+        read_header = None
+        if info.compress_type == zipfile.ZIP_STORED:
+            with archive.open(info) as f:
+                version = np.lib.format.read_magic(f)
+                read_header = {(1, 0): np.lib.format.read_array_header_1_0,
+                               (2, 0): np.lib.format.read_array_header_2_0}.get(version)
+                if read_header is not None:
+                    shape, fortran_order, dtype = read_header(f)
+                    header_size = f.tell()
+        if read_header is None or dtype.hasobject:
+            # Compressed arrays can only be read in full
+            with np.load(path, allow_pickle=False) as arrays:
+                return arrays[info.filename[:-len(".npy")]]
+    # The member data starts after its local file header, which may differ from the central directory's
+    with open(path, 'rb') as f:
+        f.seek(info.header_offset)
+        local_header = f.read(30)
+    name_size, extra_size = struct.unpack("<HH", local_header[26:30])
+    offset = info.header_offset + 30 + name_size + extra_size + header_size
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+def open_array(path):
+    """Array of a .npy, .npz or .raw file, memory-mapped so only the parts used are read"""
+    extension = path.lower().rsplit(".", 1)[-1]
+    if extension == "npy":
+        return np.load(path, mmap_mode='r', allow_pickle=False)
+    if extension == "npz":
+        return _npz_member(path)
+    header = read_sidecar(path)
+    return np.memmap(path, dtype=np.dtype(header['dtype']), mode='r', offset=header.get('offset', 0),
+                     shape=tuple(header['shape']), order=header.get('order', 'C'))
+
+
+def is_stack(array):
+    """Whether an array holds several frames: (frames, height, width) or (frames, height, width, channels)
+
+    (height, width, channels) with 1, 3 or 4 channels is a single image.
+    """
+    if array.ndim == 3:
+        return array.shape[-1] not in COLOR_CHANNELS
+    if array.ndim == 4 and array.shape[-1] in COLOR_CHANNELS:
+        return True
+    if array.ndim == 2:
+        return False
+    raise ValueError(f"Can't show an array of shape {array.shape} as an image")
+
+
+def frame_count(path):
+    """Number of frames of an array file, only its header is read"""
+    array = open_array(path)
+    return array.shape[0] if is_stack(array) else 1
+
+
+def frame_array(path, frame=None):
+    """(height, width[, channels]) view of an image or of one frame of a stack"""
+    array = open_array(path)
+    if is_stack(array):
+        return array[frame or 0]
+    if frame:
+        raise IndexError(f"{path} holds a single image, not frame {frame}")
+    return array
+
+
+def image_size(path, frame=None):
+    """(width, height) of an array image"""
+    array = frame_array(path, frame)
+    return array.shape[1], array.shape[0]
+
+
+def subsample(array, max_width=None, max_height=None):
+    """Every n-th row and column, n the largest step that still covers the display size
+
+    Only the sampled elements are read from a memory-mapped array.
+    """
+    height, width = array.shape[:2]
+    step = 1
+    if max_width and max_height:
+        step = max(1, math.floor(min(width / max_width, height / max_height)))
+    return np.ascontiguousarray(array[::step, ::step])
+
+
+def to_uint8(values):
+    """Scale the finite range of an array to 0-255"""
+    if values.dtype == np.uint8:
+        return values
+    if values.dtype == bool:
+        return values.astype(np.uint8) * 255
+    values = values.astype(np.float32)
+    finite = np.isfinite(values)
+    if not finite.any():
+        return np.zeros(values.shape, dtype=np.uint8)
+    lo, hi = values[finite].min(), values[finite].max()
+    scaled = (np.where(finite, values, lo) - lo) * (255 / (hi - lo) if hi > lo else 0)
+    return np.clip(scaled + 0.5, 0, 255).astype(np.uint8)
+
+
+def read_image(path, frame=None, max_width=None, max_height=None, keep_depth=False):
+    """(PIL image, original size) of an array, subsampled to about the display size
+
+    With `keep_depth` single channel arrays that aren't 8-bit become mode F
+    images of their values, for windowing. Otherwise the values are scaled
+    to 8 bits.
+    """
+    array = frame_array(path, frame)
+    values = subsample(array, max_width, max_height)
+    if values.ndim == 3 and values.shape[-1] == 1:
+        values = values[..., 0]
+    if keep_depth and values.ndim == 2 and values.dtype not in (np.uint8, bool):
+        return Image.fromarray(values.astype(np.float32)), (array.shape[1], array.shape[0])
+    values = to_uint8(values)
+    return Image.fromarray(values), (array.shape[1], array.shape[0])
@@ -0,0 +1,418 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+import PIL
+from PIL import Image
+
+import annotation_io
+import dataset_jobs
+import smoothing
+from annotation_document import AnnotationDocument
+from jobs import Job
+
+LAYOUTS = ("annotator", "curve_enh")  # annotations/<name>.json and annotations/<name>_annotations.json
+
+
+def parse_size(text):
+    """'1920x1080' -> (1920, 1080)"""
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def random_points(rng, count, width, height, closed=False):
+    """A wavy random loop or stroke in pixel coordinates"""
+    center = rng.uniform(0.2, 0.8, 2) * (width, height)
+    radius = rng.uniform(0.02, 0.15) * min(width, height)
+    end = 2 * np.pi if closed else rng.uniform(np.pi / 2, 2 * np.pi)
+    t = np.linspace(0, end, count, endpoint=not closed)
+    wobble = 1 + 0.2 * np.sin(rng.integers(2, 7) * t)
+    points = center + np.column_stack([np.cos(t), np.sin(t)]) * (radius * wobble)[:, None]
+    return np.clip(points, 0, (width - 1, height - 1))
+
+
+def synthetic_annotations(rng, width, height, density, curve_points=12, freehand_points=40):
+    """`density` annotations of one image, as lists of pixel coordinates per kind"""
+    counts = rng.multinomial(density, [0.3, 0.2, 0.35, 0.15])
+    keypoints = rng.uniform(0, 1, (counts[0], 2)) * (width, height)
+    curves = [random_points(rng, curve_points, width, height, closed=True) for _ in range(counts[1])]
+    corners = rng.uniform(0, 1, (counts[2], 2)) * (width, height)
+    sizes = rng.uniform(0.01, 0.2, (counts[2], 2)) * (width, height)
+    bboxes = np.concatenate([corners, np.minimum(corners + sizes, (width, height))], axis=1)
+    freehand = [random_points(rng, freehand_points, width, height) for _ in range(counts[3])]
+    return keypoints, curves, bboxes, freehand
+
+
+def annotator_data(name, width, height, annotations):
+    """Annotation file as written by coco_annotator.py"""
+    keypoints, curves, bboxes, freehand = annotations
+
+    def points(pts):
+        return [{'x': x / width, 'y': y / height} for x, y in pts]
+
+    return {
+        'image': name,
+        'image_width': width,
+        'image_height': height,
+        'keypoints': [{'id': i + 1, 'x': x / width, 'y': y / height} for i, (x, y) in enumerate(keypoints)],
+        'curves': [{'id': i + 1, 'points': points(c)} for i, c in enumerate(curves)],
+        'bboxes': [{'id': i + 1, 'x1': x1 / width, 'y1': y1 / height, 'x2': x2 / width, 'y2': y2 / height}
+                   for i, (x1, y1, x2, y2) in enumerate(bboxes)],
+        'freehand_curves': [{'id': i + 1, 'points': points(c), 'smoothing': {'method': "auto", 'degree': 3}}
+                            for i, c in enumerate(freehand)],
+        'next_ids': {'keypoint': len(keypoints) + 1, 'curve': len(curves) + 1,
+                     'bbox': len(bboxes) + 1, 'freehand': len(freehand) + 1},
+        'revision': 1,
+    }
+
+
+def curve_enh_data(name, width, height, annotations):
+    """Annotation file as written by coco_annotator_curve_enh.py, freehand strokes become smooth curves"""
+    keypoints, curves, bboxes, freehand = annotations
+
+    def points(pts):
+        return [{'x_norm': x / width, 'y_norm': y / height} for x, y in pts]
+
+    return {
+        'image_filename': name,
+        'keypoints': [{'id': i + 1, 'x_norm': x / width, 'y_norm': y / height}
+                      for i, (x, y) in enumerate(keypoints)],
+        'curves': [{'id': i + 1, 'normalized_points': points(c)} for i, c in enumerate(curves)],
+        'smooth_curves': [{'id': i + 1, 'normalized_points': points(c), 'smoothness': 0.3}
+                          for i, c in enumerate(freehand)],
+        'bboxes': [{'id': i + 1, 'x_center': (x1 + x2) / (2 * width), 'y_center': (y1 + y2) / (2 * height),
+                    'width': (x2 - x1) / width, 'height': (y2 - y1) / height}
+                   for i, (x1, y1, x2, y2) in enumerate(bboxes)],
+        'next_ids': {'keypoint': len(keypoints) + 1, 'curve': len(curves) + 1,
+                     'smooth_curve': len(freehand) + 1, 'bbox': len(bboxes) + 1},
+    }
+
+
+def make_dataset(dataset_path, num_images=20, size=(1920, 1080), density=100, layouts=LAYOUTS, seed=0,
+                 image_format="jpg"):
+    """Write a synthetic dataset, returns the sorted image paths
+
+    Images go to images/ and annotation files of the requested layouts to
+    annotations/. The same seed always produces the same dataset.
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    images_dir = os.path.join(dataset_path, "images")
+    os.makedirs(images_dir, exist_ok=True)
+    # Smooth gradients plus noise, so files compress like photos rather than flat color
+    yy, xx = np.mgrid[0:height, 0:width]
+    base = np.stack([xx * 255 / width, yy * 255 / height, (xx + yy) * 127 / (width + height)], axis=-1)
+
+    for index in range(num_images):
+        name = f"synthetic_{index:05d}.{image_format}"
+        noise = rng.normal(0, 12, (height, width, 3))
+        pixels = np.clip(base + noise + rng.uniform(-60, 60, 3), 0, 255).astype(np.uint8)
+        Image.fromarray(pixels).save(os.path.join(images_dir, name))
+
+        annotations = synthetic_annotations(rng, width, height, density)
+        base_name = os.path.splitext(name)[0]
+        annotations_dir = os.path.join(dataset_path, "annotations")
+        if "annotator" in layouts:
+            annotation_io.write_annotation_file(os.path.join(annotations_dir, f"{base_name}.json"),
+                                                annotator_data(name, width, height, annotations))
+        if "curve_enh" in layouts:
+            annotation_io.write_annotation_file(os.path.join(annotations_dir, f"{base_name}_annotations.json"),
+                                                curve_enh_data(name, width, height, annotations))
+    return annotation_io.list_images(dataset_path)
+
+
+def copy_dataset(source_path, dataset_path, num_images):
+    """Copy the first `num_images` entries of a dataset with their annotation files, returns the copied entries
+
+    The benchmarks save annotations and export labels, so they run on a
+    copy and the source dataset is only read.
+    """
+    entries = annotation_io.list_images(source_path)[:num_images]
+    images_dir = os.path.join(dataset_path, "images")
+    annotations_dir = os.path.join(dataset_path, "annotations")
+    os.makedirs(images_dir, exist_ok=True)
+    os.makedirs(annotations_dir, exist_ok=True)
+    files = dict.fromkeys(annotation_io.split_frame(entry)[0] for entry in entries)
+    for path in files:
+        shutil.copy2(path, images_dir)
+        if os.path.exists(path + ".json"):  # Sidecar of a raw array
+            shutil.copy2(path + ".json", images_dir)
+    for entry in entries:
+        stem = annotation_io.image_stem(entry)
+        for name in (f"{stem}.json", f"{stem}_annotations.json"):
+            path = os.path.join(source_path, "annotations", name)
+            if os.path.exists(path):
+                shutil.copy2(path, annotations_dir)
+    return annotation_io.list_images(dataset_path)[:num_images]
+
+
+def summarize(samples):
+    """Timing statistics in seconds"""
+    ordered = sorted(samples)
+    return {
+        'repeat': len(samples),
+        'mean': statistics.fmean(samples),
+        'median': statistics.median(samples),
+        'min': ordered[0],
+        'max': ordered[-1],
+        'p90': ordered[min(len(ordered) - 1, int(0.9 * len(ordered)))],
+        'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+def time_call(fn, repeat, setup=None):
+    """Time `repeat` calls of fn(i), `setup(i)` runs untimed before each call"""
+    samples = []
+    for i in range(repeat):
+        if setup:
+            setup(i)
+        start = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def headless_benchmarks(dataset_path, images, repeat, size):
+    """Paths that don't need a window: decoding, annotation files, smoothing and the YOLO export"""
+    import coco_annotator
+    import coco_annotator_curve_enh
+
+    results = []
+    n = len(images)
+
+    def add(name, layout, timings, **extra):
+        results.append({'name': name, 'layout': layout, 'mode': "headless", **timings, **extra})
+
+    add("decode_image", None, time_call(lambda i: annotation_io.load_display_image(images[i % n], *size), repeat))
+
+    paths = {"annotator": [annotation_io.annotation_path(dataset_path, p) for p in images],
+             "curve_enh": [os.path.join(dataset_path, "annotations",
+                                        f"{os.path.splitext(os.path.basename(p))[0]}_annotations.json")
+                           for p in images]}
+    for layout, layout_paths in paths.items():
+        if not os.path.exists(layout_paths[0]):
+            continue
+        loaded = [annotation_io.read_annotation_file(p) for p in layout_paths]
+        add("read_annotation_file", layout,
+            time_call(lambda i: annotation_io.read_annotation_file(layout_paths[i % n]), repeat))
+        add("write_annotation_file", layout,
+            time_call(lambda i: annotation_io.write_annotation_file(layout_paths[i % n], loaded[i % n]), repeat))
+        # Parsing into and serializing from the document the annotators use, at the original size
+        docs = [AnnotationDocument.from_data(data, size, layout) for data in loaded]
+        add("document_load", layout,
+            time_call(lambda i: AnnotationDocument.from_data(loaded[i % n], size, layout), repeat))
+        add("document_save", layout, time_call(lambda i: docs[i % n].to_data(layout), repeat))
+
+    # Neither method touches the window, so they can be timed on the class
+    generate_smooth_curve = coco_annotator_curve_enh.CocoAnnotator.generate_smooth_curve
+    apply_bspline_smoothing = coco_annotator.CocoAnnotator.apply_bspline_smoothing
+    rng = np.random.default_rng(1)
+    controls = [[tuple(p) for p in random_points(rng, 40, *size).astype(int)] for _ in range(64)]
+    add("generate_smooth_curve", "curve_enh",
+        time_call(lambda i: generate_smooth_curve(None, controls[i % 64], 0.3), repeat * 10), points=40)
+    for method in smoothing.METHODS:
+        if method == "scipy" and not smoothing.scipy_available():
+            continue
+        add("apply_bspline_smoothing", "annotator",
+            time_call(lambda i: apply_bspline_smoothing(None, controls[i % 64], 3, 320, method), repeat * 10),
+            points=40, method=method)
+
+    if os.path.exists(paths["annotator"][0]):
+        def export(i):
+            job = Job(i, "benchmark", total=n)
+            dataset_jobs.export_yolo_job(job, dataset_path, images)
+        add("export_yolo_dataset", "annotator", time_call(export, max(1, repeat // 5)), images=n)
+    return results
+
+
+def wait_idle(root, app):
+    """Run the Tk loop until all background work of the annotator delivered its results"""
+    root.update()
+    while app.tasks.active:
+        time.sleep(0.0005)
+        root.update()
+
+
+def gui_benchmarks(dataset_path, images, repeat, scratch_dir):
+    """The annotators' own methods end to end, drawing included; needs a display
+
+    The session is kept in `scratch_dir`, so the user's own session isn't
+    overwritten with the benchmark dataset.
+    """
+    import tkinter as tk
+
+    names = ("load_image", "load_annotations", "save_annotations")
+    try:
+        root = tk.Tk()
+    except tk.TclError as e:
+        return [{'name': name, 'layout': layout, 'mode': "gui", 'skipped': str(e)}
+                for layout in LAYOUTS for name in names]
+
+    import coco_annotator
+    import coco_annotator_curve_enh
+
+    results = []
+    n = len(images)
+
+    def add(name, layout, timings):
+        results.append({'name': name, 'layout': layout, 'mode': "gui", **timings})
+
+    # coco_annotator.py decodes and reads files in workers, so time until the results are shown
+    root.geometry("1200x800")
+    app = coco_annotator.CocoAnnotator(root, session_path=os.path.join(scratch_dir, "session.json"))
+    app.dataset_loaded(dataset_path, images)
+    wait_idle(root, app)
+
+    def show(i):
+        app.current_image_index = i % n
+        app.load_image()
+        wait_idle(root, app)
+
+    # Decoding dominates, so every call starts from a cold image cache
+    add("load_image", "annotator", time_call(show, repeat, setup=lambda i: app.image_cache.clear()))
+    data = annotation_io.read_annotation_file(app.get_annotation_filename())
+
+    def reload(i):
+        app.reload_annotations(data)
+        wait_idle(root, app)
+
+    add("load_annotations", "annotator", time_call(reload, repeat))
+
+    def save(i):
+        app.save_annotations()
+        wait_idle(root, app)
+
+    add("save_annotations", "annotator", time_call(save, repeat))
+    app.on_close()
+
+    # The curve editor does everything on the Tk thread
+    root = tk.Tk()
+    root.geometry("1200x800")
+    app = coco_annotator_curve_enh.CocoAnnotator(root)
+    app.dataset_path = dataset_path
+    app.annotations_dir = os.path.join(dataset_path, "annotations")
+    app.images = list(images)
+    root.update()
+
+    def show_enh(i):
+        app.current_image_index = i % n
+        app.load_image()
+        root.update()
+
+    add("load_image", "curve_enh", time_call(show_enh, repeat))
+
+    def reload_enh(i):
+        app.canvas.delete("all")
+        app.load_annotations()
+        root.update()
+
+    add("load_annotations", "curve_enh", time_call(reload_enh, repeat))
+    add("save_annotations", "curve_enh", time_call(lambda i: app.save_annotations(), repeat))
+    root.destroy()
+    return results
+
+
+def environment():
+    """What the results were measured on"""
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'pillow': PIL.__version__,
+        'scipy': smoothing.scipy_available(),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Benchmarks whose median got slower than the baseline by more than `tolerance`"""
+    def key(result):
+        return (result['name'], result['layout'], result['mode'], result.get('method'))
+
+    before = {key(r): r for r in baseline['results'] if 'median' in r}
+    regressions = []
+    for result in results:
+        old = before.get(key(result))
+        if old is None or 'median' not in result or not old['median']:
+            continue
+        ratio = result['median'] / old['median']
+        if ratio > 1 + tolerance:
+            regressions.append({'name': result['name'], 'layout': result['layout'], 'method': result.get('method'),
+                                'baseline': old['median'], 'median': result['median'], 'ratio': ratio})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the annotator on a synthetic dataset")
+    parser.add_argument("--dataset", help="Dataset directory to use, generated if empty or missing "
+                                          "(default: a temporary directory). An existing dataset is "
+                                          "copied and only the copy is benchmarked")
+    parser.add_argument("--images", type=int, default=20,
+                        help="Number of generated images, or of images copied from --dataset")
+    parser.add_argument("--size", type=parse_size, default=(1920, 1080), help="Generated image size, WxH")
+    parser.add_argument("--density", type=int, default=100, help="Annotations per generated image")
+    parser.add_argument("--layout", choices=LAYOUTS + ("both",), default="both",
+                        help="Annotation file layout to generate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=10, help="Timed calls per benchmark")
+    parser.add_argument("--display-size", type=parse_size, default=(1180, 640),
+                        help="Canvas size images are fitted to, WxH")
+    parser.add_argument("--no-gui", action="store_true", help="Skip the benchmarks that need a window")
+    parser.add_argument("--output", help="Write the JSON results to this file instead of stdout")
+    parser.add_argument("--baseline", help="Results of an earlier run, exit with status 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed slowdown against the baseline (default: 0.2 = 20%%)")
+    args = parser.parse_args()
+
+    layouts = LAYOUTS if args.layout == "both" else (args.layout,)
+    with tempfile.TemporaryDirectory(prefix="annotator-bench-") as tmp:
+        dataset_path = args.dataset or tmp
+        if os.path.isdir(dataset_path) and any(os.scandir(dataset_path)) and dataset_path != tmp:
+            # Saving and exporting write to the dataset, which must stay as the user left it
+            dataset_path = os.path.join(tmp, "dataset")
+            images = copy_dataset(args.dataset, dataset_path, args.images)
+        else:
+            start = time.perf_counter()
+            images = make_dataset(dataset_path, args.images, args.size, args.density, layouts, args.seed)
+            print(f"Generated {len(images)} images in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+        results = headless_benchmarks(dataset_path, images, args.repeat, args.display_size)
+        if not args.no_gui:
+            results += gui_benchmarks(dataset_path, images, args.repeat, tmp)
+
+    report = {
+        'created': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'environment': environment(),
+        'parameters': {'images': len(images), 'size': list(args.size), 'density': args.density,
+                       'layouts': list(layouts), 'seed': args.seed, 'repeat': args.repeat,
+                       'display_size': list(args.display_size), 'dataset': args.dataset},
+        'results': results,
+    }
+    status = 0
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            report['regressions'] = compare(results, json.load(f), args.tolerance)
+        for regression in report['regressions']:
+            variant = ", ".join(filter(None, (regression['layout'], regression['method'])))
+            print(f"Regression: {regression['name']} ({variant}) {regression['ratio']:.2f}x slower", file=sys.stderr)
+        status = 1 if report['regressions'] else 0
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,19 +1,61 @@
+from startup import PROCESS_START, lazy_import, warm_imports, elapsed_ms
+import argparse
+import sys
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
-import json
+from tkinter import ttk, filedialog, messagebox, simpledialog
+import io
+import math
 import os
-from PIL import Image, ImageTk
-import numpy as np
+import time
+from PIL import ImageTk, ImageDraw
 from enum import Enum
+from stroke_simplify import StreamSimplifier
+from spatial_index import SpatialIndex
+from annotation_list import AnnotationList
+from annotation_document import AnnotationDocument, fit_freehand, tessellate_freehand
+from task_runtime import TaskRuntime
+import annotation_io
+from image_cache import ImageCache
+from jobs import JobManager, JobsWindow
+from leases import LeaseManager
+from instrumentation import tracer
+import session
+
+# Not needed for the first image, loaded on first use or warmed up once it is shown
+smoothing = lazy_import("smoothing")
+editing = lazy_import("editing")
+raster_overlay = lazy_import("raster_overlay")
+dataset_jobs = lazy_import("dataset_jobs")
+annotation_client = lazy_import("annotation_client")
+work_queue = lazy_import("work_queue")
+qa_scan = lazy_import("qa_scan")
+image_hashes = lazy_import("image_hashes")
+annotation_query = lazy_import("annotation_query")
+propagation = lazy_import("propagation")
+windowing = lazy_import("windowing")
+WARM_IMPORTS = ("numpy", "smoothing", "editing", "raster_overlay")
 
 class AnnotationMode(Enum):
     KEYPOINT = 1
     CURVE = 2
     BBOX = 3
     FREEHAND = 4  # New freehand drawing mode
+    SELECT = 5  # Pick annotations on the canvas
+
+# Propagated annotations within this many display pixels of an existing one are not added again
+PROPAGATED_DUPLICATE_PX = 3
+
+# Annotation list tabs: kind, title and (column, heading, width) of the Treeview
+ANNOTATION_TABS = (
+    ("keypoint", "Keypoints", (("id", "ID", 50), ("x", "X", 100), ("y", "Y", 100))),
+    ("curve", "Curves", (("id", "ID", 50), ("points", "Points", 250))),
+    ("bbox", "Bounding Boxes", (("id", "ID", 50), ("x1", "X1", 75), ("y1", "Y1", 75),
+                                ("x2", "X2", 75), ("y2", "Y2", 75))),
+    ("freehand", "Freehand Curves", (("id", "ID", 50), ("points", "Points", 250))),
+)
 
 class CocoAnnotator:
-    def __init__(self, root):
+    def __init__(self, root, session_path=None):
         self.root = root
         self.root.title("COCO Dataset Annotator")
         self.root.geometry("1200x800")
@@ -23,6 +65,7 @@ class CocoAnnotator:
         self.current_image_index = -1
         self.current_image = None
         self.current_image_data = None
+        self.original_size = None  # Size of the image file, the display may be scaled
         self.current_annotations = {}
         
         self.annotation_mode = AnnotationMode.KEYPOINT
@@ -30,13 +73,129 @@ class CocoAnnotator:
         self.curve_points = []
         self.bbox_start = None
         self.freehand_points = []  # For storing freehand drawing points
-        
-        self.keypoints = []
-        self.curves = []
-        self.bboxes = []
-        self.freehand_curves = []  # For storing completed freehand curves
+        self.freehand_simplifier = None  # Online simplifier for the stroke being drawn
+        self.image_scale = 1.0  # Display pixels per original image pixel
+        
+        # Annotations of the current image in display coordinates, the maps
+        # and the id allocator below are the document's
+        self.doc = AnnotationDocument(integer_coords=True)
+        
+        # Spatial index over all annotations in image coordinates, used for picking
+        self.spatial_index = SpatialIndex()
+        self.pick_radius = 8  # Picking radius in screen pixels
+        self.select_start = None
+        self.hover_key = None
+        self.selected_keys = []
+        
+        # Canvas items of curves and bboxes, so edits only touch the affected items
+        self.curve_items = {}  # curve_id -> (segment item ids, label item id)
+        self.bbox_items = {}  # bbox_id -> (rectangle item id, label item id)
+        self.edit_state = None  # Active drag while editing an annotation
+        
+        # Level-of-detail rendering for annotation-dense images
+        self.label_min_scale = 0.5  # Hide labels when the image is shown smaller than this
+        self.label_always_count = 200  # ...unless the image has only a few annotations
+        self.tiny_curve_px = 8  # Curves smaller than this on screen are drawn as their box
+        self.draw_batch_size = 1500  # Annotations drawn per batch before yielding to Tk
+        self.show_labels = True
+        self.collapsed_keys = set()  # Curves currently drawn as their bounding box
+        self.deferred_keys = set()  # Off-viewport annotations not drawn yet
+        self.render_generation = 0
+        
+        # Rasterized overlay mode: committed annotations are composited into image tiles
+        self.overlay = None
+        self.live_keys = set()  # Annotations shown as canvas items while being edited
+        
+        # Disk access and decoding run on worker threads, Tk only sees the results
+        self.tasks = TaskRuntime(root)
+        self.image_cache = ImageCache()
+        
+        # Dataset-wide jobs run concurrently in the background while annotating
+        self.jobs = JobManager(self.tasks)
+        self.jobs_window = JobsWindow(root, self.jobs)
+        
+        # Shared datasets: advisory per-image leases plus a version check on save
+        self.leases = None
+        self.leased_name = None
+        self.lease_heartbeat_ms = 30000
+        self.root.after(self.lease_heartbeat_ms, self.renew_leases)
+        self.loaded_data = None  # Annotation file as loaded, the base for merging on conflicts
+        
+        # Server mode: images and annotations come from an annotation server and
+        # every change is pushed to it as a delta operation
+        self.client = None
+        self.sync = None
+        self.fields_sent = False
+        
+        # Work-queue mode: self.images only holds the images claimed from the
+        # shared queue, more are claimed in the background before they run out
+        self.work_queue = None
+        self.all_images = None  # Full image list while in work-queue mode or filtered by a query
+        self.queue_opening = False
+        self.queue_claiming = False
+        self.queue_prefetch = 5  # Claim the next batch when this few claimed images are left
+        self.work_queue_path = None  # SQLite queue on a local disk, claim files in the dataset otherwise
+        
+        # Last QA scan of the dataset, with a window listing the offending images
+        self.qa_report = None
+        self.qa_window = None
+        
+        # Near-duplicate groups of the dataset: image -> the images of its group,
+        # first one in dataset order first
+        self.duplicate_groups = {}
+        
+        # Contrast of the display image: the decoded image and, once it is of a high
+        # bit depth or adjusted, its windowing. Settings are kept per image
+        self.display_source = None
+        self.windowing = None
+        self.window_settings = {}  # image -> (window, level, gamma)
+        self.window_render_pending = False
+        
+        # Annotation index of the dataset for queries, and the query filtering self.images
+        self.annotation_index = None
+        self.indexed_images = None  # Image of every index row
+        self.query_filter = None
+        self.query_rows = None
+        self.query_window = None
+        
+        # Opt-in latency tracing, shown in the status bar while enabled
+        self.switch_started = None  # Start of the image switch in progress, while tracing
+        self.hud_interval_ms = 500
+        self.hud_job = None
+        
+        # Time to first image is measured from process start until the first image is shown
+        self.startup_pending = True
+        self.exit_after_first_image = False
+        
+        # Per-user session: the dataset, the image and the settings of the last
+        # run, so a shift can be resumed with Ctrl+R
+        self.session_path = session_path or session.default_session_path()
+        self.saved_session = session.read_session(self.session_path)
+        self.restored_canvas_size = None  # Canvas size of the last session, until the window is mapped
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
         self.setup_ui()
+        self.restore_settings()
+    
+    @property
+    def keypoints(self):
+        return self.doc.annotations["keypoint"]
+    
+    @property
+    def curves(self):
+        return self.doc.annotations["curve"]
+    
+    @property
+    def bboxes(self):
+        return self.doc.annotations["bbox"]
+    
+    @property
+    def freehand_curves(self):
+        return self.doc.annotations["freehand"]
+    
+    @property
+    def ids(self):
+        return self.doc.ids
     
     def setup_ui(self):
         # Main frame
@@ -51,6 +210,13 @@ class CocoAnnotator:
         load_btn = ttk.Button(control_frame, text="Load Dataset", command=self.load_dataset)
         load_btn.pack(side=tk.LEFT, padx=5)
         
+        server_btn = ttk.Button(control_frame, text="Connect to Server", command=self.connect_server)
+        server_btn.pack(side=tk.LEFT, padx=5)
+        
+        self.resume_btn = ttk.Button(control_frame, text="Resume", command=self.resume_session)
+        self.resume_btn.pack(side=tk.LEFT, padx=5)
+        self.root.bind("<Control-r>", lambda event: self.resume_session())
+        
         # Navigation controls
         nav_frame = ttk.Frame(control_frame)
         nav_frame.pack(side=tk.LEFT, padx=20)
@@ -64,6 +230,11 @@ class CocoAnnotator:
         next_btn = ttk.Button(nav_frame, text="Next →", command=self.next_image)
         next_btn.pack(side=tk.LEFT, padx=5)
         
+        # Carry keypoints and boxes over from the previous frame of a sequence
+        propagate_btn = ttk.Button(nav_frame, text="Propagate", command=self.propagate_from_previous)
+        propagate_btn.pack(side=tk.LEFT, padx=5)
+        self.root.bind("<Control-p>", lambda event: self.propagate_from_previous())
+        
         # Annotation mode selection
         mode_frame = ttk.LabelFrame(control_frame, text="Annotation Mode")
         mode_frame.pack(side=tk.LEFT, padx=20)
@@ -86,6 +257,10 @@ class CocoAnnotator:
                                      value="freehand", command=self.set_annotation_mode)
         freehand_rb.pack(side=tk.LEFT, padx=5)
         
+        select_rb = ttk.Radiobutton(mode_frame, text="Select", variable=self.mode_var,
+                                    value="select", command=self.set_annotation_mode)
+        select_rb.pack(side=tk.LEFT, padx=5)
+        
         # Save button
         save_btn = ttk.Button(control_frame, text="Save Annotations", command=self.save_annotations)
         save_btn.pack(side=tk.RIGHT, padx=5)
@@ -98,19 +273,101 @@ class CocoAnnotator:
         self.smoothing_frame = ttk.LabelFrame(control_frame, text="Curve Smoothing")
         self.smoothing_frame.pack(side=tk.LEFT, padx=20)
         
+        # Spline degree of the B-spline methods, 0 keeps the stroke unsmoothed
+        self.smooth_degree_var = tk.IntVar(value=3)
+        degree_label = ttk.Label(self.smoothing_frame, text="Degree:")
+        degree_label.pack(side=tk.LEFT, padx=5)
+        
+        degree_spinbox = ttk.Spinbox(self.smoothing_frame, from_=0, to=5,
+                                     textvariable=self.smooth_degree_var, width=5)
+        degree_spinbox.pack(side=tk.LEFT, padx=5)
+        
+        # Corner cutting rounds of the chaikin method
         self.smooth_iterations_var = tk.IntVar(value=2)
         smooth_label = ttk.Label(self.smoothing_frame, text="Smooth Iterations:")
         smooth_label.pack(side=tk.LEFT, padx=5)
         
-        smooth_spinbox = ttk.Spinbox(self.smoothing_frame, from_=0, to=5, 
+        smooth_spinbox = ttk.Spinbox(self.smoothing_frame, from_=1, to=5, 
                                    textvariable=self.smooth_iterations_var, width=5)
         smooth_spinbox.pack(side=tk.LEFT, padx=5)
         
+        # Smoothing method, "auto" falls back to pure NumPy when scipy is missing
+        self.smooth_method_var = tk.StringVar(value="auto")
+        method_label = ttk.Label(self.smoothing_frame, text="Method:")
+        method_label.pack(side=tk.LEFT, padx=5)
+        
+        # The methods are filled in when the list opens, smoothing pulls in NumPy
+        method_combo = ttk.Combobox(self.smoothing_frame, textvariable=self.smooth_method_var,
+                                    values=("auto",), state="readonly", width=8,
+                                    postcommand=lambda: method_combo.configure(values=smoothing.METHODS))
+        method_combo.pack(side=tk.LEFT, padx=5)
+        
+        # Simplification tolerance for freehand strokes, in original image pixels
+        self.simplify_tolerance_var = tk.DoubleVar(value=1.5)
+        tolerance_label = ttk.Label(self.smoothing_frame, text="Tolerance (px):")
+        tolerance_label.pack(side=tk.LEFT, padx=5)
+        
+        tolerance_spinbox = ttk.Spinbox(self.smoothing_frame, from_=0.0, to=10.0, increment=0.5,
+                                      textvariable=self.simplify_tolerance_var, width=5)
+        tolerance_spinbox.pack(side=tk.LEFT, padx=5)
+        
+        # Draw committed annotations into the image instead of as canvas items
+        self.raster_var = tk.BooleanVar(value=False)
+        raster_check = ttk.Checkbutton(control_frame, text="Raster overlay", variable=self.raster_var,
+                                       command=self.toggle_raster_overlay)
+        raster_check.pack(side=tk.LEFT, padx=5)
+        
+        # Window/level and gamma of the display image, mostly for 16-bit and float images
+        display_frame = ttk.LabelFrame(main_frame, text="Display")
+        display_frame.pack(fill=tk.X, side=tk.TOP)
+        self.window_var = tk.DoubleVar(value=255.0)
+        self.level_var = tk.DoubleVar(value=127.5)
+        self.gamma_var = tk.DoubleVar(value=0.0)  # log10 of the gamma, so 1 sits in the middle
+        self.window_scales = {}
+        for name, variable, limits in (("Window", self.window_var, (1.0, 255.0)),
+                                       ("Level", self.level_var, (0.0, 255.0)),
+                                       ("Gamma", self.gamma_var, (-0.7, 0.7))):
+            ttk.Label(display_frame, text=f"{name}:").pack(side=tk.LEFT, padx=5)
+            scale = ttk.Scale(display_frame, from_=limits[0], to=limits[1], variable=variable, length=160,
+                              command=lambda value: self.window_changed())
+            scale.pack(side=tk.LEFT, padx=5)
+            self.window_scales[name] = scale
+        self.window_label = ttk.Label(display_frame, text="")
+        self.window_label.pack(side=tk.LEFT, padx=5)
+        auto_btn = ttk.Button(display_frame, text="Auto", command=self.reset_windowing)
+        auto_btn.pack(side=tk.LEFT, padx=5)
+        
         # Canvas for image display and annotation
         canvas_frame = ttk.Frame(main_frame)
         canvas_frame.pack(fill=tk.BOTH, expand=True, pady=10)
-        batch_export_btn = ttk.Button(control_frame, text="Batch YOLO Export", command=self.export_all_to_yolo)
-        batch_export_btn.pack(side=tk.RIGHT, padx=5)
+        # Background jobs over the whole dataset
+        jobs_btn = ttk.Menubutton(control_frame, text="Dataset Jobs")
+        jobs_menu = tk.Menu(jobs_btn, tearoff=0)
+        jobs_menu.add_command(label="Batch YOLO Export", command=self.export_all_to_yolo)
+        jobs_menu.add_command(label="Migrate Annotation Files", command=self.migrate_annotations)
+        jobs_menu.add_command(label="Dataset Statistics", command=self.show_dataset_stats)
+        jobs_menu.add_command(label="Warm Image Cache", command=self.warm_image_cache)
+        jobs_menu.add_command(label="QA Scan", command=self.run_qa_scan)
+        jobs_menu.add_command(label="QA Report", command=self.show_qa_report)
+        jobs_menu.add_separator()
+        jobs_menu.add_command(label="Find Near-Duplicates", command=self.find_near_duplicates)
+        self.skip_duplicates_var = tk.BooleanVar(value=False)
+        jobs_menu.add_checkbutton(label="Skip Near-Duplicates", variable=self.skip_duplicates_var)
+        jobs_menu.add_command(label="Copy Annotations from Duplicate (Ctrl+D)",
+                              command=self.copy_duplicate_annotations)
+        self.root.bind("<Control-d>", lambda event: self.copy_duplicate_annotations())
+        jobs_menu.add_separator()
+        jobs_menu.add_command(label="Query Annotations (Ctrl+F)", command=self.show_query_window)
+        self.root.bind("<Control-f>", lambda event: self.show_query_window())
+        jobs_menu.add_separator()
+        self.queue_var = tk.BooleanVar(value=False)
+        jobs_menu.add_checkbutton(label="Work Queue Mode", variable=self.queue_var,
+                                  command=self.toggle_work_queue)
+        jobs_menu.add_command(label="Work Queue Progress", command=self.show_queue_progress)
+        jobs_menu.add_separator()
+        jobs_menu.add_command(label="Show Jobs", command=self.jobs_window.show)
+        jobs_btn["menu"] = jobs_menu
+        jobs_btn.pack(side=tk.RIGHT, padx=5)
         
         self.canvas = tk.Canvas(canvas_frame, bg="gray", cursor="cross")
         self.canvas.pack(fill=tk.BOTH, expand=True)
@@ -119,6 +376,8 @@ class CocoAnnotator:
         self.canvas.bind("<ButtonPress-1>", self.on_canvas_click)
         self.canvas.bind("<B1-Motion>", self.on_canvas_drag)
         self.canvas.bind("<ButtonRelease-1>", self.on_canvas_release)
+        self.canvas.bind("<Motion>", self.on_canvas_motion)
+        self.canvas.bind("<Configure>", self.on_canvas_configure)
         
         # Annotation list panel
         annotation_frame = ttk.LabelFrame(main_frame, text="Annotations")
@@ -128,180 +387,673 @@ class CocoAnnotator:
         self.annotation_tabs = ttk.Notebook(annotation_frame)
         self.annotation_tabs.pack(fill=tk.BOTH, expand=True)
         
-        # Keypoints tab
-        keypoints_tab = ttk.Frame(self.annotation_tabs)
-        self.annotation_tabs.add(keypoints_tab, text="Keypoints")
-        
-        self.keypoints_tree = ttk.Treeview(keypoints_tab, columns=("id", "x", "y"), 
-                                          show="headings", selectmode="browse")
-        self.keypoints_tree.heading("id", text="ID")
-        self.keypoints_tree.heading("x", text="X")
-        self.keypoints_tree.heading("y", text="Y")
-        self.keypoints_tree.column("id", width=50)
-        self.keypoints_tree.column("x", width=100)
-        self.keypoints_tree.column("y", width=100)
-        self.keypoints_tree.pack(fill=tk.BOTH, expand=True, side=tk.LEFT)
-        
-        kp_scrollbar = ttk.Scrollbar(keypoints_tab, orient=tk.VERTICAL, command=self.keypoints_tree.yview)
-        kp_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.keypoints_tree.configure(yscrollcommand=kp_scrollbar.set)
-        
-        delete_kp_btn = ttk.Button(keypoints_tab, text="Delete Selected", 
-                                  command=lambda: self.delete_annotation("keypoint"))
-        delete_kp_btn.pack(pady=5)
-        
-        # Curves tab
-        curves_tab = ttk.Frame(self.annotation_tabs)
-        self.annotation_tabs.add(curves_tab, text="Curves")
-        
-        self.curves_tree = ttk.Treeview(curves_tab, columns=("id", "points"), 
-                                       show="headings", selectmode="browse")
-        self.curves_tree.heading("id", text="ID")
-        self.curves_tree.heading("points", text="Points")
-        self.curves_tree.column("id", width=50)
-        self.curves_tree.column("points", width=250)
-        self.curves_tree.pack(fill=tk.BOTH, expand=True, side=tk.LEFT)
-        
-        curves_scrollbar = ttk.Scrollbar(curves_tab, orient=tk.VERTICAL, command=self.curves_tree.yview)
-        curves_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.curves_tree.configure(yscrollcommand=curves_scrollbar.set)
-        
-        delete_curve_btn = ttk.Button(curves_tab, text="Delete Selected", 
-                                     command=lambda: self.delete_annotation("curve"))
-        delete_curve_btn.pack(pady=5)
-        
-        # Bounding boxes tab
-        bbox_tab = ttk.Frame(self.annotation_tabs)
-        self.annotation_tabs.add(bbox_tab, text="Bounding Boxes")
-        
-        self.bbox_tree = ttk.Treeview(bbox_tab, columns=("id", "x1", "y1", "x2", "y2"), 
-                                     show="headings", selectmode="browse")
-        self.bbox_tree.heading("id", text="ID")
-        self.bbox_tree.heading("x1", text="X1")
-        self.bbox_tree.heading("y1", text="Y1")
-        self.bbox_tree.heading("x2", text="X2")
-        self.bbox_tree.heading("y2", text="Y2")
-        self.bbox_tree.column("id", width=50)
-        self.bbox_tree.column("x1", width=75)
-        self.bbox_tree.column("y1", width=75)
-        self.bbox_tree.column("x2", width=75)
-        self.bbox_tree.column("y2", width=75)
-        self.bbox_tree.pack(fill=tk.BOTH, expand=True, side=tk.LEFT)
-        
-        bbox_scrollbar = ttk.Scrollbar(bbox_tab, orient=tk.VERTICAL, command=self.bbox_tree.yview)
-        bbox_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.bbox_tree.configure(yscrollcommand=bbox_scrollbar.set)
-        
-        delete_bbox_btn = ttk.Button(bbox_tab, text="Delete Selected", 
-                                    command=lambda: self.delete_annotation("bbox"))
-        delete_bbox_btn.pack(pady=5)
-        
-        # Add Freehand Curves Tab
-        freehand_tab = ttk.Frame(self.annotation_tabs)
-        self.annotation_tabs.add(freehand_tab, text="Freehand Curves")
-        
-        self.freehand_tree = ttk.Treeview(freehand_tab, columns=("id", "points"), 
-                                      show="headings", selectmode="browse")
-        self.freehand_tree.heading("id", text="ID")
-        self.freehand_tree.heading("points", text="Points")
-        self.freehand_tree.column("id", width=50)
-        self.freehand_tree.column("points", width=250)
-        self.freehand_tree.pack(fill=tk.BOTH, expand=True, side=tk.LEFT)
-        
-        freehand_scrollbar = ttk.Scrollbar(freehand_tab, orient=tk.VERTICAL, command=self.freehand_tree.yview)
-        freehand_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.freehand_tree.configure(yscrollcommand=freehand_scrollbar.set)
-        
-        delete_freehand_btn = ttk.Button(freehand_tab, text="Delete Selected", 
-                                     command=lambda: self.delete_annotation("freehand"))
-        delete_freehand_btn.pack(pady=5)
-        
-        # Status bar
-        self.status_bar = ttk.Label(self.root, text="Ready", relief=tk.SUNKEN, anchor=tk.W)
-        self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
+        # Only the first tab is built now, the others when they are first shown;
+        # until then their lists just keep rows
+        self.annotation_lists = {}
+        self.annotation_tab_frames = {}
+        for index, (kind, title, _) in enumerate(ANNOTATION_TABS):
+            tab = ttk.Frame(self.annotation_tabs)
+            self.annotation_tabs.add(tab, text=title)
+            self.annotation_tab_frames[kind] = tab
+            # Incrementally updated list and tab index for each annotation kind
+            self.annotation_lists[kind] = (AnnotationList(), index)
+        self.build_annotation_tab("keypoint")
+        self.annotation_tabs.bind("<<NotebookTabChanged>>", self.on_annotation_tab_changed)
+        
+        # Latency tracing
+        trace_btn = ttk.Menubutton(control_frame, text="Diagnostics")
+        trace_menu = tk.Menu(trace_btn, tearoff=0)
+        self.trace_var = tk.BooleanVar(value=tracer.enabled)
+        trace_menu.add_checkbutton(label="Record Latency", variable=self.trace_var, command=self.toggle_tracing)
+        trace_menu.add_command(label="Latency Percentiles", command=self.show_latency_percentiles)
+        trace_menu.add_command(label="Export Chrome Trace...", command=self.export_trace)
+        trace_menu.add_command(label="Clear Recorded Latency", command=tracer.clear)
+        trace_btn["menu"] = trace_menu
+        trace_btn.pack(side=tk.RIGHT, padx=5)
+        
+        # Status bar, with the latency HUD on the right while tracing
+        status_frame = ttk.Frame(self.root)
+        status_frame.pack(side=tk.BOTTOM, fill=tk.X)
+        self.status_bar = ttk.Label(status_frame, text="Ready", relief=tk.SUNKEN, anchor=tk.W)
+        self.status_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.latency_hud = ttk.Label(status_frame, text="", relief=tk.SUNKEN, anchor=tk.E)
+        if tracer.enabled:
+            self.toggle_tracing()
+    
+    def build_annotation_tab(self, kind):
+        """Create the Treeview of an annotation tab and show the rows its list kept"""
+        annotation_list, index = self.annotation_lists[kind]
+        if annotation_list.tree is not None:
+            return
+        tab = self.annotation_tab_frames[kind]
+        columns = ANNOTATION_TABS[index][2]
+        tree = ttk.Treeview(tab, columns=[c[0] for c in columns], show="headings", selectmode="browse")
+        for column, heading, width in columns:
+            tree.heading(column, text=heading)
+            tree.column(column, width=width)
+        tree.pack(fill=tk.BOTH, expand=True, side=tk.LEFT)
+        
+        scrollbar = ttk.Scrollbar(tab, orient=tk.VERTICAL, command=tree.yview)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        tree.configure(yscrollcommand=scrollbar.set)
+        
+        delete_btn = ttk.Button(tab, text="Delete Selected", command=lambda: self.delete_annotation(kind))
+        delete_btn.pack(pady=5)
+        annotation_list.attach(tree, scrollbar)
+    
+    def on_annotation_tab_changed(self, event):
+        index = self.annotation_tabs.index("current")
+        self.build_annotation_tab(ANNOTATION_TABS[index][0])
+    
+    def first_image_shown(self):
+        """Report the time to the first image and warm up what was left out of the startup path"""
+        self.startup_pending = False
+        # Let Tk paint the image first so the measurement includes it
+        self.root.update_idletasks()
+        if tracer.enabled:
+            tracer.add("time_to_first_image", PROCESS_START)
+        startup_ms = elapsed_ms()
+        self.update_status(f"Loaded {os.path.basename(self.images[self.current_image_index])} "
+                           f"({startup_ms:.0f} ms after start)")
+        if self.exit_after_first_image:
+            print(f"time_to_first_image_ms {startup_ms:.1f}", flush=True)
+            self.root.after_idle(self.on_close)
+            return
+        warm_imports(self.root, WARM_IMPORTS)
     
     def load_dataset(self):
         """Load COCO dataset from a directory"""
-        self.dataset_path = filedialog.askdirectory(title="Select COCO dataset directory")
-        if not self.dataset_path:
+        dataset_path = filedialog.askdirectory(title="Select COCO dataset directory")
+        if not dataset_path:
             return
-        
-        # Look for images directory and annotations
-        images_dir = os.path.join(self.dataset_path, "images")
-        if not os.path.exists(images_dir):
-            images_dir = self.dataset_path  # Fallback to selected directory
-            
-        # Get all image files
-        self.images = []
-        for ext in ['.jpg', '.jpeg', '.png']:
-            self.images.extend(
-                [os.path.join(images_dir, f) for f in os.listdir(images_dir) 
-                 if f.lower().endswith(ext)]
-            )
-        
-        if not self.images:
+        self.open_dataset(dataset_path)
+    
+    def open_dataset(self, dataset_path, start_index=0, start_image=None):
+        """Scan a dataset directory in the background and show the image at `start_index`
+
+        If `start_image` is still in the dataset it is shown instead, so
+        images added or removed since don't shift the position.
+        """
+        # Listing a large directory can take a while on slow storage
+        self.update_status("Scanning dataset...")
+        self.tasks.submit(annotation_io.list_images, dataset_path, key="dataset",
+                          on_done=lambda images: self.dataset_loaded(dataset_path, images, start_index, start_image),
+                          on_error=lambda e: messagebox.showerror("Error", f"Failed to read dataset: {str(e)}"))
+    
+    def dataset_loaded(self, dataset_path, images, start_index=0, start_image=None):
+        """Show the first image of a scanned dataset"""
+        if not images:
             messagebox.showerror("Error", "No images found in the selected directory")
             return
         
-        self.images.sort()
-        self.current_image_index = 0
+        self.disconnect_server()
+        self.stop_work_queue()
+        if self.leases is not None:
+            self.tasks.submit(self.leases.release_all, lane="leases")
+        self.dataset_path = dataset_path
+        self.qa_report = None
+        self.duplicate_groups = {}
+        self.forget_query_index()
+        self.leases = LeaseManager(os.path.join(dataset_path, "annotations", ".locks"))
+        self.leased_name = None
+        self.images = images
+        if start_image in images:
+            start_index = images.index(start_image)
+        self.current_image_index = min(max(start_index, 0), len(images) - 1)
         self.load_image()
         self.update_status(f"Loaded {len(self.images)} images")
     
+    def reset_annotations(self):
+        """Forget the annotations of the current image"""
+        self.doc.clear()
+        self.clear_annotation_lists()
+        self.spatial_index.clear()
+        self.hover_key = None
+        self.selected_keys = []
+        self.curve_items = {}
+        self.bbox_items = {}
+        self.edit_state = None
+        self.collapsed_keys = set()
+        self.deferred_keys = set()
+        self.render_generation += 1
+        self.live_keys = set()
+    
+    def connect_server(self):
+        """Annotate a dataset served by annotation_server.py instead of a local directory"""
+        address = simpledialog.askstring("Connect to Server", "Server address:",
+                                         initialvalue=self.client.url if self.client else "127.0.0.1:8765")
+        if not address:
+            return
+        client = annotation_client.AnnotationClient(address)
+        self.update_status(f"Connecting to {client.url}...")
+        self.tasks.submit(client.list_images, key="dataset",
+                          on_done=lambda images: self.server_connected(client, images),
+                          on_error=lambda e: messagebox.showerror("Error", f"Failed to connect: {str(e)}"))
+    
+    def server_connected(self, client, images):
+        """Show the first image of a served dataset"""
+        if not images:
+            messagebox.showerror("Error", "The server has no images")
+            return
+        
+        self.disconnect_server()
+        self.stop_work_queue()
+        if self.leases is not None:
+            self.tasks.submit(self.leases.release_all, lane="leases")
+            self.leases = None
+        self.leased_name = None
+        self.dataset_path = None
+        self.qa_report = None
+        self.duplicate_groups = {}
+        self.forget_query_index()
+        self.client = client
+        batcher = annotation_client.OpBatcher(self.root, self.tasks, client, on_results=self.sync_results,
+                                              on_error=lambda e: self.sync_failed(batcher, e))
+        self.sync = batcher
+        self.images = images
+        self.current_image_index = 0
+        self.load_image()
+        self.update_status(f"Connected to {client.url}, {len(self.images)} images")
+    
+    def disconnect_server(self):
+        """Send pending changes and go back to local files"""
+        if self.sync is not None:
+            self.sync.flush()
+        if self.client is not None:
+            self.tasks.submit(self.client.close, lane="sync")
+        self.client = None
+        self.sync = None
+    
+    def record_op(self, op, kind, annotation_id):
+        """Push an annotation change to the server, in local mode files are saved as a whole"""
+        if self.sync is None or self.current_image_data is None:
+            return
+        name = self.images[self.current_image_index]
+        if not self.fields_sent:
+            self.fields_sent = True
+            self.sync.push({'op': "fields", 'image': name, 'kind': None, 'fields': {
+                'image': name, 'image_width': self.original_size[0], 'image_height': self.original_size[1]}})
+        payload = {'op': op, 'image': name, 'kind': kind}
+        if op == "delete":
+            payload['id'] = annotation_id
+        else:
+            payload['entry'] = self.doc.entry(kind, self.doc.get(kind, annotation_id))
+        self.sync.push(payload)
+    
+    def sync_results(self, ops, results):
+        """Adopt the ids the server gave to annotations added here
+
+        The server keeps our id unless another annotator added an annotation
+        with the same id to the image first. Changes sent before this answer
+        still use our id, the server moves them to the new one.
+        """
+        for op, result in zip(ops, results):
+            if op['op'] != "add" or 'error' in result or result['id'] == op['entry']['id']:
+                continue
+            if self.images and op['image'] == self.images[self.current_image_index]:
+                self.rename_annotation(op['kind'], op['entry']['id'], result['id'])
+    
+    def sync_failed(self, batcher, error):
+        if isinstance(error, annotation_client.ServerError) and error.rejected:
+            self.update_status(f"Server rejected a change, it was dropped: {str(error)}")
+        else:
+            self.update_status(f"Server unreachable, {len(batcher.pending)} change(s) pending: {str(error)}")
+    
+    def rename_annotation(self, kind, old_id, new_id):
+        """Give an annotation of the current image another id"""
+        annotation = self.doc.rename(kind, old_id, new_id)
+        if annotation is None:
+            return
+        self.remove_annotation_view(kind, old_id)
+        self.annotation_lists[kind][0].remove(old_id)
+        self.index_annotation(kind, annotation)
+        self.show_annotation(kind, annotation)
+        self.add_list_row(kind, annotation)
+    
+    def read_image(self, client, img_path, width, height):
+        """Decode an image from disk or from the server, runs in a worker"""
+        if client is None:
+            return self.image_cache.load(img_path, width, height)
+        return self.image_cache.load(img_path, width, height,
+                                     source=lambda: io.BytesIO(client.image_bytes(img_path)))
+    
+    def read_annotations(self, client, img_path, annotation_file):
+        """Read annotations from their file or from the server, runs in a worker"""
+        if client is None:
+            return annotation_io.read_annotation_file(annotation_file)
+        return client.annotations(img_path)
+    
     def load_image(self):
         """Load and display the current image"""
         if not self.images or self.current_image_index < 0:
             return
         
-        # Clear existing annotations
-        self.keypoints = []
-        self.curves = []
-        self.bboxes = []
-        self.freehand_curves = []
-        self.clear_annotation_lists()
-        
-        # Load image
-        img_path = self.images[self.current_image_index]
-        self.current_image_data = Image.open(img_path)
-        
-        # Resize if necessary to fit canvas
-        canvas_width = self.canvas.winfo_width()
-        canvas_height = self.canvas.winfo_height()
-        
-        if canvas_width > 10 and canvas_height > 10:  # Ensure canvas has been rendered
-            img_width, img_height = self.current_image_data.size
-            scale = min(canvas_width / img_width, canvas_height / img_height)
-            
-            new_width = int(img_width * scale)
-            new_height = int(img_height * scale)
-            
-            self.current_image_data = self.current_image_data.resize((new_width, new_height), Image.LANCZOS)
+        self.reset_annotations()
         
-        # Convert to Tkinter image and display
-        self.current_image = ImageTk.PhotoImage(self.current_image_data)
-        self.canvas.config(width=self.current_image_data.width, height=self.current_image_data.height)
+        # Ignore canvas input until the new image is shown
+        self.current_image_data = None
+        self.loaded_data = None
+        self.fields_sent = False
         self.canvas.delete("all")
-        self.canvas.create_image(0, 0, anchor=tk.NW, image=self.current_image)
         
         # Update image counter
+        img_path = self.images[self.current_image_index]
         self.image_counter.config(text=f"{self.current_image_index + 1}/{len(self.images)}")
+        self.update_status(f"Loading {os.path.basename(img_path)}...")
+        self.switch_lease(os.path.basename(img_path))
+        self.switch_started = tracer.now()
+        
+        # Decode and resize to fit the canvas in the background, then read the
+        # annotations. Both share the serial io lane so the annotations arrive
+        # after the image, and navigating again drops results of this request.
+        size = self.display_size()
+        cached = self.image_cache.get((img_path,) + size)
+        if cached is not None:
+            self.tasks.cancel("image")
+            self.show_image(cached)
+        else:
+            self.tasks.submit(self.read_image, self.client, img_path, *size,
+                              key="image", lane="io", on_done=self.show_image,
+                              on_error=lambda e: messagebox.showerror("Error", f"Failed to load image: {str(e)}"))
+        self.tasks.submit(self.read_annotations, self.client, img_path, self.get_annotation_filename(),
+                          key="annotations", lane="io", on_done=self.annotations_arrived,
+                          on_error=lambda e: messagebox.showerror("Error", f"Failed to load annotations: {str(e)}"))
+        self.save_session()
+    
+    def display_size(self):
+        """Size images are fitted to, the canvas size of the last session until the window is mapped"""
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        if (width <= 10 or height <= 10) and self.restored_canvas_size:
+            return self.restored_canvas_size
+        return width, height
+    
+    def annotations_arrived(self, data):
+        """Show the annotations read for the current image, which completes the image switch"""
+        self.load_annotations(data)
+        if not data and self.images[self.current_image_index] in self.duplicate_groups:
+            self.update_status(f"{os.path.basename(self.images[self.current_image_index])} is a near-duplicate, "
+                               f"Ctrl+D copies the annotations of another image of its group")
+        tracer.add("image_switch", self.switch_started)
+        self.switch_started = None
+    
+    def show_image(self, result):
+        """Display a decoded image"""
+        self.display_source, self.original_size = result
+        self.windowing = None
+        settings = self.window_settings.get(self.images[self.current_image_index])
+        if self.display_source.mode == "F" or settings is not None:
+            self.current_image_data = self.windowed_image(settings)
+        else:
+            # 8-bit images are shown as decoded until their contrast is changed
+            self.configure_window_scales(0.0, 255.0, 1.0)
+            self.show_window_settings((255.0, 127.5, 1.0))
+            self.current_image_data = self.display_source
+        self.doc.size = self.current_image_data.size
+        self.image_scale = self.current_image_data.width / self.original_size[0]
         
-        # Try to load existing annotations for this image
-        self.load_annotations()
+        # Convert to Tkinter image and display
+        self.canvas.config(width=self.current_image_data.width, height=self.current_image_data.height)
+        self.setup_image_layer()
+        self.update_status(f"Loaded {os.path.basename(self.images[self.current_image_index])}")
+        if self.startup_pending:
+            self.first_image_shown()
+        self.prefetch_frames()
+    
+    def prefetch_frames(self):
+        """Decode the next frames of a multi-frame file while the current one is annotated"""
+        img_path = self.images[self.current_image_index]
+        path, frame = annotation_io.split_frame(img_path)
+        if frame is None:
+            return
+        width, height = self.display_size()
+        for offset in (1, 2, -1):
+            index = self.current_image_index + offset
+            if not 0 <= index < len(self.images) or annotation_io.split_frame(self.images[index])[0] != path:
+                continue
+            # A newer prefetch for the same offset replaces one that hasn't started
+            self.tasks.submit(self.read_image, self.client, self.images[index], width, height,
+                              key=f"prefetch{offset}", lane="prefetch", on_error=lambda e: None)
+    
+    def windowed_image(self, settings=None):
+        """The display image rendered with window/level settings, automatic ones if None"""
+        if self.windowing is None:
+            # Quantized once per image, every later rendering is a table lookup
+            self.windowing = windowing.Windowing(self.display_source)
+            self.configure_window_scales(self.windowing.minimum, self.windowing.maximum, self.windowing.step)
+        settings = settings or self.windowing.auto_settings()
+        self.show_window_settings(settings)
+        return self.windowing.render(*settings)
+    
+    def configure_window_scales(self, minimum, maximum, step):
+        self.window_scales["Window"].config(from_=step, to=max(maximum - minimum, step))
+        self.window_scales["Level"].config(from_=minimum, to=maximum)
+    
+    def show_window_settings(self, settings):
+        window, level, gamma = settings
+        self.window_var.set(window)
+        self.level_var.set(level)
+        self.gamma_var.set(math.log10(gamma))
+        self.window_label.config(text=f"{window:.4g} / {level:.4g} / gamma {gamma:.2f}")
+    
+    def window_changed(self):
+        """Keep the slider settings for the current image and re-render it once Tk is idle"""
+        if self.current_image_data is None:
+            return
+        settings = (self.window_var.get(), self.level_var.get(), 10 ** self.gamma_var.get())
+        self.window_settings[self.images[self.current_image_index]] = settings
+        self.window_label.config(text=f"{settings[0]:.4g} / {settings[1]:.4g} / gamma {settings[2]:.2f}")
+        # Slider motion comes faster than frames, renders are coalesced
+        if not self.window_render_pending:
+            self.window_render_pending = True
+            self.root.after_idle(self.apply_windowing)
+    
+    def reset_windowing(self):
+        """Back to the automatic window of the current image"""
+        if self.current_image_data is None:
+            return
+        self.window_settings.pop(self.images[self.current_image_index], None)
+        self.apply_windowing()
+    
+    def apply_windowing(self):
+        """Show the current image with its window settings, without decoding it again"""
+        self.window_render_pending = False
+        if self.current_image_data is None:
+            return
+        self.current_image_data = self.windowed_image(self.window_settings.get(self.images[self.current_image_index]))
+        if self.overlay is not None:
+            self.overlay.set_base_image(self.current_image_data)
+        elif self.current_image is not None:
+            self.current_image.paste(self.current_image_data)
+    
+    def previous_frame(self, img_path):
+        """Image annotations are propagated from, or None
+
+        That is the previous frame of a multi-frame file, or for single
+        images the one before in dataset order if it is a single image
+        too. Neighbours in a work queue batch or a query result are
+        unrelated images, so the full dataset order is used.
+        """
+        path, frame = annotation_io.split_frame(img_path)
+        if frame is not None:
+            return annotation_io.frame_entry(path, frame - 1) if frame > 0 else None
+        images = self.all_images or self.images
+        index = images.index(img_path)
+        if index == 0 or annotation_io.split_frame(images[index - 1])[1] is not None:
+            return None
+        return images[index - 1]
+    
+    def propagate_from_previous(self):
+        """Add the keypoints and boxes of the previous image, tracked to where they moved"""
+        if self.current_image_data is None:
+            return
+        img_path = self.images[self.current_image_index]
+        previous = self.previous_frame(img_path)
+        if previous is None:
+            self.update_status("No previous frame to propagate from, only frames of a sequence and images "
+                               "that follow each other in the dataset can be propagated")
+            return
+        annotation_file = (annotation_io.annotation_path(self.dataset_path, previous)
+                           if self.client is None else None)
+        self.update_status(f"Propagating annotations from {os.path.basename(previous)}...")
+        # Navigating away drops the result, the matching runs in a worker
+        self.tasks.submit(self.propagation_worker, self.client, previous, self.display_size(), annotation_file,
+                          self.display_source, key="propagate",
+                          on_done=lambda result: self.propagation_done(img_path, previous, result),
+                          on_error=lambda e: messagebox.showerror("Error", f"Failed to propagate: {str(e)}"))
+    
+    def propagation_worker(self, client, previous, size, annotation_file, image):
+        """Template matching of the previous image's keypoints and boxes, runs in a worker"""
+        data = self.read_annotations(client, previous, annotation_file)
+        if not data:
+            return None
+        previous_image, _ = self.read_image(client, previous, *size)
+        return propagation.propagate(previous_image, image, data)
+    
+    def propagation_done(self, img_path, previous, result):
+        if self.current_image_data is None or img_path != self.images[self.current_image_index]:
+            return
+        if result is None:
+            self.update_status(f"{os.path.basename(previous)} has no annotations to propagate")
+            return
+        def present(existing, coords):
+            # Propagating again tracks to the same places, those are already here
+            return any(max(abs(a - b) for a, b in zip(annotation[1:], coords)) <= PROPAGATED_DUPLICATE_PX
+                       for annotation in existing.values())
+        
+        added = skipped = 0
+        for x, y, _ in result['keypoint']:
+            if present(self.keypoints, (int(x), int(y))):
+                skipped += 1
+                continue
+            keypoint = (self.ids.allocate("keypoint"), int(x), int(y))
+            self.keypoints[keypoint[0]] = keypoint
+            self.index_annotation("keypoint", keypoint)
+            self.show_annotation("keypoint", keypoint)
+            self.add_list_row("keypoint", keypoint)
+            self.record_op("add", "keypoint", keypoint[0])
+            added += 1
+        for x1, y1, x2, y2, _ in result['bbox']:
+            if present(self.bboxes, (int(x1), int(y1), int(x2), int(y2))):
+                skipped += 1
+                continue
+            bbox = (self.ids.allocate("bbox"), int(x1), int(y1), int(x2), int(y2))
+            self.bboxes[bbox[0]] = bbox
+            self.index_annotation("bbox", bbox)
+            self.show_annotation("bbox", bbox)
+            self.add_list_row("bbox", bbox)
+            self.record_op("add", "bbox", bbox[0])
+            added += 1
+        matched = [entry[-1] >= propagation.MIN_SCORE for kind in ('keypoint', 'bbox') for entry in result[kind]]
+        message = (f"Propagated {added} annotations from {os.path.basename(previous)}, "
+                   f"{matched.count(False)} not found and left in place")
+        if skipped:
+            message += f", {skipped} already present"
+        self.update_status(message)
+    
+    def switch_lease(self, name):
+        """Move our lease to another image, without waiting for the file system"""
+        if self.leases is None:
+            return
+        previous, self.leased_name = self.leased_name, name
+        self.tasks.submit(self.lease_worker, self.leases, previous, name, lane="leases",
+                          on_done=self.lease_checked)
+    
+    def lease_worker(self, leases, previous, name):
+        """Release the previous lease and acquire the new one, runs in a worker"""
+        if previous is not None and previous != name:
+            leases.release(previous)
+        held, record = leases.acquire(name)
+        return name, held, record
+    
+    def lease_checked(self, result):
+        """Tell the user if someone else is working on the image"""
+        name, held, record = result
+        if not held and name == self.leased_name:
+            owner = record.get('owner', "another annotator") if record else "another annotator"
+            self.update_status(f"{name} is being annotated by {owner}, saving will check for conflicts")
+    
+    def renew_leases(self):
+        """Heartbeat keeping our lease alive, other annotators see it expire if we crash"""
+        if self.leases is not None:
+            self.tasks.submit(self.leases.renew, lane="leases", on_done=self.leases_lost)
+        if self.work_queue is not None:
+            self.tasks.submit(self.work_queue.renew, lane="queue")
+        self.root.after(self.lease_heartbeat_ms, self.renew_leases)
+    
+    def leases_lost(self, lost):
+        """Warn when another annotator took over the image we are on"""
+        if self.leased_name in lost:
+            self.update_status(f"Lease on {self.leased_name} expired and was taken by another annotator")
+    
+    def setup_image_layer(self):
+        """Show the display image as a single photo, or as overlay tiles in raster mode"""
+        if self.overlay:
+            self.overlay.destroy()
+            self.overlay = None
+        self.canvas.delete("base_image")
+        
+        if self.raster_var.get():
+            self.current_image = None
+            self.overlay = raster_overlay.TiledOverlay(self.canvas, self.current_image_data, self.render_overlay_region)
+        else:
+            with tracer.span("photo_image"):
+                self.current_image = ImageTk.PhotoImage(self.current_image_data)
+            item = self.canvas.create_image(0, 0, anchor=tk.NW, image=self.current_image, tags="base_image")
+            self.canvas.tag_lower(item)
+    
+    def toggle_raster_overlay(self):
+        """Switch between canvas items and the rasterized overlay for the current image"""
+        if self.current_image_data is None:
+            return
+        self.canvas.delete("all")
+        self.curve_items = {}
+        self.bbox_items = {}
+        self.collapsed_keys = set()
+        self.deferred_keys = set()
+        self.live_keys = set()
+        self.setup_image_layer()
+        self.render_annotations()
+    
+    def step_index(self, step):
+        """Index of the neighbouring image in the direction of `step`, or None
+        
+        With Skip Near-Duplicates on, images whose group starts with
+        another image are passed over.
+        """
+        index = self.current_image_index + step
+        while 0 <= index < len(self.images):
+            group = self.duplicate_groups.get(self.images[index])
+            if not self.skip_duplicates_var.get() or group is None or group[0] == self.images[index]:
+                return index
+            index += step
+        return None
     
     def prev_image(self):
         """Go to the previous image"""
-        if self.current_image_index > 0:
+        index = self.step_index(-1)
+        if index is not None:
             self.prompt_save_annotations()
-            self.current_image_index -= 1
+            self.current_image_index = index
             self.load_image()
     
     def next_image(self):
         """Go to the next image"""
-        if self.current_image_index < len(self.images) - 1:
+        index = self.step_index(1)
+        if index is not None:
             self.prompt_save_annotations()
-            self.current_image_index += 1
+            self.current_image_index = index
             self.load_image()
+        elif self.work_queue is not None:
+            self.update_status("Claiming more images..." if self.queue_claiming else "No open images left in the queue")
+        if self.work_queue is not None and len(self.images) - self.current_image_index <= self.queue_prefetch:
+            self.claim_images()
+    
+    def toggle_work_queue(self):
+        """Switch between browsing the whole dataset and working through the shared queue"""
+        if self.queue_opening:
+            self.queue_var.set(True)
+            return
+        if not self.queue_var.get():
+            self.stop_work_queue()
+            return
+        if not self.dataset_path or not self.images:
+            self.queue_var.set(False)
+            messagebox.showinfo("Info", "Load a local dataset first")
+            return
+        # The queue hands out images of the whole dataset
+        self.clear_query()
+        self.update_status("Opening work queue...")
+        self.queue_opening = True
+        self.tasks.submit(self.open_work_queue, self.dataset_path, list(self.images), lane="queue",
+                          on_done=self.work_queue_opened,
+                          on_error=lambda e: self.work_queue_failed(f"Failed to open the work queue: {str(e)}"))
+    
+    def open_work_queue(self, dataset_path, images):
+        """Open the dataset's queue, add new images and claim a first batch, runs in a worker"""
+        if self.work_queue_path:
+            queue = work_queue.WorkQueue(self.work_queue_path)
+        else:
+            # Claim files work on the network shares datasets are shared on
+            queue = work_queue.ClaimFileQueue(os.path.join(dataset_path, "annotations", ".queue"))
+        names = [os.path.basename(p) for p in images]
+        done = [os.path.basename(p) for p in images
+                if os.path.exists(annotation_io.annotation_path(dataset_path, p))]
+        queue.populate(names, done)
+        return queue, queue.claim()
+    
+    def work_queue_opened(self, result):
+        queue, names = result
+        self.queue_opening = False
+        if not self.queue_var.get():
+            # Another dataset was loaded while opening
+            self.tasks.submit(queue.release, names, lane="queue")
+            return
+        if not names:
+            self.queue_var.set(False)
+            messagebox.showinfo("Work Queue", "No open images left in the queue")
+            return
+        self.prompt_save_annotations()
+        self.work_queue = queue
+        self.all_images = self.images
+        self.images = self.queued_paths(names)
+        self.current_image_index = 0
+        self.load_image()
+        self.update_status(f"Work queue: claimed {len(names)} images")
+    
+    def work_queue_failed(self, message):
+        self.queue_opening = False
+        self.queue_var.set(False)
+        messagebox.showerror("Error", message)
+    
+    def queued_paths(self, names):
+        """Image paths of claimed image names"""
+        by_name = {os.path.basename(p): p for p in self.all_images}
+        return [by_name[name] for name in names if name in by_name]
+    
+    def claim_images(self):
+        """Claim the next batch in the background, navigation never waits for the queue"""
+        if self.queue_claiming:
+            return
+        self.queue_claiming = True
+        queue = self.work_queue
+        self.tasks.submit(queue.claim, lane="queue",
+                          on_done=lambda names: self.images_claimed(queue, names),
+                          on_error=lambda e: self.images_claimed(queue, [], e))
+    
+    def images_claimed(self, queue, names, error=None):
+        self.queue_claiming = False
+        if queue is not self.work_queue:
+            self.tasks.submit(queue.release, names, lane="queue")
+            return
+        if error is not None:
+            self.update_status(f"Failed to claim images: {str(error)}")
+            return
+        self.images.extend(self.queued_paths(names))
+        self.image_counter.config(text=f"{self.current_image_index + 1}/{len(self.images)}")
+    
+    def stop_work_queue(self):
+        """Return unfinished claims and go back to the whole dataset"""
+        self.queue_var.set(False)
+        if self.work_queue is None:
+            return
+        self.tasks.submit(self.work_queue.release, lane="queue")
+        current = self.images[self.current_image_index] if self.images else None
+        self.images = self.all_images
+        self.work_queue = None
+        self.all_images = None
+        if current in self.images:
+            self.current_image_index = self.images.index(current)
+            self.image_counter.config(text=f"{self.current_image_index + 1}/{len(self.images)}")
+    
+    def show_queue_progress(self):
+        """Show how much of the shared queue is done"""
+        if self.work_queue is None:
+            messagebox.showinfo("Info", "Work queue mode is off")
+            return
+        self.tasks.submit(self.work_queue.stats, lane="queue",
+                          on_done=lambda stats: messagebox.showinfo(
+                              "Work Queue",
+                              f"Done: {stats['done']}\nClaimed: {stats['claimed']}\nOpen: {stats['open']}"))
     
     def set_annotation_mode(self):
         """Set the current annotation mode based on radio button selection"""
@@ -314,23 +1066,32 @@ class CocoAnnotator:
             self.annotation_mode = AnnotationMode.BBOX
         elif mode == "freehand":
             self.annotation_mode = AnnotationMode.FREEHAND
+        elif mode == "select":
+            self.annotation_mode = AnnotationMode.SELECT
+        
+        if self.annotation_mode != AnnotationMode.SELECT:
+            self.canvas.config(cursor="cross")
+            self.hover_key = None
         
         self.update_status(f"Annotation mode: {mode}")
     
+    @tracer.traced("click")
     def on_canvas_click(self, event):
         """Handle mouse click on the canvas"""
-        if self.current_image is None:
+        if self.current_image_data is None:
             return
         
         x, y = event.x, event.y
         
         if self.annotation_mode == AnnotationMode.KEYPOINT:
             # Add keypoint
-            keypoint_id = len(self.keypoints) + 1
+            keypoint_id = self.ids.allocate("keypoint")
             keypoint = (keypoint_id, x, y)
-            self.keypoints.append(keypoint)
-            self.draw_keypoint(keypoint)
-            self.update_keypoint_list()
+            self.keypoints[keypoint_id] = keypoint
+            self.index_annotation("keypoint", keypoint)
+            self.show_annotation("keypoint", keypoint)
+            self.add_list_row("keypoint", keypoint)
+            self.record_op("add", "keypoint", keypoint[0])
             
         elif self.annotation_mode == AnnotationMode.CURVE:
             # Start or continue a curve
@@ -357,6 +1118,22 @@ class CocoAnnotator:
             self.drawing = True
             self.freehand_points = [(x, y)]
             self.canvas.delete("temp_freehand")  # Clear any previous temporary drawing
+            
+            # Simplify while the stroke is captured; tolerance is given in image pixels
+            tolerance = self.get_simplify_tolerance() * self.image_scale
+            self.freehand_simplifier = StreamSimplifier(tolerance)
+            self.freehand_simplifier.add(x, y)
+        
+        elif self.annotation_mode == AnnotationMode.SELECT:
+            # Pick the annotation under the cursor and start editing it,
+            # or start a selection rectangle
+            key = self.pick_annotation(x, y)
+            self.drawing = True
+            if key:
+                self.select_annotations([key])
+                self.begin_edit(key, x, y)
+            else:
+                self.select_start = (x, y)
     
     # def on_canvas_drag(self, event):
     #     """Handle mouse drag on the canvas"""
@@ -384,12 +1161,29 @@ class CocoAnnotator:
     #             self.canvas.create_line(p1[0], p1[1], p2[0], p2[1], 
     #                                   fill="purple", width=2, tags="temp_freehand")
 
+    @tracer.traced("drag")
     def on_canvas_drag(self, event):
-        if not self.drawing or self.current_image is None or self.annotation_mode != AnnotationMode.FREEHAND:
+        if not self.drawing or self.current_image_data is None:
             return
         
         x, y = event.x, event.y
         
+        if self.annotation_mode == AnnotationMode.SELECT and self.edit_state:
+            self.update_edit(x, y)
+            return
+        
+        if self.annotation_mode == AnnotationMode.SELECT and self.select_start:
+            # Update selection rectangle preview
+            self.canvas.delete("temp_select")
+            self.canvas.create_rectangle(
+                self.select_start[0], self.select_start[1], x, y,
+                outline="orange", width=1, dash=(3, 3), tags="temp_select"
+            )
+            return
+        
+        if self.annotation_mode != AnnotationMode.FREEHAND:
+            return
+        
         # Only add point if it's at least N pixels away from last point
         if self.freehand_points:
             last_x, last_y = self.freehand_points[-1]
@@ -398,6 +1192,8 @@ class CocoAnnotator:
                 return
         
         self.freehand_points.append((x, y))
+        if self.freehand_simplifier:
+            self.freehand_simplifier.add(x, y)
         
         # Only draw the new line segment
         if len(self.freehand_points) > 1:
@@ -406,9 +1202,10 @@ class CocoAnnotator:
             self.canvas.create_line(p1[0], p1[1], p2[0], p2[1], 
                                 fill="purple", width=2, tags="temp_freehand")
     
+    @tracer.traced("release")
     def on_canvas_release(self, event):
         """Handle mouse release on the canvas"""
-        if not self.drawing or self.current_image is None:
+        if not self.drawing or self.current_image_data is None:
             return
         
         x, y = event.x, event.y
@@ -418,10 +1215,13 @@ class CocoAnnotator:
             if len(self.curve_points) > 1 and abs(x - self.curve_points[0][0]) < 10 and abs(y - self.curve_points[0][1]) < 10:
                 # Close the curve
                 self.canvas.delete("temp_curve")
-                curve_id = len(self.curves) + 1
-                self.curves.append((curve_id, self.curve_points[:]))
-                self.draw_curve((curve_id, self.curve_points))
-                self.update_curve_list()
+                curve_id = self.ids.allocate("curve")
+                curve = (curve_id, self.curve_points[:])
+                self.curves[curve_id] = curve
+                self.index_annotation("curve", curve)
+                self.show_annotation("curve", curve)
+                self.add_list_row("curve", curve)
+                self.record_op("add", "curve", curve[0])
                 self.drawing = False
                 self.curve_points = []
         
@@ -438,11 +1238,13 @@ class CocoAnnotator:
             
             # Ignore very small boxes (probably misclicks)
             if (x2 - x1) > 5 and (y2 - y1) > 5:
-                bbox_id = len(self.bboxes) + 1
+                bbox_id = self.ids.allocate("bbox")
                 bbox = (bbox_id, x1, y1, x2, y2)
-                self.bboxes.append(bbox)
-                self.draw_bbox(bbox)
-                self.update_bbox_list()
+                self.bboxes[bbox_id] = bbox
+                self.index_annotation("bbox", bbox)
+                self.show_annotation("bbox", bbox)
+                self.add_list_row("bbox", bbox)
+                self.record_op("add", "bbox", bbox[0])
             
             self.bbox_start = None
             
@@ -454,71 +1256,342 @@ class CocoAnnotator:
             if len(self.freehand_points) > 2:
                 self.canvas.delete("temp_freehand")
                 
-                # Apply Chaikin's corner cutting algorithm for smoothing
-                smoothed_points = self.apply_bspline_smoothing(
-                    self.freehand_points, 
-                    self.smooth_iterations_var.get()
-                )
+                # Keep only the simplified control points, the smooth curve
+                # is re-tessellated from them whenever it is drawn
+                control_points = self.freehand_simplifier.finish()
+                if len(control_points) < 2:
+                    control_points = [self.freehand_points[0], self.freehand_points[-1]]
+                smoothing_spec = {
+                    'method': self.smooth_method_var.get(),
+                    'degree': self.smooth_degree_var.get(),
+                    'iterations': self.smooth_iterations_var.get(),
+                }
+                # The smooth curve must stay as close to the stroke as the simplified points do
+                control_points = fit_freehand(self.freehand_points, control_points, smoothing_spec,
+                                              self.freehand_simplifier.tolerance)
                 
-                # Save the smoothed curve
-                curve_id = len(self.freehand_curves) + 1
-                self.freehand_curves.append((curve_id, smoothed_points))
+                # Save the curve
+                curve_id = self.ids.allocate("freehand")
+                curve = (curve_id, control_points, smoothing_spec)
+                self.freehand_curves[curve_id] = curve
                 
                 # Draw the final smooth curve
-                self.draw_freehand_curve((curve_id, smoothed_points))
+                self.index_annotation("freehand", curve)
+                self.show_annotation("freehand", curve)
                 
-                # Update the freehand curves list
-                self.update_freehand_list()
+                # Add the curve to the freehand curves list
+                self.add_list_row("freehand", curve)
+                self.record_op("add", "freehand", curve[0])
             
             self.freehand_points = []
+            self.freehand_simplifier = None
+        
+        elif self.annotation_mode == AnnotationMode.SELECT and self.select_start:
+            # Select everything intersecting the selection rectangle
+            self.drawing = False
+            self.canvas.delete("temp_select")
+            x0, y0 = self.to_image_coords(*self.select_start)
+            x1, y1 = self.to_image_coords(x, y)
+            self.select_annotations(self.spatial_index.query_rect(x0, y0, x1, y1))
+            self.select_start = None
+        
+        elif self.annotation_mode == AnnotationMode.SELECT:
+            self.drawing = False
+            if self.edit_state:
+                self.finish_edit()
+    
+    def on_canvas_motion(self, event):
+        """Give hover feedback for the annotation under the cursor in select mode"""
+        if self.annotation_mode != AnnotationMode.SELECT or self.drawing:
+            return
+        
+        key = self.pick_annotation(event.x, event.y)
+        if key == self.hover_key:
+            return
+        self.hover_key = key
+        self.canvas.config(cursor="hand2" if key else "cross")
+        if key:
+            self.update_status(f"{key[0]} {key[1]}")
+    
+    def annotation_map(self, kind):
+        """The id -> annotation map holding annotations of a kind"""
+        return self.doc.annotations[kind]
+    
+    def get_annotation(self, key):
+        """Look up an annotation by its (kind, id) key, or None"""
+        return self.annotation_map(key[0]).get(key[1])
+    
+    def begin_edit(self, key, x, y):
+        """Start dragging a vertex, a bbox corner or a whole annotation"""
+        kind, annotation_id = key
+        annotation = self.get_annotation(key)
+        if annotation is None:
+            return
+        
+        # In raster mode the edited annotation is taken out of the overlay and
+        # shown as live canvas items until the drag is finished
+        if self.overlay and key not in self.live_keys:
+            self.invalidate_annotation(key)
+            self.live_keys.add(key)
+            self.draw_annotation(kind, annotation, full_detail=True)
+        
+        # Curves collapsed by the level-of-detail rules are drawn in full for editing
+        elif key in self.collapsed_keys:
+            self.collapsed_keys.discard(key)
+            self.canvas.delete(self.annotation_tag(kind, annotation_id))
+            self.draw_annotation(kind, annotation, full_detail=True)
+        
+        # Grab a handle when the press is on one, otherwise move the whole annotation
+        action, handle = "move", None
+        if kind == "curve":
+            handle = editing.nearest_vertex(annotation[1], x, y, self.pick_radius)
+            if handle is not None:
+                action = "vertex"
+        elif kind == "bbox":
+            handle = editing.bbox_corner_at(*annotation[1:], x, y, self.pick_radius)
+            if handle is not None:
+                action = "corner"
+        
+        self.edit_state = {
+            'key': key,
+            'action': action,
+            'handle': handle,
+            'start': (x, y),
+            'last': (x, y),
+            'bbox': annotation[1:] if kind == "bbox" else None,
+            'points': annotation[1] if kind == "curve" else None,
+        }
+        self.canvas.delete("selection")
+    
+    def update_edit(self, x, y):
+        """Apply a drag step, only touching the canvas items that changed"""
+        state = self.edit_state
+        kind, annotation_id = state['key']
+        
+        if state['action'] == "vertex":
+            # Only the two segments meeting at the vertex are redrawn
+            points = state['points']
+            i = state['handle']
+            points[i] = (x, y)
+            segments, label = self.curve_items[annotation_id]
+            for seg in ((i - 1) % len(points), i):
+                p1, p2 = points[seg], points[(seg + 1) % len(points)]
+                self.canvas.coords(segments[seg], p1[0], p1[1], p2[0], p2[1])
+            if i == 0 and label:
+                self.canvas.coords(label, x, y - 15)
+        
+        elif state['action'] == "corner":
+            x1, y1, x2, y2 = editing.move_bbox_corner(*state['bbox'], state['handle'], x, y)
+            rect, label = self.bbox_items[annotation_id]
+            self.canvas.coords(rect, x1, y1, x2, y2)
+            if label:
+                self.canvas.coords(label, x1, y1 - 10)
+            state['current'] = (x1, y1, x2, y2)
+        
+        else:
+            last_x, last_y = state['last']
+            self.canvas.move(self.annotation_tag(kind, annotation_id), x - last_x, y - last_y)
+        
+        state['last'] = (x, y)
+    
+    def finish_edit(self):
+        """Store the result of a drag in the annotation data and its index"""
+        state = self.edit_state
+        self.edit_state = None
+        kind, annotation_id = state['key']
+        annotations = self.annotation_map(kind)
+        annotation = annotations.get(annotation_id)
+        if annotation is None:
+            return
+        
+        if state['action'] == "corner":
+            if 'current' in state:
+                annotations[annotation_id] = (annotation_id,) + state['current']
+        elif state['action'] == "move":
+            dx = state['last'][0] - state['start'][0]
+            dy = state['last'][1] - state['start'][1]
+            if dx == 0 and dy == 0:
+                pass  # Plain click, nothing moved
+            elif kind == "keypoint":
+                annotations[annotation_id] = (annotation_id, annotation[1] + dx, annotation[2] + dy)
+            elif kind == "bbox":
+                _, x1, y1, x2, y2 = annotation
+                annotations[annotation_id] = (annotation_id, x1 + dx, y1 + dy, x2 + dx, y2 + dy)
+            else:
+                points = [(px + dx, py + dy) for px, py in annotation[1]]
+                annotations[annotation_id] = (annotation_id, points) + annotation[2:]
+        changed = annotations[annotation_id] is not annotation
+        
+        if self.overlay:
+            # Put the annotation back into the overlay, invalidating old and new bounds
+            self.invalidate_annotation(state['key'])
+            self.canvas.delete(self.annotation_tag(kind, annotation_id))
+            self.live_keys.discard(state['key'])
+        self.index_annotation(kind, annotations[annotation_id])
+        if self.overlay:
+            self.invalidate_annotation(state['key'])
+        self.select_annotations([state['key']])
+        if not changed:
+            return  # A click without a drag, nothing to save or send
+        self.update_list_row(kind, annotations[annotation_id])
+        self.record_op("update", kind, annotation_id)
+    
+    def annotation_tag(self, kind, annotation_id):
+        """Canvas tag shared by all items of an annotation"""
+        prefix = {"keypoint": "kp", "curve": "curve", "bbox": "bbox", "freehand": "freehand"}[kind]
+        return f"{prefix}_{annotation_id}"
+    
+    def show_annotation(self, kind, annotation):
+        """Display a newly committed or edited annotation"""
+        key = (kind, annotation[0])
+        if self.overlay and key not in self.live_keys:
+            self.invalidate_annotation(key)
+        else:
+            self.draw_annotation(kind, annotation, full_detail=True)
+    
+    def invalidate_annotation(self, key):
+        """Re-render the overlay region covered by an annotation"""
+        bounds = self.spatial_index.bounds(key)
+        if not self.overlay or bounds is None:
+            return
+        # Pad for point markers, line widths and labels drawn above the shape
+        x1, y1, x2, y2 = [v * self.image_scale for v in bounds]
+        self.overlay.invalidate(x1 - 20, y1 - 25, x2 + 20, y2 + 20)
+    
+    def remove_annotation_view(self, kind, annotation_id):
+        """Remove an annotation from the canvas and from the spatial index"""
+        key = (kind, annotation_id)
+        if self.overlay and key not in self.live_keys:
+            self.invalidate_annotation(key)
+        else:
+            self.canvas.delete(self.annotation_tag(kind, annotation_id))
+        self.spatial_index.remove(key)
+        if kind == "curve":
+            self.curve_items.pop(annotation_id, None)
+        elif kind == "bbox":
+            self.bbox_items.pop(annotation_id, None)
+        self.deferred_keys.discard(key)
+        self.collapsed_keys.discard(key)
+        self.live_keys.discard(key)
+    
+    def render_overlay_region(self, image, box):
+        """Draw the committed annotations intersecting a display region into an image tile"""
+        ox, oy, ox2, oy2 = box
+        keys = self.spatial_index.query_rect(*self.to_image_coords(ox - 20, oy - 20),
+                                             *self.to_image_coords(ox2 + 20, oy2 + 25))
+        draw = ImageDraw.Draw(image)
+        points = []
+        labels = []
+        for key in keys:
+            annotation = self.get_annotation(key)
+            if annotation is None or key in self.live_keys:
+                continue
+            kind, annotation_id = key
+            if kind == "keypoint":
+                _, x, y = annotation
+                points.append((x - ox, y - oy))
+                labels.append((x - ox, y - oy - 15, str(annotation_id)))
+            elif kind == "bbox":
+                _, x1, y1, x2, y2 = annotation
+                draw.rectangle([x1 - ox, y1 - oy, x2 - ox, y2 - oy], outline=(0, 0, 255), width=2)
+                labels.append((x1 - ox, y1 - oy - 10, str(annotation_id)))
+            else:
+                if kind == "curve":
+                    line = annotation[1] + annotation[1][:1]
+                    color = (0, 128, 0)
+                else:
+                    line = self.tessellate_freehand(annotation[1], annotation[2])
+                    color = (128, 0, 128)
+                    annotation_id = f"F{annotation_id}"
+                if len(line) >= 2:
+                    draw.line([(x - ox, y - oy) for x, y in line], fill=color, width=2)
+                labels.append((line[0][0] - ox, line[0][1] - oy - 15, str(annotation_id)))
+        
+        # Keypoints are stamped in bulk, labels go on top of everything
+        image = raster_overlay.stamp_points(image, points)
+        if self.show_labels and labels:
+            draw = ImageDraw.Draw(image)
+            font = raster_overlay.label_font()
+            for x, y, text in labels:
+                draw.text((x - 3 * len(text), y - 5), text, fill=(0, 0, 0), font=font)
+        return image
+    
+    def to_image_coords(self, x, y):
+        """Convert display coordinates to original image coordinates"""
+        return x / self.image_scale, y / self.image_scale
+    
+    def index_annotation(self, kind, annotation):
+        """Add or update an annotation in the spatial index"""
+        key = (kind, annotation[0])
+        if kind == "keypoint":
+            _, x, y = annotation
+            self.spatial_index.insert_point(key, *self.to_image_coords(x, y))
+        elif kind == "bbox":
+            _, x1, y1, x2, y2 = annotation
+            self.spatial_index.insert_rect(key, *self.to_image_coords(x1, y1), *self.to_image_coords(x2, y2))
+        else:
+            points = [self.to_image_coords(x, y) for x, y in annotation[1]]
+            self.spatial_index.insert_polyline(key, points, closed=(kind == "curve"))
+    
+    def pick_annotation(self, x, y):
+        """Find the annotation nearest to a canvas position, or None"""
+        radius = self.pick_radius / self.image_scale
+        key, _ = self.spatial_index.nearest(*self.to_image_coords(x, y), radius)
+        return key
+    
+    def select_annotations(self, keys):
+        """Highlight annotations on the canvas and show the first one in its list"""
+        self.selected_keys = list(keys)
+        self.canvas.delete("selection")
+        for key in self.selected_keys:
+            bounds = self.spatial_index.bounds(key)
+            if bounds is None:
+                continue
+            x1, y1, x2, y2 = [v * self.image_scale for v in bounds]
+            self.canvas.create_rectangle(x1 - 4, y1 - 4, x2 + 4, y2 + 4,
+                                         outline="orange", width=2, dash=(4, 2), tags="selection")
+        
+        if not self.selected_keys:
+            self.update_status("Nothing selected")
+            return
+        
+        kind, annotation_id = self.selected_keys[0]
+        annotation_list, tab_index = self.annotation_lists[kind]
+        self.annotation_tabs.select(tab_index)
+        annotation_list.select(annotation_id)
+        self.update_status(f"Selected {len(self.selected_keys)} annotation(s)")
+    
+    def get_simplify_tolerance(self):
+        """Get the freehand simplification tolerance in image pixels"""
+        try:
+            return max(0.0, float(self.simplify_tolerance_var.get()))
+        except (tk.TclError, ValueError):
+            return 1.5
+    
+    def tessellate_freehand(self, control_points, smoothing_spec):
+        """Generate the display points of a freehand curve from its control points"""
+        return tessellate_freehand(control_points, smoothing_spec)
 
-    def apply_bspline_smoothing(self, points, degree=3):
+    def apply_bspline_smoothing(self, points, degree=3, num_points=None, method="auto"):
         """Apply B-spline interpolation for smoother curves"""
-        if len(points) < degree + 1:
+        if len(points) < 3:
             return points
         
-        try:
-            import scipy.interpolate as interpolate
-            import numpy as np
-            
-            # Convert points to numpy arrays
-            points_array = np.array(points)
-            x = points_array[:, 0]
-            y = points_array[:, 1]
-            
-            # Parameter t based on cumulative distance
-            t = np.zeros(len(points))
-            for i in range(1, len(points)):
-                dx = points[i][0] - points[i-1][0]
-                dy = points[i][1] - points[i-1][1]
-                t[i] = t[i-1] + (dx**2 + dy**2)**0.5
-            
-            # Normalize t to [0, 1]
-            if t[-1] > 0:
-                t = t / t[-1]
-            
-            # Create a B-spline representation
-            tck, _ = interpolate.splprep([x, y], s=0, k=min(degree, len(points)-1))
-            
-            # Evaluate the spline at more points for smoothness
-            num_points = max(len(points) * 2, 50)
-            u_new = np.linspace(0, 1, num_points)
-            x_new, y_new = interpolate.splev(u_new, tck)
-            
-            # Convert back to list of tuples
-            return [(int(x_new[i]), int(y_new[i])) for i in range(len(x_new))]
-        except ImportError:
-            # Fallback to Chaikin if scipy is not available
-            return self.apply_chaikin_smoothing(points, iterations=3)
+        # Degree comes from the spinbox, where 0 means no smoothing
+        if degree < 1:
+            return points
+        
+        return smoothing.smooth_points(points, method, degree, num_points=num_points)
     
-    def draw_keypoint(self, keypoint):
+    def draw_keypoint(self, keypoint, label=True):
         """Draw a keypoint on the canvas"""
         _, x, y = keypoint
         keypoint_id = f"kp_{keypoint[0]}"
         self.canvas.create_oval(x-5, y-5, x+5, y+5, fill="red", tags=keypoint_id)
-        self.canvas.create_text(x, y-15, text=str(keypoint[0]), tags=keypoint_id)
+        if label:
+            self.canvas.create_text(x, y-15, text=str(keypoint[0]), tags=keypoint_id)
     
-    def draw_curve(self, curve):
+    def draw_curve(self, curve, label=True):
         """Draw a curve on the canvas"""
         curve_id, points = curve
         tag = f"curve_{curve_id}"
@@ -526,32 +1599,39 @@ class CocoAnnotator:
         if len(points) < 2:
             return
             
-        # Draw line segments
+        # Draw line segments, keeping their ids so a vertex drag only updates two of them
+        segments = []
         for i in range(len(points) - 1):
             p1 = points[i]
             p2 = points[i+1]
-            self.canvas.create_line(p1[0], p1[1], p2[0], p2[1], fill="green", width=2, tags=tag)
+            segments.append(self.canvas.create_line(p1[0], p1[1], p2[0], p2[1], fill="green", width=2, tags=tag))
         
         # Close the curve
         p1 = points[-1]
         p2 = points[0]
-        self.canvas.create_line(p1[0], p1[1], p2[0], p2[1], fill="green", width=2, tags=tag)
+        segments.append(self.canvas.create_line(p1[0], p1[1], p2[0], p2[1], fill="green", width=2, tags=tag))
         
         # Draw curve ID
-        if points:
-            self.canvas.create_text(points[0][0], points[0][1]-15, text=str(curve_id), tags=tag)
+        label_item = None
+        if label:
+            label_item = self.canvas.create_text(points[0][0], points[0][1]-15, text=str(curve_id), tags=tag)
+        self.curve_items[curve_id] = (segments, label_item)
     
-    def draw_bbox(self, bbox):
+    def draw_bbox(self, bbox, label=True):
         """Draw a bounding box on the canvas"""
         bbox_id, x1, y1, x2, y2 = bbox
         tag = f"bbox_{bbox_id}"
-        self.canvas.create_rectangle(x1, y1, x2, y2, outline="blue", width=2, tags=tag)
-        self.canvas.create_text(x1, y1-10, text=str(bbox_id), tags=tag, anchor="w")
+        rect = self.canvas.create_rectangle(x1, y1, x2, y2, outline="blue", width=2, tags=tag)
+        label_item = None
+        if label:
+            label_item = self.canvas.create_text(x1, y1-10, text=str(bbox_id), tags=tag, anchor="w")
+        self.bbox_items[bbox_id] = (rect, label_item)
     
-    def draw_freehand_curve(self, curve):
+    def draw_freehand_curve(self, curve, label=True):
         """Draw a freehand curve with improved rendering"""
-        curve_id, points = curve
+        curve_id, control_points, smoothing_spec = curve
         tag = f"freehand_{curve_id}"
+        points = self.tessellate_freehand(control_points, smoothing_spec)
         
         if len(points) < 2:
             return
@@ -574,191 +1654,248 @@ class CocoAnnotator:
                                   fill="purple", width=2, tags=tag)
         
         # Draw curve ID
-        if points:
+        if label:
             self.canvas.create_text(points[0][0], points[0][1]-15, 
                                   text=f"F{curve_id}", tags=tag)
     
+    def draw_annotation(self, kind, annotation, full_detail=False):
+        """Draw an annotation following the level-of-detail rules"""
+        key = (kind, annotation[0])
+        if kind == "keypoint":
+            self.draw_keypoint(annotation, self.show_labels)
+            return
+        if kind == "bbox":
+            self.draw_bbox(annotation, self.show_labels)
+            return
+        
+        # Curves that would only cover a few pixels are drawn as their bounding box
+        bounds = self.spatial_index.bounds(key)
+        if not full_detail and bounds is not None:
+            x1, y1, x2, y2 = [v * self.image_scale for v in bounds]
+            if max(x2 - x1, y2 - y1) < self.tiny_curve_px:
+                color = "green" if kind == "curve" else "purple"
+                self.canvas.create_rectangle(x1, y1, x2, y2, outline=color,
+                                             tags=self.annotation_tag(kind, annotation[0]))
+                self.collapsed_keys.add(key)
+                return
+        
+        if kind == "curve":
+            self.draw_curve(annotation, self.show_labels)
+        else:
+            self.draw_freehand_curve(annotation, self.show_labels)
+    
+    def render_annotations(self):
+        """Draw all loaded annotations, skipping the ones outside the viewport"""
+        self.render_generation += 1
+        self.collapsed_keys = set()
+        
+        total = len(self.keypoints) + len(self.curves) + len(self.bboxes) + len(self.freehand_curves)
+        self.show_labels = self.image_scale >= self.label_min_scale or total <= self.label_always_count
+        
+        if self.overlay:
+            # Everything is composited into the overlay tiles, no canvas items needed
+            self.deferred_keys = set()
+            self.overlay.invalidate_all()
+            return
+        
+        visible = set(self.spatial_index.query_rect(*self.viewport_bounds()))
+        pending = []
+        self.deferred_keys = set()
+        for kind, annotations in (("bbox", self.bboxes), ("curve", self.curves),
+                                  ("freehand", self.freehand_curves), ("keypoint", self.keypoints)):
+            for annotation in annotations.values():
+                key = (kind, annotation[0])
+                if key in visible:
+                    pending.append((kind, annotation))
+                else:
+                    self.deferred_keys.add(key)
+        
+        self.draw_annotation_batch(pending, 0, self.render_generation)
+    
+    def draw_annotation_batch(self, pending, start, generation):
+        """Draw one batch of annotations and schedule the next one"""
+        if generation != self.render_generation:
+            return  # A newer image or render replaced this one
+        
+        end = min(start + self.draw_batch_size, len(pending))
+        for kind, annotation in pending[start:end]:
+            self.draw_annotation(kind, annotation)
+        
+        if end < len(pending):
+            self.root.after(1, self.draw_annotation_batch, pending, end, generation)
+    
+    def viewport_bounds(self):
+        """Visible part of the canvas in original image coordinates"""
+        x1 = self.canvas.canvasx(0)
+        y1 = self.canvas.canvasy(0)
+        x2 = x1 + max(self.canvas.winfo_width(), 1)
+        y2 = y1 + max(self.canvas.winfo_height(), 1)
+        return (*self.to_image_coords(x1, y1), *self.to_image_coords(x2, y2))
+    
+    def on_canvas_configure(self, event):
+        """Draw annotations that became visible after the canvas was resized"""
+        if not self.deferred_keys:
+            return
+        visible = self.deferred_keys.intersection(self.spatial_index.query_rect(*self.viewport_bounds()))
+        for key in visible:
+            annotation = self.get_annotation(key)
+            if annotation is not None:
+                self.draw_annotation(key[0], annotation)
+        self.deferred_keys -= visible
+    
+    def list_row(self, kind, annotation):
+        """Values shown in the list row of an annotation"""
+        if kind in ("curve", "freehand"):
+            return (annotation[0], f"{len(annotation[1])} points")
+        return tuple(annotation)
+    
+    def add_list_row(self, kind, annotation):
+        """Append the row of a new annotation to its list"""
+        self.annotation_lists[kind][0].add(annotation[0], self.list_row(kind, annotation))
+    
+    def update_list_row(self, kind, annotation):
+        """Refresh the row of an edited annotation"""
+        self.annotation_lists[kind][0].update(annotation[0], self.list_row(kind, annotation))
+    
     def update_keypoint_list(self):
         """Update the keypoints in the treeview"""
-        self.keypoints_tree.delete(*self.keypoints_tree.get_children())
-        for kp in self.keypoints:
-            kp_id, x, y = kp
-            self.keypoints_tree.insert("", "end", values=(kp_id, x, y))
+        self.annotation_lists["keypoint"][0].set_rows(
+            (kp[0], self.list_row("keypoint", kp)) for kp in self.keypoints.values())
     
     def update_curve_list(self):
         """Update the curves in the treeview"""
-        self.curves_tree.delete(*self.curves_tree.get_children())
-        for curve in self.curves:
-            curve_id, points = curve
-            points_str = f"{len(points)} points"
-            self.curves_tree.insert("", "end", values=(curve_id, points_str))
+        self.annotation_lists["curve"][0].set_rows(
+            (curve[0], self.list_row("curve", curve)) for curve in self.curves.values())
     
     def update_bbox_list(self):
         """Update the bounding boxes in the treeview"""
-        self.bbox_tree.delete(*self.bbox_tree.get_children())
-        for bbox in self.bboxes:
-            bbox_id, x1, y1, x2, y2 = bbox
-            self.bbox_tree.insert("", "end", values=(bbox_id, x1, y1, x2, y2))
+        self.annotation_lists["bbox"][0].set_rows(
+            (bbox[0], self.list_row("bbox", bbox)) for bbox in self.bboxes.values())
     
     def update_freehand_list(self):
         """Update the freehand curves in the treeview"""
-        self.freehand_tree.delete(*self.freehand_tree.get_children())
-        for curve in self.freehand_curves:
-            curve_id, points = curve
-            points_str = f"{len(points)} points"
-            self.freehand_tree.insert("", "end", values=(curve_id, points_str))
+        self.annotation_lists["freehand"][0].set_rows(
+            (curve[0], self.list_row("freehand", curve)) for curve in self.freehand_curves.values())
     
     def clear_annotation_lists(self):
         """Clear all annotation lists"""
-        self.keypoints_tree.delete(*self.keypoints_tree.get_children())
-        self.curves_tree.delete(*self.curves_tree.get_children())
-        self.bbox_tree.delete(*self.bbox_tree.get_children())
-        self.freehand_tree.delete(*self.freehand_tree.get_children())
+        for annotation_list, _ in self.annotation_lists.values():
+            annotation_list.clear()
     
     def delete_annotation(self, annotation_type):
         """Delete the selected annotation"""
-        if annotation_type == "keypoint":
-            selected = self.keypoints_tree.selection()
-            if selected:
-                idx = self.keypoints_tree.index(selected[0])
-                if 0 <= idx < len(self.keypoints):
-                    kp_id = self.keypoints[idx][0]
-                    self.canvas.delete(f"kp_{kp_id}")
-                    del self.keypoints[idx]
-                    self.update_keypoint_list()
-        
-        elif annotation_type == "curve":
-            selected = self.curves_tree.selection()
-            if selected:
-                idx = self.curves_tree.index(selected[0])
-                if 0 <= idx < len(self.curves):
-                    curve_id = self.curves[idx][0]
-                    self.canvas.delete(f"curve_{curve_id}")
-                    del self.curves[idx]
-                    self.update_curve_list()
-        
-        elif annotation_type == "bbox":
-            selected = self.bbox_tree.selection()
-            if selected:
-                idx = self.bbox_tree.index(selected[0])
-                if 0 <= idx < len(self.bboxes):
-                    bbox_id = self.bboxes[idx][0]
-                    self.canvas.delete(f"bbox_{bbox_id}")
-                    del self.bboxes[idx]
-                    self.update_bbox_list()
-                    
-        elif annotation_type == "freehand":
-            selected = self.freehand_tree.selection()
-            if selected:
-                idx = self.freehand_tree.index(selected[0])
-                if 0 <= idx < len(self.freehand_curves):
-                    curve_id = self.freehand_curves[idx][0]
-                    self.canvas.delete(f"freehand_{curve_id}")
-                    del self.freehand_curves[idx]
-                    self.update_freehand_list()
+        self.canvas.delete("selection")
+        annotation_list, _ = self.annotation_lists[annotation_type]
+        annotation_id = annotation_list.selected_key()
+        if annotation_id is None:
+            return
+        
+        if self.annotation_map(annotation_type).pop(annotation_id, None) is not None:
+            self.remove_annotation_view(annotation_type, annotation_id)
+        annotation_list.remove(annotation_id)
+        self.record_op("delete", annotation_type, annotation_id)
     
     def get_annotation_filename(self):
         """Get the annotation filename for the current image"""
-        if not self.current_image_index >= 0 or not self.images:
+        if not self.current_image_index >= 0 or not self.images or self.client is not None:
             return None
-            
-        img_path = self.images[self.current_image_index]
-        img_name = os.path.basename(img_path)
-        base_name = os.path.splitext(img_name)[0]
-        
-        # Create annotations directory if it doesn't exist
-        annotations_dir = os.path.join(self.dataset_path, "annotations")
-        os.makedirs(annotations_dir, exist_ok=True)
-        
-        return os.path.join(annotations_dir, f"{base_name}.json")
+        return annotation_io.annotation_path(self.dataset_path, self.images[self.current_image_index])
     
 
+    @tracer.traced("save")
     def save_annotations(self):
         """Save annotations for the current image"""
-        if self.current_image_index < 0 or not self.images:
+        if self.current_image_index < 0 or not self.images or self.current_image_data is None:
             messagebox.showinfo("Info", "No image loaded")
             return
         
-        # Load original image to get true dimensions
-        original_img_path = self.images[self.current_image_index]
-        original_image = Image.open(original_img_path)
-        orig_width, orig_height = original_image.size
-        
-        # Current display dimensions
-        display_width, display_height = self.current_image_data.width, self.current_image_data.height
-        
-        # Create normalized annotations
-        normalized_keypoints = []
-        for kp in self.keypoints:
-            kp_id, x, y = kp
-            # Convert to normalized coordinates (0-1 range)
-            norm_x = x / display_width
-            norm_y = y / display_height
-            normalized_keypoints.append({'id': kp_id, 'x': norm_x, 'y': norm_y})
-        
-        normalized_curves = []
-        for curve in self.curves:
-            curve_id, points = curve
-            normalized_points = []
-            for x, y in points:
-                norm_x = x / display_width
-                norm_y = y / display_height
-                normalized_points.append({'x': norm_x, 'y': norm_y})
-            normalized_curves.append({'id': curve_id, 'points': normalized_points})
-        
-        normalized_bboxes = []
-        for bbox in self.bboxes:
-            bbox_id, x1, y1, x2, y2 = bbox
-            norm_x1 = x1 / display_width
-            norm_y1 = y1 / display_height
-            norm_x2 = x2 / display_width
-            norm_y2 = y2 / display_height
-            normalized_bboxes.append({
-                'id': bbox_id, 
-                'x1': norm_x1, 
-                'y1': norm_y1, 
-                'x2': norm_x2, 
-                'y2': norm_y2
-            })
-        
-        # Add normalized freehand curves
-        normalized_freehand = []
-        for curve in self.freehand_curves:
-            curve_id, points = curve
-            normalized_points = []
-            for x, y in points:
-                norm_x = x / display_width
-                norm_y = y / display_height
-                normalized_points.append({'x': norm_x, 'y': norm_y})
-            normalized_freehand.append({'id': curve_id, 'points': normalized_points})
+        if self.sync is not None:
+            # Changes are pushed to the server as they are made, just don't wait for the batch
+            self.sync.flush()
+            self.update_status("Sent changes to the server")
+            return
+        
+        # True dimensions were recorded when the image was decoded
+        orig_width, orig_height = self.original_size
         
         # Store both normalized coordinates and original image dimensions
-        annotation_data = {
+        annotation_data = self.doc.to_data()
+        annotation_data.update({
             'image': os.path.basename(self.images[self.current_image_index]),
             'image_width': orig_width,
             'image_height': orig_height,
-            'keypoints': normalized_keypoints,
-            'curves': normalized_curves,
-            'bboxes': normalized_bboxes,
-            'freehand_curves': normalized_freehand
-        }
+        })
         
         annotation_file = self.get_annotation_filename()
         if not annotation_file:
             return
-            
-        try:
-            with open(annotation_file, 'w') as f:
-                json.dump(annotation_data, f, indent=2)
-                
-            self.update_status(f"Saved annotations to {os.path.basename(annotation_file)}")
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to save annotations: {str(e)}")
+        
+        # The file must still be at the revision it was loaded at, otherwise
+        # another annotator saved in between and we ask how to resolve it
+        base = self.loaded_data
+        annotation_data['revision'] = annotation_io.file_revision(base) + 1
+        self.loaded_data = annotation_data
+        self.write_checked(annotation_file, annotation_data, base, annotation_io.file_revision(base))
+    
+    def write_checked(self, path, data, base, base_revision):
+        """Save on the io lane, so reopening the image reads the saved file"""
+        self.tasks.submit(annotation_io.write_annotation_file_checked, path, data, base_revision, lane="io",
+                          on_done=lambda path: self.annotations_saved(path, data),
+                          on_error=lambda e: self.save_failed(e, path, data, base))
+    
+    def annotations_saved(self, path, data):
+        self.update_status(f"Saved annotations to {os.path.basename(path)}")
+        if self.annotation_index is not None:
+            annotation_query.update_row(self.annotation_index, data['image'], data)
+        if self.work_queue is not None:
+            self.tasks.submit(self.work_queue.complete, data['image'], lane="queue")
+    
+    def save_failed(self, error, path, mine, base):
+        """Resolve a save conflict, or report the error"""
+        if not isinstance(error, annotation_io.ConflictError):
+            messagebox.showerror("Error", f"Failed to save annotations: {str(error)}")
+            return
+        
+        current = path == self.get_annotation_filename()
+        theirs = error.theirs
+        answer = messagebox.askyesnocancel(
+            "Save Conflict",
+            f"{error}.\n\n"
+            "Yes: merge their changes with yours\n"
+            "No: overwrite their changes\n"
+            "Cancel: don't save")
+        if answer is None:
+            if current:
+                self.loaded_data = base
+            self.update_status("Annotations not saved")
+            return
+        
+        if answer:
+            data, conflicts = annotation_io.merge_annotation_data(base, mine, theirs)
+            if conflicts:
+                self.update_status(f"Merged, {conflicts} conflicting annotation(s): your changes won over theirs, "
+                                   f"changes won over deletions")
+        else:
+            data = mine
+        if current:
+            self.loaded_data = data
+            if data is not mine:
+                self.reload_annotations(data)
+        self.write_checked(path, data, theirs, annotation_io.file_revision(theirs))
+    
+    def reload_annotations(self, data):
+        """Replace the annotations shown for the current image"""
+        self.reset_annotations()
+        self.canvas.delete("all")
+        self.setup_image_layer()
+        self.load_annotations(data)
 
     
     def prompt_save_annotations(self):
         """Prompt user to save annotations before switching images"""
+        if self.sync is not None:
+            self.sync.flush()
+            return
         if self.keypoints or self.curves or self.bboxes or self.freehand_curves:
             if messagebox.askyesno("Save Annotations", 
                                   "Do you want to save the current annotations before continuing?"):
@@ -769,74 +1906,27 @@ class CocoAnnotator:
         self.status_bar.config(text=message)
 
 
-    def load_annotations(self):
-        """Try to load existing annotations for the current image"""
-        annotation_file = self.get_annotation_filename()
-        if not annotation_file or not os.path.exists(annotation_file):
+    @tracer.traced("load_annotations")
+    def load_annotations(self, data):
+        """Show the annotations read from the file of the current image"""
+        self.loaded_data = data
+        if data is None or self.current_image_data is None:
             return
             
         try:
-            with open(annotation_file, 'r') as f:
-                data = json.load(f)
+            # Normalized file coordinates become display coordinates
+            self.doc.size = self.current_image_data.size
+            self.doc.load(data, "annotator")
+            for kind in ("keypoint", "curve", "bbox", "freehand"):
+                for annotation in self.doc.annotations[kind].values():
+                    self.index_annotation(kind, annotation)
+            self.update_keypoint_list()
+            self.update_curve_list()
+            self.update_bbox_list()
+            self.update_freehand_list()
             
-            # Get current display dimensions
-            display_width = self.current_image_data.width
-            display_height = self.current_image_data.height
-                
-            # Load keypoints - convert from normalized to display coordinates
-            if 'keypoints' in data:
-                self.keypoints = []
-                for kp in data['keypoints']:
-                    # Convert normalized coordinates to pixel coordinates for current display
-                    x = int(kp['x'] * display_width)
-                    y = int(kp['y'] * display_height)
-                    keypoint = (kp['id'], x, y)
-                    self.keypoints.append(keypoint)
-                    self.draw_keypoint(keypoint)
-                self.update_keypoint_list()
-                
-            # Load curves - convert from normalized to display coordinates
-            if 'curves' in data:
-                self.curves = []
-                for curve in data['curves']:
-                    points = []
-                    for p in curve['points']:
-                        # Convert normalized coordinates to pixel coordinates
-                        x = int(p['x'] * display_width)
-                        y = int(p['y'] * display_height)
-                        points.append((x, y))
-                    curve_data = (curve['id'], points)
-                    self.curves.append(curve_data)
-                    self.draw_curve(curve_data)
-                self.update_curve_list()
-                
-            # Load bounding boxes - convert from normalized to display coordinates
-            if 'bboxes' in data:
-                self.bboxes = []
-                for bbox in data['bboxes']:
-                    x1 = int(bbox['x1'] * display_width)
-                    y1 = int(bbox['y1'] * display_height)
-                    x2 = int(bbox['x2'] * display_width)
-                    y2 = int(bbox['y2'] * display_height)
-                    bbox_data = (bbox['id'], x1, y1, x2, y2)
-                    self.bboxes.append(bbox_data)
-                    self.draw_bbox(bbox_data)
-                self.update_bbox_list()
-                
-            # Load freehand curves - convert from normalized to display coordinates
-            if 'freehand_curves' in data:
-                self.freehand_curves = []
-                for curve in data['freehand_curves']:
-                    points = []
-                    for p in curve['points']:
-                        # Convert normalized coordinates to pixel coordinates
-                        x = int(p['x'] * display_width)
-                        y = int(p['y'] * display_height)
-                        points.append((x, y))
-                    curve_data = (curve['id'], points)
-                    self.freehand_curves.append(curve_data)
-                    self.draw_freehand_curve(curve_data)
-                self.update_freehand_list()
+            # Draw everything at once with the level-of-detail rules
+            self.render_annotations()
                 
             self.update_status(f"Loaded annotations for {os.path.basename(self.images[self.current_image_index])}")
             
@@ -844,62 +1934,25 @@ class CocoAnnotator:
             messagebox.showerror("Error", f"Failed to load annotations: {str(e)}")
 
 
-    def convert_to_yolo_format(self):
-        """Convert bounding boxes to normalized center format (YOLO style)"""
-        if not self.current_image_data or not self.bboxes:
-            return []
-            
-        display_width, display_height = self.current_image_data.width, self.current_image_data.height
-        yolo_bboxes = []
-        
-        for bbox_id, x1, y1, x2, y2 in self.bboxes:
-            # Calculate center points and dimensions (normalized)
-            x_center = (x1 + x2) / (2 * display_width)
-            y_center = (y1 + y2) / (2 * display_height)
-            width = (x2 - x1) / display_width
-            height = (y2 - y1) / display_height
-            
-            yolo_bboxes.append({
-                'id': bbox_id,
-                'x_c': x_center,
-                'y_c': y_center,
-                'w': width,
-                'h': height
-            })
-            
-        return yolo_bboxes
-    
-        
+    @tracer.traced("export")
     def export_yolo_format(self):
         """Export annotations in YOLO format"""
         if self.current_image_index < 0 or not self.images or not self.bboxes:
             messagebox.showinfo("Info", "No bounding boxes to export")
             return
-        
-        # Create YOLO export directory if it doesn't exist
-        yolo_dir = os.path.join(self.dataset_path, "yolo_annotations")
-        os.makedirs(yolo_dir, exist_ok=True)
+        if not self.dataset_path:
+            messagebox.showinfo("Info", "YOLO export is only available for local datasets")
+            return
         
         # Get filename without extension
         img_path = self.images[self.current_image_index]
-        img_name = os.path.basename(img_path)
-        base_name = os.path.splitext(img_name)[0]
-        yolo_file = os.path.join(yolo_dir, f"{base_name}.txt")
+        yolo_file = os.path.join(self.dataset_path, "yolo_annotations", f"{annotation_io.image_stem(img_path)}.txt")
         
-        # Convert bboxes to YOLO format
-        yolo_bboxes = self.convert_to_yolo_format()
-        
-        try:
-            with open(yolo_file, 'w') as f:
-                # Standard YOLO format: class_id center_x center_y width height
-                # For simplicity, using bbox_id as class_id
-                for bbox in yolo_bboxes:
-                    f.write(f"0 {bbox['x_c']:.6f} {bbox['y_c']:.6f} {bbox['w']:.6f} {bbox['h']:.6f}\n")
-                    
-            self.update_status(f"Exported YOLO format to {os.path.basename(yolo_file)}")
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to export YOLO format: {str(e)}")
+        # Same conversion as Export All, from the annotations as they would be saved
+        lines = annotation_io.yolo_lines(self.doc.to_data())
+        self.tasks.submit(annotation_io.write_yolo_file, yolo_file, lines, lane="io",
+                          on_done=lambda path: self.update_status(f"Exported YOLO format to {os.path.basename(path)}"),
+                          on_error=lambda e: messagebox.showerror("Error", f"Failed to export YOLO format: {str(e)}"))
 
 
     def export_all_to_yolo(self):
@@ -907,67 +1960,537 @@ class CocoAnnotator:
         if not self.dataset_path or not self.images:
             messagebox.showinfo("Info", "No dataset loaded")
             return
-            
-        # Create YOLO export directory
-        yolo_dir = os.path.join(self.dataset_path, "yolo_annotations")
-        os.makedirs(yolo_dir, exist_ok=True)
-        
-        # Remember current image index to restore it later
-        current_idx = self.current_image_index
-        exported_count = 0
-        
-        # Show progress
-        progress = tk.Toplevel(self.root)
-        progress.title("Exporting to YOLO format")
-        progress.geometry("300x100")
-        progress_label = ttk.Label(progress, text="Exporting annotations...")
-        progress_label.pack(pady=10)
-        progress_bar = ttk.Progressbar(progress, length=250)
-        progress_bar.pack(pady=10)
-        progress_bar["maximum"] = len(self.images)
-        
-        # Process each image
-        for idx, img_path in enumerate(self.images):
-            # Update progress
-            progress_bar["value"] = idx + 1
-            progress.update()
-            
-            # Load image and its annotations
-            self.current_image_index = idx
-            self.load_image()
-            
-            # Only export if there are bounding boxes
-            if self.bboxes:
-                img_name = os.path.basename(img_path)
-                base_name = os.path.splitext(img_name)[0]
-                yolo_file = os.path.join(yolo_dir, f"{base_name}.txt")
-                
-                # Convert and save
-                yolo_bboxes = self.convert_to_yolo_format()
-                try:
-                    with open(yolo_file, 'w') as f:
-                        for bbox in yolo_bboxes:
-                            f.write(f"0 {bbox['x_c']:.6f} {bbox['y_c']:.6f} {bbox['w']:.6f} {bbox['h']:.6f}\n")
-                    exported_count += 1
-                except Exception:
-                    continue
-        
-        # Restore original image
-        self.current_image_index = current_idx
-        self.load_image()
         
-        # Close progress dialog
-        progress.destroy()
+        # Reads the annotation files from disk, the current image stays loaded
+        self.start_dataset_job("YOLO export", dataset_jobs.export_yolo_job, lambda job: self.update_status(
+            f"Exported {job.result} annotations to YOLO format"))
+    
+    def migrate_annotations(self):
+        """Rewrite annotation files of older versions in the current format"""
+        if not self.dataset_path or not self.images:
+            messagebox.showinfo("Info", "No dataset loaded")
+            return
+        self.start_dataset_job("Migrate annotations", dataset_jobs.migrate_annotations_job,
+                               lambda job: self.update_status(
+                                   f"Migrated {job.result} annotation files"
+                                   + (f", {len(job.errors)} skipped (see Background Jobs)" if job.errors else "")))
+    
+    def show_dataset_stats(self):
+        """Count the annotations of the whole dataset"""
+        if not self.dataset_path or not self.images:
+            messagebox.showinfo("Info", "No dataset loaded")
+            return
+        
+        def finished(job):
+            stats = job.result
+            messagebox.showinfo("Dataset Statistics",
+                                f"Images: {stats['images']} ({stats['annotated_images']} annotated)\n"
+                                f"Keypoints: {stats['keypoint']}\n"
+                                f"Curves: {stats['curve']}\n"
+                                f"Bounding boxes: {stats['bbox']}\n"
+                                f"Freehand curves: {stats['freehand']}")
         
-        # Show completion message
-        messagebox.showinfo("Export Complete", f"Exported {exported_count} annotations to YOLO format")
+        self.start_dataset_job("Dataset statistics", dataset_jobs.dataset_stats_job, finished)
+    
+    def run_qa_scan(self):
+        """Check the geometry of every annotation file in the dataset"""
+        if not self.dataset_path or not self.images:
+            messagebox.showinfo("Info", "No dataset loaded")
+            return
+        self.start_dataset_job("QA scan", qa_scan.qa_scan_job, self.qa_scan_finished)
+    
+    def qa_scan_finished(self, job):
+        report = job.result
+        self.qa_report = report
+        self.update_status(f"QA scan: {len(report['entries'])} of {report['annotated']} annotated images have issues")
+        self.show_qa_report()
+    
+    def show_qa_report(self):
+        """List the images with issues, selecting one opens it"""
+        if self.qa_report is None:
+            if not self.dataset_path:
+                messagebox.showinfo("Info", "No dataset loaded")
+                return
+            # The report of an earlier scan, if there was one
+            path = os.path.join(self.dataset_path, "annotations", qa_scan.REPORT_NAME)
+            self.tasks.submit(annotation_io.read_annotation_file, path, lane="io",
+                              on_done=self.qa_report_loaded,
+                              on_error=lambda e: messagebox.showerror("Error", f"Failed to read QA report: {str(e)}"))
+            return
+        if self.qa_window is not None and self.qa_window.winfo_exists():
+            self.qa_window.destroy()
+        report = self.qa_report
+        window = self.qa_window = tk.Toplevel(self.root)
+        window.title("QA Report")
+        window.geometry("760x420")
+        counts = ", ".join(f"{code} {count}" for code, count in sorted(report['counts'].items()))
+        summary = (f"{len(report['entries'])} of {report['annotated']} annotated images have issues"
+                   + (f": {counts}" if counts else ""))
+        ttk.Label(window, text=summary, wraplength=740).pack(fill=tk.X, padx=5, pady=5)
+        
+        frame = ttk.Frame(window)
+        frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        tree = ttk.Treeview(frame, columns=("kind", "id", "issue"), show="tree headings")
+        tree.heading("#0", text="Image")
+        tree.heading("kind", text="Kind")
+        tree.heading("id", text="ID")
+        tree.heading("issue", text="Issue")
+        tree.column("#0", width=220)
+        tree.column("kind", width=80)
+        tree.column("id", width=50)
+        tree.column("issue", width=380)
+        scrollbar = ttk.Scrollbar(frame, orient=tk.VERTICAL, command=tree.yview)
+        tree.configure(yscrollcommand=scrollbar.set)
+        tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        paths = {}
+        for entry in report['entries']:
+            parent = tree.insert("", tk.END, text=entry['image'],
+                                 values=("", "", f"{len(entry['issues'])} issue(s)"))
+            paths[parent] = entry['path']
+            for item in entry['issues']:
+                child = tree.insert(parent, tk.END, values=(
+                    item['kind'] or "", "" if item['id'] is None else item['id'], item['message']))
+                paths[child] = entry['path']
+        
+        def selected(event):
+            selection = tree.selection()
+            if selection:
+                self.go_to_image(paths[selection[0]])
+        tree.bind("<<TreeviewSelect>>", selected)
+    
+    def qa_report_loaded(self, report):
+        if report is None:
+            messagebox.showinfo("QA Report", "No QA report yet, run Dataset Jobs → QA Scan first")
+            return
+        self.qa_report = report
+        self.show_qa_report()
+    
+    def go_to_image(self, img_path):
+        """Show an image of the dataset by path"""
+        if self.images and self.images[self.current_image_index] == img_path:
+            return
+        if img_path not in self.images:
+            self.update_status(f"{os.path.basename(img_path)} is not in the current image list")
+            return
+        self.prompt_save_annotations()
+        self.current_image_index = self.images.index(img_path)
+        self.load_image()
+    
+    def find_near_duplicates(self):
+        """Hash every image and group the near-identical ones"""
+        if not self.dataset_path or not self.images:
+            messagebox.showinfo("Info", "No dataset loaded")
+            return
+        self.start_dataset_job("Find near-duplicates", image_hashes.near_duplicates_job,
+                               self.near_duplicates_found)
+    
+    def near_duplicates_found(self, job):
+        # Labels belong to the images the job hashed, not to the images loaded now
+        images, labels = job.result
+        groups = {}
+        for img_path, label in zip(images, labels.tolist()):
+            groups.setdefault(label, []).append(img_path)
+        self.duplicate_groups = {img_path: group for group in groups.values() if len(group) > 1
+                                 for img_path in group}
+        redundant = len(self.duplicate_groups) - sum(1 for group in groups.values() if len(group) > 1)
+        self.update_status(f"{redundant} images are near-duplicates of an earlier one, "
+                           f"turn on Skip Near-Duplicates to pass over them")
+    
+    def copy_duplicate_annotations(self):
+        """Load the annotations of the nearest annotated image of the current image's group"""
+        if self.current_image_data is None or self.client is not None:
+            return
+        img_path = self.images[self.current_image_index]
+        group = self.duplicate_groups.get(img_path)
+        if group is None:
+            self.update_status(f"{os.path.basename(img_path)} has no near-duplicates")
+            return
+        position = group.index(img_path)
+        others = [p for _, p in sorted((abs(i - position), p) for i, p in enumerate(group) if p != img_path)]
+        self.tasks.submit(self.read_group_annotations, self.dataset_path, others, lane="io",
+                          on_done=lambda result: self.duplicate_annotations_read(img_path, result),
+                          on_error=lambda e: messagebox.showerror("Error", f"Failed to read annotations: {str(e)}"))
+    
+    def read_group_annotations(self, dataset_path, images):
+        """(image, annotations) of the first image that has any, runs in a worker"""
+        for img_path in images:
+            data = annotation_io.read_annotation_file(annotation_io.annotation_path(dataset_path, img_path))
+            if data and any(data.get(field) for field in annotation_io.ANNOTATION_FIELDS.values()):
+                return img_path, data
+        return None, None
+    
+    def duplicate_annotations_read(self, img_path, result):
+        source, data = result
+        if img_path != self.images[self.current_image_index] or self.current_image_data is None:
+            return
+        if data is None:
+            self.update_status("No image of the group has annotations yet")
+            return
+        if len(self.doc) and not messagebox.askyesno(
+                "Copy Annotations", "Replace the annotations of this image with the copied ones?"):
+            return
+        # The file of this image stays the base of the next save
+        base = self.loaded_data
+        self.reset_annotations()
+        self.canvas.delete("all")
+        self.setup_image_layer()
+        self.load_annotations(data)
+        self.loaded_data = base
+        self.update_status(f"Copied {len(self.doc)} annotations from {os.path.basename(source)}, not saved yet")
+    
+    def forget_query_index(self):
+        """Drop the annotation index and the query filter of the previous dataset"""
+        if self.query_filter is not None:
+            self.all_images = None
+        self.query_filter = None
+        self.query_rows = None
+        self.annotation_index = None
+        self.indexed_images = None
+        if self.query_window is not None and self.query_window.winfo_exists():
+            self.query_window.destroy()
+        self.query_window = None
+    
+    def show_query_window(self):
+        """Filter the images by their annotations, or look at the distribution of a column"""
+        if not self.dataset_path or not self.images:
+            messagebox.showinfo("Info", "No dataset loaded")
+            return
+        if self.query_window is not None and self.query_window.winfo_exists():
+            self.query_window.lift()
+            return
+        window = self.query_window = tk.Toplevel(self.root)
+        window.title("Query Annotations")
+        window.geometry("640x420")
+        
+        query_frame = ttk.Frame(window)
+        query_frame.pack(fill=tk.X, padx=5, pady=5)
+        self.query_var = tk.StringVar(value=self.query_filter or "")
+        entry = ttk.Entry(query_frame, textvariable=self.query_var)
+        entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        entry.bind("<Return>", lambda event: self.apply_query())
+        entry.focus_set()
+        ttk.Button(query_frame, text="Filter", command=self.apply_query).pack(side=tk.LEFT, padx=5)
+        ttk.Button(query_frame, text="Clear", command=self.clear_query).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(window, wraplength=620, justify=tk.LEFT,
+                  text="e.g. bbox > 10, freehand and not bbox, bbox_area_min * width * height < 100\n"
+                       f"Columns: {', '.join(annotation_query.COLUMNS)}").pack(fill=tk.X, padx=10)
+        
+        histogram_frame = ttk.Frame(window)
+        histogram_frame.pack(fill=tk.X, padx=5, pady=5)
+        self.histogram_var = tk.StringVar(value="keypoint")
+        ttk.Combobox(histogram_frame, textvariable=self.histogram_var, values=annotation_query.COLUMNS,
+                     state="readonly", width=20).pack(side=tk.LEFT, padx=5)
+        ttk.Button(histogram_frame, text="Histogram", command=self.show_histogram).pack(side=tk.LEFT, padx=5)
+        ttk.Button(histogram_frame, text="Refresh Index", command=self.refresh_annotation_index).pack(side=tk.RIGHT, padx=5)
+        
+        self.query_status = ttk.Label(window, text="")
+        self.query_status.pack(fill=tk.X, padx=10)
+        self.query_output = tk.Text(window, height=12, font=("Courier", 10), state=tk.DISABLED)
+        self.query_output.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        
+        if self.annotation_index is None:
+            self.refresh_annotation_index()
+        else:
+            self.query_status.config(text=f"{len(self.annotation_index)} images indexed")
+    
+    def refresh_annotation_index(self):
+        """Read the annotation files that changed since the index was last built"""
+        dataset_path = self.dataset_path
+        images = list(self.all_images or self.images)
+        if self.query_window is not None and self.query_window.winfo_exists():
+            self.query_status.config(text="Indexing annotations...")
+        self.jobs.start("Index annotations", annotation_query.index_annotations_job, dataset_path, images,
+                        total=len(images), on_done=lambda job: self.annotation_index_ready(dataset_path, images, job))
+    
+    def annotation_index_ready(self, dataset_path, images, job):
+        if dataset_path != self.dataset_path:
+            return
+        self.annotation_index = job.result
+        self.indexed_images = images
+        if self.query_window is not None and self.query_window.winfo_exists():
+            self.query_status.config(text=f"{len(images)} images indexed")
+    
+    def apply_query(self):
+        """Navigate only through the images matching the query"""
+        if self.annotation_index is None:
+            self.query_status.config(text="The index is still being built")
+            return
+        if self.work_queue is not None:
+            self.query_status.config(text="Leave work-queue mode to filter the dataset")
+            return
+        text = self.query_var.get().strip()
+        if not text:
+            self.clear_query()
+            return
+        started = time.perf_counter()
+        try:
+            rows = annotation_query.run_query(self.annotation_index, text)
+        except annotation_query.QueryError as e:
+            self.query_status.config(text=f"Invalid query: {e}")
+            return
+        query_ms = (time.perf_counter() - started) * 1e3
+        if not len(rows):
+            self.query_status.config(text=f"No images match ({query_ms:.1f} ms)")
+            return
+        
+        current = self.images[self.current_image_index]
+        matches = [self.indexed_images[i] for i in rows]
+        if self.all_images is None:
+            self.all_images = self.images
+        self.images = matches
+        self.query_filter = text
+        self.query_rows = rows
+        self.query_status.config(text=f"{len(matches)} of {len(self.all_images)} images match ({query_ms:.1f} ms)")
+        self.update_status(f"Filtered by: {text}")
+        if current in matches:
+            self.current_image_index = matches.index(current)
+            self.image_counter.config(text=f"{self.current_image_index + 1}/{len(self.images)}")
+        else:
+            self.prompt_save_annotations()
+            self.current_image_index = 0
+            self.load_image()
+    
+    def clear_query(self):
+        """Go back to navigating the whole dataset, staying on the current image"""
+        if self.query_filter is None:
+            return
+        current = self.images[self.current_image_index]
+        self.images = self.all_images
+        self.all_images = None
+        self.query_filter = None
+        self.query_rows = None
+        if self.query_window is not None and self.query_window.winfo_exists():
+            self.query_status.config(text=f"Showing all {len(self.images)} images")
+        self.current_image_index = self.images.index(current) if current in self.images else 0
+        self.image_counter.config(text=f"{self.current_image_index + 1}/{len(self.images)}")
+    
+    def show_histogram(self):
+        """Distribution of a column over the filtered images, or all of them"""
+        if self.annotation_index is None:
+            self.query_status.config(text="The index is still being built")
+            return
+        name = self.histogram_var.get()
+        bins = annotation_query.histogram(self.annotation_index, name, self.query_rows)
+        width = max((count for _, count in bins), default=0)
+        lines = [f"{name}{' (filtered)' if self.query_rows is not None else ''}"]
+        for label, count in bins:
+            bar = "#" * (40 * count // width) if width else ""
+            lines.append(f"{label:>20s} {count:7d} {bar}")
+        self.query_output.config(state=tk.NORMAL)
+        self.query_output.delete("1.0", tk.END)
+        self.query_output.insert("1.0", "\n".join(lines))
+        self.query_output.config(state=tk.DISABLED)
+    
+    def warm_image_cache(self):
+        """Decode the images following the current one so navigating to them is instant"""
+        if not self.images:
+            messagebox.showinfo("Info", "No dataset loaded")
+            return
+        start = max(self.current_image_index, 0)
+        images = self.images[start:start + self.image_cache.max_items]
+        self.jobs.start("Warm image cache", dataset_jobs.warm_cache_job, self.image_cache, images,
+                        *self.display_size(), total=len(images))
+        self.jobs_window.show()
+    
+    def start_dataset_job(self, name, fn, on_done=None):
+        """Run a job over all images of the dataset and show the jobs window"""
+        images = list(self.all_images or self.images)
+        self.jobs.start(name, fn, self.dataset_path, images, total=len(images), on_done=on_done)
+        self.jobs_window.show()
+    
+    def toggle_tracing(self):
+        """Start or stop recording latency spans"""
+        tracer.enabled = self.trace_var.get()
+        if tracer.enabled:
+            self.latency_hud.pack(side=tk.RIGHT)
+            if self.hud_job is None:
+                self.update_latency_hud()
+        else:
+            self.latency_hud.pack_forget()
+    
+    def update_latency_hud(self):
+        """Latest image switch and input latencies, refreshed while tracing"""
+        if not tracer.enabled:
+            self.hud_job = None
+            return
+        parts = []
+        for name, label in (("image_switch", "switch"), ("click", "click"), ("drag", "drag")):
+            seconds = tracer.latest(name)
+            if seconds is not None:
+                parts.append(f"{label} {seconds * 1e3:.0f} ms")
+        switch = tracer.percentiles().get("image_switch")
+        if switch:
+            parts.append(f"switch p90 {switch['p90']:.0f} ms")
+        self.latency_hud.config(text=" | ".join(parts) or "Recording latency...")
+        self.hud_job = self.root.after(self.hud_interval_ms, self.update_latency_hud)
+    
+    def show_latency_percentiles(self):
+        """Latency percentiles of every recorded span"""
+        stats = tracer.percentiles()
+        if not stats:
+            messagebox.showinfo("Latency", "Nothing recorded, turn on Diagnostics → Record Latency first")
+            return
+        lines = [f"{'span':18s} {'n':>5s} {'p50':>8s} {'p90':>8s} {'p99':>8s} {'max':>8s}"]
+        for name, entry in stats.items():
+            lines.append(f"{name:18s} {entry['count']:5d} {entry['p50']:8.1f} {entry['p90']:8.1f} "
+                         f"{entry['p99']:8.1f} {entry['max']:8.1f}")
+        window = tk.Toplevel(self.root)
+        window.title("Latency (ms)")
+        text = tk.Text(window, width=62, height=min(len(lines) + 1, 30), font=("Courier", 10))
+        text.insert("1.0", "\n".join(lines))
+        text.config(state=tk.DISABLED)
+        text.pack(fill=tk.BOTH, expand=True)
+    
+    def export_trace(self):
+        """Save the recorded spans as a Chrome trace, viewable in chrome://tracing or Perfetto"""
+        path = filedialog.asksaveasfilename(title="Export Chrome Trace", defaultextension=".json",
+                                            filetypes=[("Trace JSON", "*.json")])
+        if not path:
+            return
+        self.tasks.submit(tracer.export_chrome_trace, path, lane="io",
+                          on_done=lambda path: self.update_status(f"Exported trace to {os.path.basename(path)}"),
+                          on_error=lambda e: messagebox.showerror("Error", f"Failed to export trace: {str(e)}"))
+    
+    def restore_settings(self):
+        """Apply the annotation mode, smoothing settings and window size of the last session"""
+        state = self.saved_session
+        if state is None:
+            self.resume_btn.state(["disabled"])
+            return
+        smoothing_settings = state.get('smoothing', {})
+        try:
+            self.smooth_degree_var.set(int(smoothing_settings.get('degree', self.smooth_degree_var.get())))
+            self.smooth_iterations_var.set(int(smoothing_settings.get('iterations', self.smooth_iterations_var.get())))
+            self.smooth_method_var.set(smoothing_settings.get('method', self.smooth_method_var.get()))
+            self.simplify_tolerance_var.set(float(smoothing_settings.get('tolerance', self.simplify_tolerance_var.get())))
+            self.raster_var.set(bool(state.get('raster_overlay', False)))
+            if state.get('geometry'):
+                self.root.geometry(state['geometry'])
+            if state.get('canvas_size'):
+                width, height = (int(v) for v in state['canvas_size'])
+                if width > 10 and height > 10:
+                    self.restored_canvas_size = (width, height)
+        except (TypeError, ValueError, tk.TclError):
+            pass  # Keep the defaults for whatever is broken
+        if state.get('mode') in ("keypoint", "curve", "bbox", "freehand", "select"):
+            self.mode_var.set(state['mode'])
+            self.set_annotation_mode()
+        if state.get('dataset'):
+            self.update_status(f"Press Ctrl+R to resume {os.path.basename(state['dataset'])} "
+                               f"at image {state.get('index', 0) + 1}")
+        else:
+            self.resume_btn.state(["disabled"])
+    
+    def session_state(self):
+        """The position and settings to restore next time"""
+        state = {
+            'mode': self.mode_var.get(),
+            'smoothing': {'degree': self.smooth_degree_var.get(),
+                          'iterations': self.smooth_iterations_var.get(),
+                          'method': self.smooth_method_var.get(),
+                          'tolerance': self.simplify_tolerance_var.get()},
+            'raster_overlay': self.raster_var.get(),
+            'geometry': self.root.geometry(),
+        }
+        width, height = self.display_size()
+        if width > 10 and height > 10:
+            state['canvas_size'] = [width, height]
+        if self.dataset_path and self.images and self.client is None:
+            images, index = self.images, self.current_image_index
+            current = images[index]
+            if self.all_images is not None:
+                # In work-queue mode or with a query the position is kept in the whole dataset
+                images = self.all_images
+                index = images.index(current) if current in images else 0
+            state.update(dataset=self.dataset_path, image=current, index=index,
+                         prefetch=session.neighbours(images, index))
+        elif self.saved_session:
+            # Nothing opened, or a server: keep the dataset to resume
+            for key in ('dataset', 'image', 'index', 'prefetch'):
+                if key in self.saved_session:
+                    state[key] = self.saved_session[key]
+        return state
+    
+    def save_session(self, wait=False):
+        """Save the session file, in the background unless `wait` is set"""
+        try:
+            state = self.session_state()
+        except tk.TclError:
+            return  # Invalid value in one of the spinboxes
+        self.saved_session = state
+        if wait:
+            try:
+                session.write_session(self.session_path, state)
+            except OSError as e:
+                print(f"Failed to save the session: {e}", file=sys.stderr)
+            return
+        self.tasks.submit(session.write_session, self.session_path, state, lane="session")
+    
+    def resume_session(self):
+        """Reopen the dataset of the last session at the image it was left on
+        
+        The images around that position are decoded into the cache while
+        the dataset is scanned, so the first few images show up at once.
+        """
+        state = self.saved_session
+        if not state or not state.get('dataset'):
+            self.update_status("No session to resume")
+            return
+        dataset_path = state['dataset']
+        if not os.path.isdir(dataset_path):
+            self.update_status(f"Can't resume, {dataset_path} no longer exists")
+            return
+        self.prefetch_images(state.get('prefetch', []))
+        self.open_dataset(dataset_path, state.get('index', 0), start_image=state.get('image'))
+        # The scan is running, load what the first image switch needs meanwhile
+        warm_imports(self.root, WARM_IMPORTS)
+    
+    def prefetch_images(self, images):
+        """Decode images into the cache in the background, in the given order"""
+        width, height = self.display_size()
+        for img_path in images:
+            self.tasks.submit(self.image_cache.load, img_path, width, height, lane="prefetch",
+                              on_error=lambda e: None)  # Shown when the image is actually opened
+    
+    def on_close(self):
+        """Stop background jobs and close the window, pending saves still finish"""
+        self.jobs.cancel_all()
+        self.disconnect_server()
+        self.stop_work_queue()
+        self.save_session(wait=True)
+        if self.leases is not None:
+            self.tasks.submit(self.leases.release_all, lane="leases")
+        self.tasks.shutdown()
+        self.root.destroy()
 
 
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Annotate images of a COCO style dataset")
+    parser.add_argument("dataset", nargs="?", help="Dataset directory to open right away")
+    parser.add_argument("--index", type=int, default=1, help="Image to start at, 1 is the first")
+    parser.add_argument("--resume", action="store_true", help="Resume the last session")
+    parser.add_argument("--work-queue", metavar="PATH",
+                        help="Keep the work queue in this SQLite file, which must be on a local disk and only "
+                             "serves annotators on this machine. By default it is kept in the dataset")
+    parser.add_argument("--startup-time", action="store_true",
+                        help="Print the time to the first image and exit, for measuring startup")
+    args = parser.parse_args()
+    
     root = tk.Tk()
     app = CocoAnnotator(root)
+    app.work_queue_path = args.work_queue
+    if args.dataset:
+        app.exit_after_first_image = args.startup_time
+        # Scan the dataset while the window is being mapped
+        app.open_dataset(args.dataset, args.index - 1)
+    elif args.resume:
+        app.exit_after_first_image = args.startup_time
+        app.resume_session()
     root.mainloop()
 
 if __name__ == "__main__":
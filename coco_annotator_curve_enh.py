@@ -3,14 +3,17 @@ from tkinter import ttk, filedialog, messagebox
 import json
 import os
 from PIL import Image, ImageTk
-import numpy as np
 from enum import Enum
+from spatial_index import SpatialIndex
+import editing
+from annotation_document import AnnotationDocument, smooth_curve_points
 
 class AnnotationMode(Enum):
     KEYPOINT = 1
     CURVE = 2
     SMOOTH_CURVE = 3  # New mode for smooth curves
     BBOX = 4
+    SELECT = 5  # Pick and edit existing annotations
 
 class CocoAnnotator:
     def __init__(self, root):
@@ -34,10 +37,20 @@ class CocoAnnotator:
         self.curves = []
         self.smooth_curves = []  # New list for smooth curves
         self.bboxes = []
+        # Reads and writes the annotation files; its coordinates stay normalized
+        self.doc = AnnotationDocument()
+        self.ids = self.doc.ids
         
         # Smooth curve parameters
         self.smoothness = 0.3  # Controls the curve smoothness (0.0 to 1.0)
         
+        # Picking and editing of existing annotations
+        self.spatial_index = SpatialIndex()
+        self.image_scale = 1.0  # Display pixels per original image pixel
+        self.pick_radius = 8  # Picking radius in screen pixels
+        self.canvas_items = {}  # (kind, id) -> canvas item ids of that annotation
+        self.edit_state = None  # Active drag while editing an annotation
+        
         self.setup_ui()
     
     def setup_ui(self):
@@ -88,6 +101,10 @@ class CocoAnnotator:
                                   value="bbox", command=self.set_annotation_mode)
         bbox_rb.pack(side=tk.LEFT, padx=5)
         
+        select_rb = ttk.Radiobutton(mode_frame, text="Select/Edit", variable=self.mode_var,
+                                    value="select", command=self.set_annotation_mode)
+        select_rb.pack(side=tk.LEFT, padx=5)
+        
         # Curve smoothness control (only visible when smooth curve mode is active)
         self.smoothness_frame = ttk.Frame(control_frame)
         self.smoothness_frame.pack(side=tk.LEFT, padx=20)
@@ -264,11 +281,16 @@ class CocoAnnotator:
         self.curves = []
         self.smooth_curves = []
         self.bboxes = []
+        self.doc.clear()
         self.clear_annotation_lists()
+        self.spatial_index.clear()
+        self.canvas_items = {}
+        self.edit_state = None
         
         # Load image
         img_path = self.images[self.current_image_index]
         self.current_image_data = Image.open(img_path)
+        self.image_scale = 1.0
         
         # Resize if necessary to fit canvas
         canvas_width = self.canvas.winfo_width()
@@ -282,6 +304,7 @@ class CocoAnnotator:
             new_height = int(img_height * scale)
             
             self.current_image_data = self.current_image_data.resize((new_width, new_height), Image.LANCZOS)
+            self.image_scale = new_width / img_width
         
         # Convert to Tkinter image and display
         self.current_image = ImageTk.PhotoImage(self.current_image_data)
@@ -324,6 +347,9 @@ class CocoAnnotator:
         elif mode == "bbox":
             self.annotation_mode = AnnotationMode.BBOX
             self.smoothness_frame.pack_forget()
+        elif mode == "select":
+            self.annotation_mode = AnnotationMode.SELECT
+            self.smoothness_frame.pack_forget()
         
         self.update_status(f"Annotation mode: {mode}")
     
@@ -351,7 +377,7 @@ class CocoAnnotator:
         
         if self.annotation_mode == AnnotationMode.KEYPOINT:
             # Add keypoint
-            keypoint_id = len(self.keypoints) + 1
+            keypoint_id = self.ids.allocate("keypoint")
             
             # Store in normalized coordinates
             img_width = self.current_image_data.width
@@ -364,6 +390,7 @@ class CocoAnnotator:
             keypoint = (keypoint_id, x_norm, y_norm, x, y)
             self.keypoints.append(keypoint)
             self.draw_keypoint(keypoint)
+            self.index_annotation("keypoint", keypoint)
             self.update_keypoint_list()
             
         elif self.annotation_mode == AnnotationMode.CURVE:
@@ -400,6 +427,13 @@ class CocoAnnotator:
             # Start bounding box
             self.drawing = True
             self.bbox_start = (x, y)
+        
+        elif self.annotation_mode == AnnotationMode.SELECT:
+            # Start editing the annotation under the cursor
+            key = self.pick_annotation(x, y)
+            if key:
+                self.drawing = True
+                self.begin_edit(key, x, y)
             
     def draw_smooth_curve_preview(self):
         """Draw a preview of the smooth curve while drawing"""
@@ -423,7 +457,10 @@ class CocoAnnotator:
         
         x, y = event.x, event.y
         
-        if self.annotation_mode == AnnotationMode.BBOX and self.bbox_start:
+        if self.annotation_mode == AnnotationMode.SELECT and self.edit_state:
+            self.update_edit(x, y)
+        
+        elif self.annotation_mode == AnnotationMode.BBOX and self.bbox_start:
             # Update bounding box preview
             self.canvas.delete("temp_bbox")
             self.canvas.create_rectangle(
@@ -445,7 +482,7 @@ class CocoAnnotator:
             if len(self.curve_points) > 1 and abs(x - self.curve_points[0][0]) < 10 and abs(y - self.curve_points[0][1]) < 10:
                 # Close the curve
                 self.canvas.delete("temp_curve")
-                curve_id = len(self.curves) + 1
+                curve_id = self.ids.allocate("curve")
                 
                 # Convert all points to normalized coordinates
                 # Store as (x_norm, y_norm, x_pixel, y_pixel) for each point
@@ -458,6 +495,7 @@ class CocoAnnotator:
                 # Add to curves list
                 self.curves.append((curve_id, normalized_points))
                 self.draw_curve((curve_id, normalized_points))
+                self.index_annotation("curve", (curve_id, normalized_points))
                 self.update_curve_list()
                 self.drawing = False
                 self.curve_points = []
@@ -467,7 +505,7 @@ class CocoAnnotator:
             if len(self.curve_points) > 1 and abs(x - self.curve_points[0][0]) < 10 and abs(y - self.curve_points[0][1]) < 10:
                 # Close the smooth curve
                 self.canvas.delete("temp_curve")
-                curve_id = len(self.smooth_curves) + 1
+                curve_id = self.ids.allocate("smooth_curve")
                 
                 # Convert all points to normalized coordinates
                 # Store as (x_norm, y_norm, x_pixel, y_pixel) for each point
@@ -483,6 +521,7 @@ class CocoAnnotator:
                 
                 # Draw the final smooth curve
                 self.draw_smooth_curve(curve_data)
+                self.index_annotation("smooth_curve", curve_data)
                 self.update_smooth_curve_list()
                 self.drawing = False
                 self.curve_points = []
@@ -500,7 +539,7 @@ class CocoAnnotator:
             
             # Ignore very small boxes (probably misclicks)
             if (x2 - x1) > 5 and (y2 - y1) > 5:
-                bbox_id = len(self.bboxes) + 1
+                bbox_id = self.ids.allocate("bbox")
                 
                 # Convert to YOLO format (normalized coordinates)
                 img_width = self.current_image_data.width
@@ -517,65 +556,23 @@ class CocoAnnotator:
                 
                 # Still draw in pixel coordinates for display
                 self.draw_bbox(bbox, img_width, img_height)
+                self.index_annotation("bbox", bbox)
                 self.update_bbox_list()
             
             self.bbox_start = None
+        
+        elif self.annotation_mode == AnnotationMode.SELECT:
+            self.drawing = False
+            if self.edit_state:
+                self.finish_edit()
     
     def generate_smooth_curve(self, points, smoothness):
         """Generate points for a smooth curve using Catmull-Rom spline"""
         if len(points) < 2:
             return points
         
-        # If we only have 2 points, return them
-        if len(points) == 2:
-            return points
-        
-        # For closed curves, add the first point at the end and the last point at the beginning
-        if abs(points[0][0] - points[-1][0]) < 10 and abs(points[0][1] - points[-1][1]) < 10:
-            # Close the curve by making the first and last points the same
-            control_points = points[:-1]  # Remove the last point since it's a duplicate
-            control_points.append(control_points[0])  # Add the first point to close the loop
-            
-            # Add extra control points for a closed curve
-            extended_points = [control_points[-2]] + control_points + [control_points[1]]
-        else:
-            # For an open curve, duplicate the first and last points
-            extended_points = [points[0]] + points + [points[-1]]
-        
-        # Number of segments to generate between each pair of control points
-        num_segments = 10
-        
-        # Generate smooth curve points
-        curve_points = []
-        for i in range(1, len(extended_points) - 2):
-            p0 = np.array(extended_points[i - 1])
-            p1 = np.array(extended_points[i])
-            p2 = np.array(extended_points[i + 1])
-            p3 = np.array(extended_points[i + 2])
-            
-            # Generate points for this segment
-            for t in range(num_segments + 1):
-                t_normalized = t / num_segments
-                
-                # Catmull-Rom spline formula
-                t2 = t_normalized * t_normalized
-                t3 = t2 * t_normalized
-                
-                # Adjust tensioning (smoothness)
-                s = 1.0 - smoothness
-                
-                # Calculate position using Catmull-Rom spline
-                pos = 0.5 * (
-                    (2 * p1) +
-                    (-p0 + p2) * s * t_normalized +
-                    (2*p0 - 5*p1 + 4*p2 - p3) * s * t2 +
-                    (-p0 + 3*p1 - 3*p2 + p3) * s * t3
-                )
-                
-                # Add point to curve
-                curve_points.append((int(pos[0]), int(pos[1])))
-        
-        return curve_points
+        # Closed curves wrap around, open curves repeat their end points
+        return smooth_curve_points(points, smoothness)
     
     def draw_keypoint(self, keypoint):
         """Draw a keypoint on the canvas"""
@@ -593,24 +590,28 @@ class CocoAnnotator:
             return
             
         # Draw line segments - use pixel coordinates for drawing
+        segments = []
         for i in range(len(points) - 1):
             p1 = (points[i][2], points[i][3])  # Get pixel coordinates (x_pixel, y_pixel)
             p2 = (points[i+1][2], points[i+1][3])
-            self.canvas.create_line(p1[0], p1[1], p2[0], p2[1], fill="green", width=2, tags=tag)
+            segments.append(self.canvas.create_line(p1[0], p1[1], p2[0], p2[1], fill="green", width=2, tags=tag))
         
         # Close the curve
         p1 = (points[-1][2], points[-1][3])
         p2 = (points[0][2], points[0][3])
-        self.canvas.create_line(p1[0], p1[1], p2[0], p2[1], fill="green", width=2, tags=tag)
+        segments.append(self.canvas.create_line(p1[0], p1[1], p2[0], p2[1], fill="green", width=2, tags=tag))
         
         # Draw control points
+        handles = []
         for point in points:
             x, y = point[2], point[3]  # Pixel coordinates for display
-            self.canvas.create_oval(x-3, y-3, x+3, y+3, fill="green", tags=tag)
+            handles.append(self.canvas.create_oval(x-3, y-3, x+3, y+3, fill="green", tags=tag))
         
         # Draw curve ID
-        if points:
-            self.canvas.create_text(points[0][2], points[0][3]-15, text=str(curve_id), tags=tag)
+        label = self.canvas.create_text(points[0][2], points[0][3]-15, text=str(curve_id), tags=tag)
+        
+        # Remember the items so editing a vertex only touches its two segments
+        self.canvas_items[("curve", curve_id)] = {'segments': segments, 'handles': handles, 'label': label}
     
     def draw_smooth_curve(self, curve_data):
         """Draw a smooth curve on the canvas"""
@@ -621,25 +622,35 @@ class CocoAnnotator:
             return
         
         # Draw control points - use pixel coordinates for display
+        handles = []
         for point in control_points:
             x, y = point[2], point[3]  # Get pixel coordinates
-            self.canvas.create_oval(x-3, y-3, x+3, y+3, fill="purple", tags=tag)
+            handles.append(self.canvas.create_oval(x-3, y-3, x+3, y+3, fill="purple", tags=tag))
         
         # Generate pixel coordinates for drawing
         pixel_points = [(p[2], p[3]) for p in control_points]
         
-        # Generate and draw the smooth curve
-        smooth_points = self.generate_smooth_curve(pixel_points, smoothness)
-        
-        for i in range(len(smooth_points) - 1):
-            p1 = smooth_points[i]
-            p2 = smooth_points[i+1]
-            self.canvas.create_line(p1[0], p1[1], p2[0], p2[1], fill="purple", width=2, tags=tag)
+        # Draw the smooth curve with one line item per Catmull-Rom span, so moving
+        # a control point only recomputes the spans that depend on it
+        layout = None
+        spans = []
+        if len(pixel_points) == 2:
+            p1, p2 = pixel_points
+            spans.append(self.canvas.create_line(p1[0], p1[1], p2[0], p2[1], fill="purple", width=2, tags=tag))
+        else:
+            layout = editing.catmull_rom_layout(pixel_points)
+            for span in range(len(layout) - 3):
+                span_points = editing.catmull_rom_span(pixel_points, layout, span, smoothness)
+                spans.append(self.canvas.create_line(*[c for p in span_points for c in p],
+                                                     fill="purple", width=2, tags=tag))
             
         # Draw curve ID
-        if control_points:
-            x, y = control_points[0][2], control_points[0][3]  # Pixel coordinates
-            self.canvas.create_text(x, y-15, text=str(curve_id), tags=tag)
+        x, y = control_points[0][2], control_points[0][3]  # Pixel coordinates
+        label = self.canvas.create_text(x, y-15, text=str(curve_id), tags=tag)
+        
+        self.canvas_items[("smooth_curve", curve_id)] = {
+            'spans': spans, 'handles': handles, 'label': label, 'layout': layout
+        }
     
     def draw_bbox(self, bbox, img_width=None, img_height=None):
         """Draw a bounding box on the canvas"""
@@ -658,8 +669,174 @@ class CocoAnnotator:
         x2 = int((x_center + width/2) * img_width)
         y2 = int((y_center + height/2) * img_height)
         
-        self.canvas.create_rectangle(x1, y1, x2, y2, outline="red", width=2, tags=tag)
-        self.canvas.create_text(x1, y1-10, text=str(bbox_id), tags=tag)
+        rect = self.canvas.create_rectangle(x1, y1, x2, y2, outline="red", width=2, tags=tag)
+        label = self.canvas.create_text(x1, y1-10, text=str(bbox_id), tags=tag)
+        self.canvas_items[("bbox", bbox_id)] = {'rect': rect, 'label': label}
+    
+    def bbox_pixels(self, bbox):
+        """Convert a YOLO format bbox to pixel corners for display"""
+        _, x_center, y_center, width, height = bbox
+        img_width = self.current_image_data.width
+        img_height = self.current_image_data.height
+        return (int((x_center - width/2) * img_width), int((y_center - height/2) * img_height),
+                int((x_center + width/2) * img_width), int((y_center + height/2) * img_height))
+    
+    def index_annotation(self, kind, annotation):
+        """Add or update an annotation in the spatial index (original image pixels)"""
+        key = (kind, annotation[0])
+        scale = self.image_scale
+        if kind == "keypoint":
+            self.spatial_index.insert_point(key, annotation[3] / scale, annotation[4] / scale)
+        elif kind == "bbox":
+            x1, y1, x2, y2 = self.bbox_pixels(annotation)
+            self.spatial_index.insert_rect(key, x1 / scale, y1 / scale, x2 / scale, y2 / scale)
+        else:
+            points = [(p[2] / scale, p[3] / scale) for p in annotation[1]]
+            self.spatial_index.insert_polyline(key, points, closed=True)
+    
+    def pick_annotation(self, x, y):
+        """Find the annotation nearest to a canvas position, or None"""
+        scale = self.image_scale
+        key, _ = self.spatial_index.nearest(x / scale, y / scale, self.pick_radius / scale)
+        return key
+    
+    def annotation_list(self, kind):
+        """The list holding annotations of a kind"""
+        return {
+            "keypoint": self.keypoints,
+            "curve": self.curves,
+            "smooth_curve": self.smooth_curves,
+            "bbox": self.bboxes,
+        }[kind]
+    
+    def begin_edit(self, key, x, y):
+        """Start dragging a control point, a bbox corner or a whole annotation"""
+        kind, annotation_id = key
+        annotations = self.annotation_list(kind)
+        idx = next((i for i, a in enumerate(annotations) if a[0] == annotation_id), None)
+        if idx is None:
+            return
+        annotation = annotations[idx]
+        
+        # Grab a handle when the press is on one, otherwise move the whole annotation
+        action, handle, pixels = "move", None, None
+        if kind in ("curve", "smooth_curve"):
+            pixels = [(p[2], p[3]) for p in annotation[1]]
+            handle = editing.nearest_vertex(pixels, x, y, self.pick_radius)
+            if handle is not None:
+                action = "vertex"
+        elif kind == "bbox":
+            pixels = self.bbox_pixels(annotation)
+            handle = editing.bbox_corner_at(*pixels, x, y, self.pick_radius)
+            if handle is not None:
+                action = "corner"
+        
+        self.edit_state = {
+            'key': key, 'index': idx, 'action': action, 'handle': handle,
+            'pixels': pixels, 'start': (x, y), 'last': (x, y),
+        }
+    
+    def update_edit(self, x, y):
+        """Apply a drag step, only touching the canvas items that changed"""
+        state = self.edit_state
+        kind, annotation_id = state['key']
+        items = self.canvas_items.get(state['key'], {})
+        
+        if state['action'] == "vertex":
+            pixels = state['pixels']
+            i = state['handle']
+            pixels[i] = (x, y)
+            self.canvas.coords(items['handles'][i], x-3, y-3, x+3, y+3)
+            if i == 0:
+                self.canvas.coords(items['label'], x, y-15)
+            
+            if kind == "curve":
+                # The two polyline segments meeting at the vertex
+                for seg in ((i - 1) % len(pixels), i):
+                    p1, p2 = pixels[seg], pixels[(seg + 1) % len(pixels)]
+                    self.canvas.coords(items['segments'][seg], p1[0], p1[1], p2[0], p2[1])
+            else:
+                self.update_smooth_curve_spans(annotation_id, pixels, i)
+        
+        elif state['action'] == "corner":
+            box = editing.move_bbox_corner(*state['pixels'], state['handle'], x, y)
+            self.canvas.coords(items['rect'], *box)
+            self.canvas.coords(items['label'], box[0], box[1]-10)
+            state['current'] = box
+        
+        else:
+            last_x, last_y = state['last']
+            prefix = {"keypoint": "kp", "curve": "curve", "smooth_curve": "smooth_curve", "bbox": "bbox"}[kind]
+            self.canvas.move(f"{prefix}_{annotation_id}", x - last_x, y - last_y)
+        
+        state['last'] = (x, y)
+    
+    def update_smooth_curve_spans(self, curve_id, pixels, index):
+        """Recompute only the Catmull-Rom spans that depend on a moved control point"""
+        items = self.canvas_items[("smooth_curve", curve_id)]
+        _, _, smoothness = self.smooth_curves[self.edit_state['index']]
+        layout = editing.catmull_rom_layout(pixels) if len(pixels) > 2 else None
+        
+        if layout != items['layout']:
+            # Opening or closing the loop changes every span, redraw the curve
+            self.canvas.delete(f"smooth_curve_{curve_id}")
+            img_width = self.current_image_data.width
+            img_height = self.current_image_data.height
+            points = [(px / img_width, py / img_height, px, py) for px, py in pixels]
+            self.draw_smooth_curve((curve_id, points, smoothness))
+            return
+        
+        if layout is None:
+            p1, p2 = pixels
+            self.canvas.coords(items['spans'][0], p1[0], p1[1], p2[0], p2[1])
+            return
+        
+        for span in editing.spans_for_point(layout, index):
+            span_points = editing.catmull_rom_span(pixels, layout, span, smoothness)
+            self.canvas.coords(items['spans'][span], *[c for p in span_points for c in p])
+    
+    def finish_edit(self):
+        """Store the result of a drag in the annotation data and its index"""
+        state = self.edit_state
+        self.edit_state = None
+        kind, annotation_id = state['key']
+        annotations = self.annotation_list(kind)
+        idx = state['index']
+        annotation = annotations[idx]
+        img_width = self.current_image_data.width
+        img_height = self.current_image_data.height
+        dx = state['last'][0] - state['start'][0]
+        dy = state['last'][1] - state['start'][1]
+        
+        if state['action'] == "vertex":
+            points = [(px / img_width, py / img_height, px, py) for px, py in state['pixels']]
+            annotations[idx] = (annotation_id, points) + tuple(annotation[2:])
+        elif state['action'] == "corner":
+            if 'current' not in state:
+                return
+            x1, y1, x2, y2 = state['current']
+            annotations[idx] = (annotation_id, (x1 + x2) / (2 * img_width), (y1 + y2) / (2 * img_height),
+                                (x2 - x1) / img_width, (y2 - y1) / img_height)
+        else:
+            if dx == 0 and dy == 0:
+                return
+            if kind == "keypoint":
+                x, y = annotation[3] + dx, annotation[4] + dy
+                annotations[idx] = (annotation_id, x / img_width, y / img_height, x, y)
+            elif kind == "bbox":
+                _, x_center, y_center, width, height = annotation
+                annotations[idx] = (annotation_id, x_center + dx / img_width, y_center + dy / img_height,
+                                    width, height)
+            else:
+                points = [((p[2] + dx) / img_width, (p[3] + dy) / img_height, p[2] + dx, p[3] + dy)
+                          for p in annotation[1]]
+                annotations[idx] = (annotation_id, points) + tuple(annotation[2:])
+        
+        self.index_annotation(kind, annotations[idx])
+        if kind == "keypoint":
+            self.update_keypoint_list()
+        elif kind == "bbox":
+            self.update_bbox_list()
     
     def update_keypoint_list(self):
         """Update the keypoints list in the UI"""
@@ -733,6 +910,8 @@ class CocoAnnotator:
                 if 0 <= idx < len(self.keypoints):
                     kp_id = self.keypoints[idx][0]
                     self.canvas.delete(f"kp_{kp_id}")
+                    self.spatial_index.remove(("keypoint", kp_id))
+                    self.canvas_items.pop(("keypoint", kp_id), None)
                     self.keypoints.pop(idx)
                     self.update_keypoint_list()
         
@@ -743,6 +922,8 @@ class CocoAnnotator:
                 if 0 <= idx < len(self.curves):
                     curve_id = self.curves[idx][0]
                     self.canvas.delete(f"curve_{curve_id}")
+                    self.spatial_index.remove(("curve", curve_id))
+                    self.canvas_items.pop(("curve", curve_id), None)
                     self.curves.pop(idx)
                     self.update_curve_list()
         
@@ -753,6 +934,8 @@ class CocoAnnotator:
                 if 0 <= idx < len(self.smooth_curves):
                     curve_id = self.smooth_curves[idx][0]
                     self.canvas.delete(f"smooth_curve_{curve_id}")
+                    self.spatial_index.remove(("smooth_curve", curve_id))
+                    self.canvas_items.pop(("smooth_curve", curve_id), None)
                     self.smooth_curves.pop(idx)
                     self.update_smooth_curve_list()
         
@@ -763,6 +946,8 @@ class CocoAnnotator:
                 if 0 <= idx < len(self.bboxes):
                     bbox_id = self.bboxes[idx][0]
                     self.canvas.delete(f"bbox_{bbox_id}")
+                    self.spatial_index.remove(("bbox", bbox_id))
+                    self.canvas_items.pop(("bbox", bbox_id), None)
                     self.bboxes.pop(idx)
                     self.update_bbox_list()
     
@@ -795,115 +980,46 @@ class CocoAnnotator:
                 img_width = self.current_image_data.width
                 img_height = self.current_image_data.height
                 
+                # The document parses both the normalized and the old pixel
+                # format and renumbers duplicate ids; it keeps coordinates normalized
+                self.doc.load(data, "curve_enh", pixel_size=(img_width, img_height))
+                annotations = self.doc.annotations
+                
+                def with_pixels(points):
+                    return [(x_norm, y_norm, int(x_norm * img_width), int(y_norm * img_height))
+                            for x_norm, y_norm in points]
+                
                 # Load keypoints
                 self.keypoints = []
-                for kp in data.get('keypoints', []):
-                    # Handle both old and new format
-                    if 'x_norm' in kp:
-                        # New format with normalized coordinates
-                        kp_id = kp['id']
-                        x_norm = kp['x_norm']
-                        y_norm = kp['y_norm']
-                        # Convert to pixel coordinates for display
-                        x = int(x_norm * img_width)
-                        y = int(y_norm * img_height)
-                        keypoint = (kp_id, x_norm, y_norm, x, y)
-                    else:
-                        # Old format with pixel coordinates
-                        kp_id = kp['id']
-                        x = kp['x']
-                        y = kp['y']
-                        # Calculate normalized coordinates
-                        x_norm = x / img_width
-                        y_norm = y / img_height
-                        keypoint = (kp_id, x_norm, y_norm, x, y)
-                        
+                for kp_id, x_norm, y_norm in annotations["keypoint"].values():
+                    keypoint = (kp_id, x_norm, y_norm, int(x_norm * img_width), int(y_norm * img_height))
                     self.keypoints.append(keypoint)
                     self.draw_keypoint(keypoint)
+                    self.index_annotation("keypoint", keypoint)
                 
                 # Load curves
                 self.curves = []
-                for c in data.get('curves', []):
-                    curve_id = c['id']
-                    
-                    if 'normalized_points' in c:
-                        # New format with normalized points
-                        norm_points = c['normalized_points']
-                        points = []
-                        for p in norm_points:
-                            x_norm = p['x_norm']
-                            y_norm = p['y_norm']
-                            # Convert to pixel coordinates for display
-                            x = int(x_norm * img_width)
-                            y = int(y_norm * img_height)
-                            points.append((x_norm, y_norm, x, y))
-                    else:
-                        # Old format with pixel points
-                        points = []
-                        for p in c['points']:
-                            x = p['x']
-                            y = p['y']
-                            # Calculate normalized coordinates
-                            x_norm = x / img_width
-                            y_norm = y / img_height
-                            points.append((x_norm, y_norm, x, y))
-                            
-                    curve_data = (curve_id, points)
+                for curve_id, points in annotations["curve"].values():
+                    curve_data = (curve_id, with_pixels(points))
                     self.curves.append(curve_data)
                     self.draw_curve(curve_data)
+                    self.index_annotation("curve", curve_data)
                 
                 # Load smooth curves
                 self.smooth_curves = []
-                for sc in data.get('smooth_curves', []):
-                    curve_id = sc['id']
-                    smoothness = sc['smoothness']
-                    
-                    if 'normalized_points' in sc:
-                        # New format with normalized points
-                        norm_points = sc['normalized_points']
-                        points = []
-                        for p in norm_points:
-                            x_norm = p['x_norm']
-                            y_norm = p['y_norm']
-                            # Convert to pixel coordinates for display
-                            x = int(x_norm * img_width)
-                            y = int(y_norm * img_height)
-                            points.append((x_norm, y_norm, x, y))
-                    else:
-                        # Old format with pixel points
-                        points = []
-                        for p in sc['points']:
-                            x = p['x']
-                            y = p['y']
-                            # Calculate normalized coordinates
-                            x_norm = x / img_width
-                            y_norm = y / img_height
-                            points.append((x_norm, y_norm, x, y))
-                    
-                    curve_data = (curve_id, points, smoothness)
+                for curve_id, points, smoothness in annotations["smooth_curve"].values():
+                    curve_data = (curve_id, with_pixels(points), smoothness)
                     self.smooth_curves.append(curve_data)
                     self.draw_smooth_curve(curve_data)
+                    self.index_annotation("smooth_curve", curve_data)
                 
-                # Load bounding boxes (support both old format and YOLO format)
+                # Load bounding boxes in YOLO format
                 self.bboxes = []
-                img_width = self.current_image_data.width
-                img_height = self.current_image_data.height
-                
-                for bb in data.get('bboxes', []):
-                    if 'x1' in bb:  # Old format with pixel coordinates
-                        # Convert to YOLO format
-                        x1, y1 = bb['x1'], bb['y1']
-                        x2, y2 = bb['x2'], bb['y2']
-                        x_center = (x1 + x2) / (2 * img_width)
-                        y_center = (y1 + y2) / (2 * img_height)
-                        width = (x2 - x1) / img_width
-                        height = (y2 - y1) / img_height
-                        bbox_data = (bb['id'], x_center, y_center, width, height)
-                    else:  # New YOLO format
-                        bbox_data = (bb['id'], bb['x_center'], bb['y_center'], bb['width'], bb['height'])
-                    
+                for bbox_id, x1, y1, x2, y2 in annotations["bbox"].values():
+                    bbox_data = (bbox_id, (x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1)
                     self.bboxes.append(bbox_data)
                     self.draw_bbox(bbox_data, img_width, img_height)
+                    self.index_annotation("bbox", bbox_data)
                 
                 # Update UI lists
                 self.update_keypoint_list()
@@ -929,20 +1045,10 @@ class CocoAnnotator:
         json_filename = f"{base_filename}_annotations.json"
         json_path = os.path.join(self.annotations_dir, json_filename)
         
-        # Prepare data to save
-        data = {
-            'image_filename': img_filename,
-            'keypoints': [{'id': kp[0], 'x_norm': kp[1], 'y_norm': kp[2]} for kp in self.keypoints],
-            'curves': [{'id': c[0], 
-                       'normalized_points': [{'x_norm': p[0], 'y_norm': p[1]} for p in c[1]]} 
-                      for c in self.curves],
-            'smooth_curves': [{'id': sc[0], 
-                              'normalized_points': [{'x_norm': p[0], 'y_norm': p[1]} for p in sc[1]], 
-                              'smoothness': sc[2]} 
-                             for sc in self.smooth_curves],
-            'bboxes': [{'id': bb[0], 'x_center': bb[1], 'y_center': bb[2], 'width': bb[3], 'height': bb[4]} 
-                      for bb in self.bboxes]
-        }
+        # Prepare data to save, the document writes the file format
+        self.sync_document()
+        self.doc.fields['image_filename'] = img_filename
+        data = self.doc.to_data("curve_enh")
         
         try:
             # Save JSON with all annotations
@@ -957,6 +1063,15 @@ class CocoAnnotator:
             messagebox.showerror("Error", f"Failed to save annotations: {str(e)}")
             return False
     
+    def sync_document(self):
+        """Copy the annotations into the document, in normalized coordinates"""
+        annotations = self.doc.annotations
+        annotations["keypoint"] = {kp[0]: kp[:3] for kp in self.keypoints}
+        annotations["curve"] = {c[0]: (c[0], [p[:2] for p in c[1]]) for c in self.curves}
+        annotations["smooth_curve"] = {sc[0]: (sc[0], [p[:2] for p in sc[1]], sc[2]) for sc in self.smooth_curves}
+        annotations["bbox"] = {bb[0]: (bb[0], bb[1] - bb[3] / 2, bb[2] - bb[4] / 2, bb[1] + bb[3] / 2, bb[2] + bb[4] / 2)
+                               for bb in self.bboxes}
+    
     def prompt_save_annotations(self):
         """Prompt the user to save annotations before moving to another image"""
         if any([self.keypoints, self.curves, self.smooth_curves, self.bboxes]):
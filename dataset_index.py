@@ -0,0 +1,90 @@
+import os
+import threading
+
+import numpy as np
+
+INDEX_NAME = "dataset_index.npz"
+
+# Jobs updating the index of a dataset hold this from opening it until it is saved
+index_lock = threading.Lock()
+
+
+class DatasetIndex:
+    """Per-image columns of a dataset, stored in annotations/dataset_index.npz
+
+    Every column is a NumPy array with one row per image, rows are matched
+    to images by file name. Jobs fill in the columns they compute (e.g.
+    perceptual hashes) together with what they were computed from, so
+    later runs only redo images that changed.
+    """
+
+    def __init__(self, path, columns=None):
+        self.path = path
+        self.columns = columns or {'name': np.array([], dtype=str)}
+
+    @classmethod
+    def open(cls, dataset_path):
+        """Index of a dataset, empty if there is none yet or it can't be read"""
+        path = os.path.join(dataset_path, "annotations", INDEX_NAME)
+        try:
+            with np.load(path, allow_pickle=False) as f:
+                return cls(path, {key: f[key] for key in f.files})
+        except (OSError, ValueError):
+            return cls(path)
+
+    def __len__(self):
+        return len(self.columns['name'])
+
+    def __contains__(self, key):
+        return key in self.columns
+
+    def __getitem__(self, key):
+        return self.columns[key]
+
+    def __setitem__(self, key, values):
+        values = np.asarray(values)
+        if len(values) != len(self):
+            raise ValueError(f"Column {key!r} has {len(values)} rows, the index {len(self)}")
+        self.columns[key] = values
+
+    def reindex(self, names):
+        """Make the rows exactly these images in this order
+
+        Columns keep the values of images that were in the index, new
+        images get zeros. Returns a mask of the rows that were known.
+        """
+        rows = {name: i for i, name in enumerate(self.columns['name'].tolist())}
+        old_rows = np.array([rows.get(name, -1) for name in names], dtype=np.int64)
+        known = old_rows >= 0
+        columns = {'name': np.array(names, dtype=str)}
+        for key, values in self.columns.items():
+            if key == 'name':
+                continue
+            column = np.zeros(len(names), dtype=values.dtype)
+            column[known] = values[old_rows[known]]
+            columns[key] = column
+        self.columns = columns
+        return known
+
+    def save(self):
+        """Write the index atomically"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **self.columns)
+        os.replace(tmp_path, self.path)
+        return self.path
+
+
+def file_stats(paths):
+    """(modification times, sizes) of files, -1 for files that can't be read"""
+    mtimes = np.full(len(paths), -1.0)
+    sizes = np.full(len(paths), -1, dtype=np.int64)
+    for i, path in enumerate(paths):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        mtimes[i] = stat.st_mtime
+        sizes[i] = stat.st_size
+    return mtimes, sizes
@@ -0,0 +1,113 @@
+import os
+
+import annotation_io
+from annotation_io import ANNOTATION_FIELDS, ConflictError
+from annotation_ids import IdAllocator
+from leases import LeaseManager, default_owner
+
+
+def export_yolo_job(job, dataset_path, images):
+    """Export the boxes of every annotated image, returns the number of files written"""
+    exported_count = 0
+    for img_path in images:
+        try:
+            if annotation_io.export_yolo(dataset_path, img_path):
+                exported_count += 1
+        except Exception as e:
+            job.log_error(os.path.basename(img_path), e)
+        job.step()
+    return exported_count
+
+
+def migrate_annotation_data(data):
+    """Bring annotation data to the current format, returns True if it changed
+
+    Older files have no `next_ids` and may hold duplicate ids; duplicates
+    are renumbered the same way the annotator does when loading them.
+    """
+    ids = IdAllocator(ANNOTATION_FIELDS)
+    ids.restore(data.get('next_ids'))
+    for kind, field in ANNOTATION_FIELDS.items():
+        for entry in data.get(field, []):
+            ids.observe(kind, entry['id'])
+
+    changed = 'next_ids' not in data
+    for kind, field in ANNOTATION_FIELDS.items():
+        taken = set()
+        for entry in data.get(field, []):
+            annotation_id = ids.claim(kind, entry['id'], taken)
+            if annotation_id != entry['id']:
+                entry['id'] = annotation_id
+                changed = True
+            taken.add(annotation_id)
+
+    if data.get('next_ids') != ids.state():
+        data['next_ids'] = ids.state()
+        changed = True
+    return changed
+
+
+def migrate_annotations_job(job, dataset_path, images):
+    """Rewrite outdated annotation files, returns the number of files migrated
+
+    Other annotators may be editing the dataset: images leased by someone
+    else are skipped, and so are files saved again between reading and
+    writing them. Skipped files are logged, running the job again later
+    migrates them.
+    """
+    # Our own owner, so the lease of the image open in this annotator counts as someone else's
+    leases = LeaseManager(os.path.join(dataset_path, "annotations", ".locks"), owner=f"{default_owner()}:migrate")
+    migrated = 0
+    for img_path in images:
+        name = os.path.basename(img_path)
+        path = annotation_io.annotation_path(dataset_path, img_path)
+        try:
+            held, record = leases.acquire(name)
+            if not held:
+                job.log_error(name, f"skipped, leased by {(record or {}).get('owner', 'another annotator')}")
+            else:
+                try:
+                    data = annotation_io.read_annotation_file(path)
+                    if data is not None and migrate_annotation_data(data):
+                        annotation_io.write_annotation_file_checked(path, data, annotation_io.file_revision(data))
+                        migrated += 1
+                finally:
+                    leases.release(name)
+        except (ConflictError, TimeoutError) as e:
+            job.log_error(name, f"skipped, {e}")
+        except Exception as e:
+            job.log_error(os.path.basename(path), e)
+        job.step()
+    return migrated
+
+
+def dataset_stats_job(job, dataset_path, images):
+    """Count annotated images and annotations of every kind"""
+    stats = dict.fromkeys(ANNOTATION_FIELDS, 0)
+    stats['images'] = len(images)
+    stats['annotated_images'] = 0
+    for img_path in images:
+        try:
+            data = annotation_io.read_annotation_file(annotation_io.annotation_path(dataset_path, img_path))
+        except Exception as e:
+            job.log_error(os.path.basename(img_path), e)
+            data = None
+        if data:
+            counts = {kind: len(data.get(field, [])) for kind, field in ANNOTATION_FIELDS.items()}
+            if any(counts.values()):
+                stats['annotated_images'] += 1
+            for kind, count in counts.items():
+                stats[kind] += count
+        job.step()
+    return stats
+
+
+def warm_cache_job(job, cache, images, max_width, max_height):
+    """Decode images into the display image cache ahead of navigation"""
+    for img_path in images:
+        try:
+            cache.load(img_path, max_width, max_height)
+        except Exception as e:
+            job.log_error(os.path.basename(img_path), e)
+        job.step()
+    return len(images)
@@ -0,0 +1,72 @@
+import math
+
+import numpy as np
+
+# Bounding box corners in the order (x from left/right, y from top/bottom)
+BBOX_CORNERS = ((0, 0), (1, 0), (1, 1), (0, 1))
+
+
+def nearest_vertex(points, x, y, radius):
+    """Index of the vertex closest to (x, y) within radius, or None"""
+    best, best_dist = None, radius
+    for i, point in enumerate(points):
+        dist = math.hypot(point[0] - x, point[1] - y)
+        if dist <= best_dist:
+            best, best_dist = i, dist
+    return best
+
+
+def bbox_corner_at(x1, y1, x2, y2, x, y, radius):
+    """Index into BBOX_CORNERS of the corner handle at (x, y), or None"""
+    xs, ys = (x1, x2), (y1, y2)
+    return nearest_vertex([(xs[cx], ys[cy]) for cx, cy in BBOX_CORNERS], x, y, radius)
+
+
+def move_bbox_corner(x1, y1, x2, y2, corner, x, y):
+    """Move one corner of a box, returns the box with x1,y1 top-left again"""
+    cx, cy = BBOX_CORNERS[corner]
+    xs, ys = [x1, x2], [y1, y2]
+    xs[cx], ys[cy] = x, y
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def is_closed_curve(points):
+    """Smooth curves whose end points meet are drawn as closed loops"""
+    return abs(points[0][0] - points[-1][0]) < 10 and abs(points[0][1] - points[-1][1]) < 10
+
+
+def catmull_rom_layout(points):
+    """Control point index behind every entry of the extended Catmull-Rom sequence
+
+    Closed curves drop the duplicated end point and wrap around, open curves
+    repeat their first and last points. Span `s` of the curve is driven by
+    the four entries layout[s:s + 4].
+    """
+    count = len(points)
+    if is_closed_curve(points):
+        loop = list(range(count - 1)) + [0]
+        return [loop[-2]] + loop + [loop[1]]
+    return [0] + list(range(count)) + [count - 1]
+
+
+def spans_for_point(layout, index):
+    """Spans whose shape depends on control point `index`"""
+    return [span for span in range(len(layout) - 3) if index in layout[span:span + 4]]
+
+
+def catmull_rom_span(points, layout, span, smoothness, num_segments=10):
+    """Points of one Catmull-Rom span, including both of its end points"""
+    p0, p1, p2, p3 = (np.asarray(points[i][:2], dtype=float) for i in layout[span:span + 4])
+    t = np.linspace(0.0, 1.0, num_segments + 1)[:, None]
+    t2 = t * t
+    t3 = t2 * t
+
+    # Tension is controlled by the smoothness setting
+    s = 1.0 - smoothness
+    pos = 0.5 * (
+        (2 * p1) +
+        (-p0 + p2) * s * t +
+        (2 * p0 - 5 * p1 + 4 * p2 - p3) * s * t2 +
+        (-p0 + 3 * p1 - 3 * p2 + p3) * s * t3
+    )
+    return [(int(px), int(py)) for px, py in pos]
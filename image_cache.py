@@ -0,0 +1,57 @@
+import threading
+from collections import OrderedDict
+
+import annotation_io
+
+
+class ImageCache:
+    """LRU cache of decoded display images, shared between Tk and workers
+
+    Entries are keyed by (path, max width, max height) since the display
+    image depends on the canvas size it was fitted to.
+    """
+
+    def __init__(self, max_items=32):
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def get(self, key):
+        """Cached (display image, original size), or None"""
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """Store a decoded image, evicting the least recently used ones"""
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def load(self, path, max_width=None, max_height=None, source=None):
+        """Decode an image through the cache, safe to call from workers
+
+        `source` returns a file object to decode instead of opening `path`,
+        e.g. for images fetched from the annotation server.
+        """
+        key = (path, max_width, max_height)
+        value = self.get(key)
+        if value is None:
+            value = annotation_io.load_display_image(source() if source else path, max_width, max_height)
+            self.put(key, value)
+        return value
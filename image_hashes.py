@@ -0,0 +1,178 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+import annotation_io
+from dataset_index import DatasetIndex, file_stats, index_lock
+from jobs import run_chunks
+
+HASH_SIZE = 8  # 8x8 = 64 bit hashes
+PHASH_SIZE = 32  # pHash takes the DCT of a 32x32 rendition
+MAX_DISTANCE = 6  # Hamming distance up to which two images count as near-duplicates
+BLOCKS = 4  # Substrings of the multi-index search, 16 bits each
+
+# DCT-II basis, pHash keeps the lowest 8x8 frequencies of it
+_n = np.arange(PHASH_SIZE)
+DCT = np.cos(np.pi * (2 * _n[None, :] + 1) * _n[:, None] / (2 * PHASH_SIZE))
+_BYTE_BITS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def pack_bits(bits):
+    """64 booleans as one unsigned 64 bit integer, first bit highest"""
+    return np.packbits(bits.ravel()).view(">u8")[0].astype(np.uint64)
+
+
+def dhash(gray):
+    """Difference hash: is every pixel of a 9x8 rendition brighter than its left neighbour"""
+    small = np.asarray(gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR), dtype=np.int16)
+    return pack_bits(small[:, 1:] > small[:, :-1])
+
+
+def phash(gray):
+    """DCT hash: is every low frequency above the median of them, DC left out of the median"""
+    small = np.asarray(gray.resize((PHASH_SIZE, PHASH_SIZE), Image.BILINEAR), dtype=float)
+    low = (DCT @ small @ DCT.T)[:HASH_SIZE, :HASH_SIZE]
+    return pack_bits(low > np.median(low.ravel()[1:]))
+
+
+def hash_image(path):
+    """(dHash, pHash) of an image file"""
+    with annotation_io.open_image(path, (PHASH_SIZE * 2, PHASH_SIZE * 2)) as image:
+        # JPEGs are decoded at 1/8 scale, only a tiny rendition is needed
+        image.draft("L", (PHASH_SIZE * 2, PHASH_SIZE * 2))
+        gray = image.convert("L")
+    return dhash(gray), phash(gray)
+
+
+def hash_chunk(paths):
+    """Hashes of some images, runs in a worker process
+
+    Returns dHashes, pHashes and (index, message) of images that failed.
+    """
+    dhashes = np.zeros(len(paths), dtype=np.uint64)
+    phashes = np.zeros(len(paths), dtype=np.uint64)
+    errors = []
+    for i, path in enumerate(paths):
+        try:
+            dhashes[i], phashes[i] = hash_image(path)
+        except Exception as e:
+            errors.append((i, str(e)))
+    return dhashes, phashes, errors
+
+
+def popcount(values):
+    """Number of set bits of every uint64"""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _BYTE_BITS[values.astype(np.uint64).view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def near_duplicate_pairs(phashes, dhashes, max_distance=MAX_DISTANCE, valid=None):
+    """Pairs (i, j), i < j, whose pHashes and dHashes both differ in at most `max_distance` bits
+
+    Multi-index hashing instead of comparing all pairs: the pHashes are cut
+    into BLOCKS substrings. Two hashes within `max_distance` have at least
+    one substring within max_distance // BLOCKS bits of each other. For
+    every substring, each hash is looked up in a table of the 16 bit
+    substrings with that many bits flipped. Only these candidates get the
+    full distance check.
+    """
+    n = len(phashes)
+    if valid is None:
+        valid = np.ones(n, dtype=bool)
+    width = 64 // BLOCKS
+    flips = [0] + [1 << bit for bit in range(width)] if max_distance // BLOCKS >= 1 else [0]
+    if max_distance // BLOCKS >= 2:
+        flips += [(1 << a) | (1 << b) for a in range(width) for b in range(a + 1, width)]
+    found = []
+    for block in range(BLOCKS):
+        keys = ((phashes >> np.uint64(block * width)) & np.uint64((1 << width) - 1)).astype(np.int64)
+        # Hashes sorted by substring, with the first row and size of every substring's bucket
+        order = np.argsort(keys, kind="stable")
+        bucket_sizes = np.bincount(keys, minlength=1 << width)
+        bucket_starts = np.cumsum(bucket_sizes) - bucket_sizes
+        for flip in flips:
+            probes = keys ^ flip
+            lo = bucket_starts[probes]
+            counts = bucket_sizes[probes]
+            total = counts.sum()
+            if not total:
+                continue
+            # Expand every hash's range of matching substrings into candidate pairs
+            a = np.repeat(np.arange(n), counts)
+            offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            b = order[np.repeat(lo, counts) + offsets]
+            keep = (a < b) & valid[a] & valid[b]
+            a, b = a[keep], b[keep]
+            close = ((popcount(phashes[a] ^ phashes[b]) <= max_distance)
+                     & (popcount(dhashes[a] ^ dhashes[b]) <= max_distance))
+            found.append(a[close] * n + b[close])
+    if not found:
+        return np.zeros((0, 2), dtype=np.int64)
+    pairs = np.unique(np.concatenate(found))
+    return np.stack([pairs // n, pairs % n], axis=1)
+
+
+def cluster(n, pairs):
+    """Group label of every image: the index of the first image of its group"""
+    parent = np.arange(n)
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b in pairs.tolist():
+        ra, rb = root(a), root(b)
+        if ra != rb:
+            # The earlier image stays the root, so it represents the group
+            parent[max(ra, rb)] = min(ra, rb)
+    return np.array([root(i) for i in range(n)])
+
+
+def near_duplicates_job(job, dataset_path, images, workers=None, chunk_size=256, max_distance=MAX_DISTANCE):
+    """Hash every image across a process pool and group the near-duplicates
+
+    Hashes are kept in the dataset index together with the size and
+    modification time of the image, only new or changed images are hashed
+    again. Returns `images` and the group label of each of them, see
+    `cluster`, as the dataset may have changed by the time the job ends.
+    """
+    with index_lock:
+        index = DatasetIndex.open(dataset_path)
+        known = index.reindex([os.path.basename(p) for p in images])
+        # Frames of a multi-frame file change together with it
+        mtimes, sizes = file_stats([annotation_io.split_frame(p)[0] for p in images])
+        if 'phash' in index:
+            fresh = known & index['hashed'] & (index['image_mtime'] == mtimes) & (index['image_bytes'] == sizes)
+        else:
+            fresh = np.zeros(len(images), dtype=bool)
+            for key in ('dhash', 'phash'):
+                index[key] = np.zeros(len(images), dtype=np.uint64)
+            index['hashed'] = fresh.copy()
+        index['image_mtime'] = mtimes
+        index['image_bytes'] = sizes
+
+        stale = np.flatnonzero(~fresh)
+        job.step(len(images) - len(stale))
+        if len(stale):
+            chunk_rows = [stale[start:start + chunk_size] for start in range(0, len(stale), chunk_size)]
+
+            def hashed(chunk, result):
+                rows = chunk_rows[chunk]
+                dhashes, phashes, errors = result
+                index['dhash'][rows] = dhashes
+                index['phash'][rows] = phashes
+                index['hashed'][rows] = True
+                for i, message in errors:
+                    index['hashed'][rows[i]] = False
+                    job.log_error(os.path.basename(images[rows[i]]), message)
+                job.step(len(rows))
+
+            run_chunks(job, hash_chunk, [([images[i] for i in rows],) for rows in chunk_rows], hashed, workers)
+            index.save()
+
+    pairs = near_duplicate_pairs(index['phash'], index['dhash'], max_distance, index['hashed'])
+    return images, cluster(len(images), pairs)
@@ -0,0 +1,130 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class _NullSpan:
+    """Shared do-nothing span handed out while tracing is off"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer.add(self.name, self.start, time.perf_counter() - self.start, **self.args)
+        return False
+
+
+class Tracer:
+    """Opt-in latency spans kept in a ring buffer
+
+    Spans are (name, thread, start, duration, args) records of the last
+    `capacity` events. While `enabled` is off, `span` returns a shared no-op
+    context and `traced` functions cost one attribute check, so the
+    instrumentation can stay in the hot paths. Appending to a deque is
+    atomic, workers record their spans without a lock.
+    """
+
+    def __init__(self, capacity=4096, enabled=False):
+        self.enabled = enabled
+        self.events = deque(maxlen=capacity)
+        self.origin = time.perf_counter()
+
+    def span(self, name, **args):
+        """Context manager timing a block"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def traced(self, name):
+        """Decorator timing every call of a function"""
+        def decorate(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.add(name, start, time.perf_counter() - start)
+            return wrapper
+        return decorate
+
+    def now(self):
+        """Start time for `add`, or None while tracing is off"""
+        return time.perf_counter() if self.enabled else None
+
+    def add(self, name, start, duration=None, **args):
+        """Record a span, e.g. one that started and ended in different callbacks"""
+        if start is None:
+            return
+        if duration is None:
+            duration = time.perf_counter() - start
+        self.events.append((name, threading.get_ident(), start, duration, args))
+
+    def clear(self):
+        self.events.clear()
+
+    def latest(self, name):
+        """Duration of the most recent span with this name in seconds, or None"""
+        for event in reversed(self.events):
+            if event[0] == name:
+                return event[3]
+        return None
+
+    def percentiles(self, quantiles=(50, 90, 99)):
+        """Per span name: count, mean, max and the given percentiles, in milliseconds"""
+        durations = {}
+        for name, _, _, duration, _ in list(self.events):
+            durations.setdefault(name, []).append(duration * 1e3)
+        stats = {}
+        for name, values in sorted(durations.items()):
+            values.sort()
+            entry = {'count': len(values), 'mean': sum(values) / len(values), 'max': values[-1]}
+            for q in quantiles:
+                entry[f"p{q}"] = values[min(len(values) - 1, int(q / 100 * len(values)))]
+            stats[name] = entry
+        return stats
+
+    def chrome_trace(self):
+        """Events in the Chrome trace_event format, for chrome://tracing or Perfetto"""
+        pid = os.getpid()
+        threads = {}
+        events = []
+        for name, tid, start, duration, args in list(self.events):
+            threads.setdefault(tid, f"worker-{len(threads)}" if tid != threading.main_thread().ident else "main")
+            events.append({'name': name, 'ph': "X", 'pid': pid, 'tid': tid,
+                           'ts': (start - self.origin) * 1e6, 'dur': duration * 1e6, 'args': args})
+        for tid, thread_name in threads.items():
+            events.append({'name': "thread_name", 'ph': "M", 'pid': pid, 'tid': tid,
+                           'args': {'name': thread_name}})
+        return {'traceEvents': events, 'displayTimeUnit': "ms"}
+
+    def export_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        return path
+
+
+# Process-wide tracer, ANNOTATOR_TRACE=1 turns it on from the start
+tracer = Tracer(enabled=os.environ.get("ANNOTATOR_TRACE", "") not in ("", "0"))
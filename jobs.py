@@ -0,0 +1,278 @@
+import multiprocessing
+import os
+import time
+import tkinter as tk
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from tkinter import ttk, messagebox
+
+
+class JobCancelled(Exception):
+    """Raised inside a job function by `Job.step` once the job was cancelled"""
+
+
+class Job:
+    """Progress, cancellation and error log of one background job
+
+    The job function runs in a worker and only touches plain attributes, the
+    jobs window reads them periodically on the Tk thread.
+    """
+
+    def __init__(self, job_id, name, total=0):
+        self.job_id = job_id
+        self.name = name
+        self.total = total
+        self.done = 0
+        self.status = "queued"
+        self.result = None
+        self.errors = []  # (item, message) pairs of items that failed
+        self.started = None
+        self.finished = None
+        self.task = None
+
+    @property
+    def cancelled(self):
+        return self.task is not None and self.task.cancelled
+
+    @property
+    def running(self):
+        return self.status in ("queued", "running", "cancelling")
+
+    def cancel(self):
+        """Ask the job to stop after its current item"""
+        if self.task is None or not self.running:
+            return
+        # A queued job never starts, a running one stops at its next step
+        self.status = "cancelled" if self.status == "queued" else "cancelling"
+        self.task.cancel()
+
+    def step(self, count=1):
+        """Count finished items, raises JobCancelled once the job is cancelled"""
+        self.done += count
+        if self.cancelled:
+            raise JobCancelled()
+
+    def log_error(self, item, error):
+        """Record an item that failed without stopping the job"""
+        self.errors.append((item, str(error)))
+
+    def eta(self):
+        """Estimated seconds left, or None before there is a rate to go by"""
+        if not self.started or not self.done or not self.total:
+            return None
+        elapsed = time.monotonic() - self.started
+        return elapsed / self.done * (self.total - self.done)
+
+    def describe_progress(self):
+        """Progress column text"""
+        if not self.total:
+            return str(self.done)
+        return f"{self.done}/{self.total} ({100 * self.done // self.total}%)"
+
+    def describe_eta(self):
+        """ETA column text"""
+        if not self.running:
+            return ""
+        eta = self.eta()
+        if eta is None:
+            return "..."
+        minutes, seconds = divmod(int(eta), 60)
+        return f"{minutes}:{seconds:02d}"
+
+
+def run_chunks(job, fn, chunks, on_result, workers=None):
+    """Call `fn(*args)` for every argument tuple in `chunks` across a process pool
+
+    `on_result(index, result)` gets the result of `chunks[index]` in the
+    job's worker as chunks finish, in any order, and usually steps the job.
+    When it raises, e.g. JobCancelled, the chunks not started yet are
+    dropped instead of waited for. A single chunk runs in the calling
+    thread, starting processes would cost more than it saves.
+    """
+    if len(chunks) < 2:
+        for index, args in enumerate(chunks):
+            on_result(index, fn(*args))
+        return
+    # Spawned workers start clean instead of forking the Tk process and its threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers or os.cpu_count(), mp_context=context) as pool:
+        futures = {pool.submit(fn, *args): index for index, args in enumerate(chunks)}
+        try:
+            for future in as_completed(futures):
+                on_result(futures[future], future.result())
+        except BaseException:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+
+class JobManager:
+    """Run dataset-wide jobs concurrently in the background
+
+    Jobs run on the "jobs" lane of the task runtime, so they never block the
+    image and annotation file lanes the annotator itself uses.
+    `fn(job, *args)` should call `job.step()` after every item and return
+    the job's result; `on_done(job)` is then called on the Tk thread.
+    """
+
+    def __init__(self, tasks, max_jobs=2):
+        self.tasks = tasks
+        self.tasks.add_lane("jobs", max_jobs)
+        self.jobs = []
+        self.listeners = []
+        self._next_id = 1
+
+    def start(self, name, fn, *args, total=0, on_done=None):
+        """Queue a job, returns its Job handle"""
+        job = Job(self._next_id, name, total)
+        self._next_id += 1
+        self.jobs.append(job)
+        job.task = self.tasks.submit(self._run, job, fn, args, lane="jobs",
+                                     on_done=lambda result: self._finished(job, on_done))
+        self._notify()
+        return job
+
+    def _run(self, job, fn, args):
+        """Worker side of a job, also sets its final status
+
+        Results of cancelled tasks are never delivered to Tk, so the status
+        can't be left to the completion callback.
+        """
+        job.status = "running"
+        job.started = time.monotonic()
+        try:
+            job.result = fn(job, *args)
+        except JobCancelled:
+            pass
+        except Exception as e:
+            job.log_error(job.name, e)
+            job.status = "failed"
+        else:
+            job.status = "done with errors" if job.errors else "done"
+        finally:
+            job.finished = time.monotonic()
+        if job.cancelled:
+            job.status = "cancelled"
+
+    def _finished(self, job, on_done):
+        """Tk side, the job function returned"""
+        self._notify()
+        if on_done and job.status.startswith("done"):
+            on_done(job)
+
+    def running(self):
+        """Jobs that are queued or still running"""
+        return [job for job in self.jobs if job.running]
+
+    def cancel_all(self):
+        for job in self.running():
+            job.cancel()
+
+    def clear_finished(self):
+        """Forget jobs that are no longer running"""
+        self.jobs = [job for job in self.jobs if job in self.running()]
+        self._notify()
+
+    def _notify(self):
+        for listener in self.listeners:
+            listener()
+
+
+class JobsWindow:
+    """Window listing the background jobs with progress, ETA and errors
+
+    Closing the window does not stop any job, it can be reopened at any time.
+    """
+
+    refresh_ms = 250
+
+    def __init__(self, root, manager):
+        self.root = root
+        self.manager = manager
+        self.window = None
+        self.tree = None
+        self._refresh_pending = False
+        manager.listeners.append(self.schedule_refresh)
+
+    def show(self):
+        """Open the window, or raise it if it is already open"""
+        if self.window is not None and self.window.winfo_exists():
+            self.window.lift()
+            self.schedule_refresh()
+            return
+
+        self.window = tk.Toplevel(self.root)
+        self.window.title("Background Jobs")
+        self.window.geometry("560x260")
+
+        self.tree = ttk.Treeview(self.window, columns=("job", "progress", "eta", "status", "errors"),
+                                 show="headings", height=8)
+        for column, text, width in (("job", "Job", 160), ("progress", "Progress", 120), ("eta", "ETA", 60),
+                                    ("status", "Status", 110), ("errors", "Errors", 60)):
+            self.tree.heading(column, text=text)
+            self.tree.column(column, width=width)
+        self.tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+
+        button_frame = ttk.Frame(self.window)
+        button_frame.pack(fill=tk.X, padx=5, pady=5)
+        ttk.Button(button_frame, text="Cancel", command=self.cancel_selected).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Show Errors", command=self.show_errors).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="Clear Finished", command=self.manager.clear_finished).pack(side=tk.LEFT, padx=5)
+        self.refresh()
+
+    def selected_job(self):
+        """Job of the selected row, or None"""
+        if self.tree is None:
+            return None
+        selection = self.tree.selection()
+        if not selection:
+            return None
+        for job in self.manager.jobs:
+            if str(job.job_id) == selection[0]:
+                return job
+        return None
+
+    def cancel_selected(self):
+        job = self.selected_job()
+        if job is not None:
+            job.cancel()
+            self.refresh()
+
+    def show_errors(self):
+        """Show the error log of the selected job"""
+        job = self.selected_job()
+        if job is None:
+            return
+        if not job.errors:
+            messagebox.showinfo("Errors", f"{job.name}: no errors", parent=self.window)
+            return
+        lines = [f"{item}: {message}" for item, message in job.errors[:50]]
+        if len(job.errors) > 50:
+            lines.append(f"... and {len(job.errors) - 50} more")
+        messagebox.showerror("Errors", f"{job.name}\n\n" + "\n".join(lines), parent=self.window)
+
+    def schedule_refresh(self):
+        """Refresh soon, and keep refreshing while jobs are running"""
+        if not self._refresh_pending and self.window is not None:
+            self._refresh_pending = True
+            self.root.after(self.refresh_ms, self.refresh)
+
+    def refresh(self):
+        """Update the rows from the job attributes"""
+        self._refresh_pending = False
+        if self.window is None or not self.window.winfo_exists():
+            self.window = None
+            self.tree = None
+            return
+
+        rows = {str(job.job_id): job for job in self.manager.jobs}
+        for iid in self.tree.get_children():
+            if iid not in rows:
+                self.tree.delete(iid)
+        for iid, job in rows.items():
+            values = (job.name, job.describe_progress(), job.describe_eta(), job.status, len(job.errors))
+            if self.tree.exists(iid):
+                self.tree.item(iid, values=values)
+            else:
+                self.tree.insert("", "end", iid=iid, values=values)
+
+        if self.manager.running():
+            self.schedule_refresh()
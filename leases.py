@@ -0,0 +1,113 @@
+import getpass
+import json
+import os
+import socket
+import time
+
+
+def default_owner():
+    """Owner string identifying this annotator process"""
+    try:
+        user = getpass.getuser()
+    except Exception:
+        user = "unknown"
+    return f"{user}@{socket.gethostname()}:{os.getpid()}"
+
+
+class LeaseManager:
+    """Per-image leases as lock files in a shared directory
+
+    A lease is a small JSON file created with O_EXCL, which also works on
+    NFS. It records its owner and an expiry time that the holder pushes
+    forward with `renew` (the heartbeat); a lease whose holder stopped
+    renewing it expires and can be taken over. Leases are advisory: they
+    tell annotators who else is working on an image, the version check on
+    save is what prevents lost updates.
+
+    All methods touch the file system and are meant to run in a worker.
+    """
+
+    def __init__(self, lock_dir, owner=None, ttl=90.0):
+        self.lock_dir = lock_dir
+        self.owner = owner or default_owner()
+        self.ttl = ttl
+        self.held = set()
+
+    def lock_path(self, name):
+        return os.path.join(self.lock_dir, f"{name}.lock")
+
+    def read(self, name):
+        """Lease record of an image, or None if it has none"""
+        try:
+            with open(self.lock_path(name), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _record(self):
+        return {'owner': self.owner, 'expires': time.time() + self.ttl}
+
+    def _write_new(self, name):
+        """Create the lock file, fails if it already exists"""
+        fd = os.open(self.lock_path(name), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._record(), f)
+
+    def _write_over(self, name):
+        """Replace the lock file with one of ours"""
+        tmp_path = f"{self.lock_path(name)}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self._record(), f)
+        os.replace(tmp_path, self.lock_path(name))
+
+    def acquire(self, name):
+        """Try to lease an image
+
+        Returns (True, None) when the lease is ours and (False, record) when
+        another annotator holds an unexpired lease on it.
+        """
+        os.makedirs(self.lock_dir, exist_ok=True)
+        try:
+            self._write_new(name)
+        except FileExistsError:
+            record = self.read(name)
+            if record and record.get('owner') != self.owner and record.get('expires', 0) > time.time():
+                return False, record
+            # Expired, unreadable or already ours
+            self._write_over(name)
+            # Two takeovers can race, whoever's file survived holds the lease
+            record = self.read(name)
+            if not record or record.get('owner') != self.owner:
+                return False, record
+        self.held.add(name)
+        return True, None
+
+    def renew(self):
+        """Heartbeat, pushes the expiry of all held leases forward
+
+        Returns the names of leases that were lost to another annotator,
+        e.g. after this process was suspended longer than the ttl.
+        """
+        lost = []
+        for name in list(self.held):
+            record = self.read(name)
+            if record is not None and record.get('owner') != self.owner:
+                self.held.discard(name)
+                lost.append(name)
+                continue
+            self._write_over(name)
+        return lost
+
+    def release(self, name):
+        """Give up a lease, only removes the lock file if it is still ours"""
+        self.held.discard(name)
+        record = self.read(name)
+        if record is not None and record.get('owner') == self.owner:
+            try:
+                os.remove(self.lock_path(name))
+            except OSError:
+                pass
+
+    def release_all(self):
+        for name in list(self.held):
+            self.release(name)
@@ -0,0 +1,103 @@
+import math
+
+import numpy as np
+from PIL import Image
+
+from annotation_document import AnnotationDocument
+
+PATCH_RADIUS = 12  # Keypoints are tracked by the patch of this radius around them, in pixels
+SEARCH_RADIUS = 40  # How far an annotation may have moved between frames, in pixels
+MAX_TEMPLATE = 64  # Larger boxes are matched at a reduced scale
+MIN_SCORE = 0.5  # Matches with a lower correlation leave the annotation where it was
+
+
+def match_template(search, template):
+    """Normalized cross-correlation of a template at every position inside a search area
+
+    The correlation is computed with FFTs and normalized with running sums
+    of the search area (Lewis, "Fast Normalized Cross-Correlation"). The
+    result has one score in [-1, 1] per top-left position of the template.
+    Returns None for a template without any texture.
+    """
+    h, w = template.shape
+    H, W = search.shape
+    t = template - template.mean()
+    t_norm = math.sqrt((t * t).sum())
+    if t_norm < 1e-6:
+        return None
+    shape = (H + h - 1, W + w - 1)
+    correlation = np.fft.irfft2(np.fft.rfft2(search, shape) * np.fft.rfft2(t[::-1, ::-1], shape), shape)
+    correlation = correlation[h - 1:H, w - 1:W]
+
+    def window_sums(values):
+        integral = np.pad(values.cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+        return integral[h:, w:] - integral[:-h, w:] - integral[h:, :-w] + integral[:-h, :-w]
+
+    sums = window_sums(search)
+    variance = window_sums(search * search) - sums * sums / (h * w)
+    denominator = np.sqrt(np.maximum(variance, 0)) * t_norm
+    scores = np.zeros_like(correlation)
+    np.divide(correlation, denominator, out=scores, where=denominator > 1e-6 * t_norm)
+    return scores
+
+
+def track_region(previous, current, box, margin):
+    """Displacement (dx, dy) and score of a region of the previous frame in the current one
+
+    Only displacements up to `margin` pixels are searched. `previous` and
+    `current` are grayscale images of the same size.
+    """
+    width, height = previous.size
+    x0, y0 = max(int(box[0]), 0), max(int(box[1]), 0)
+    x1, y1 = min(int(math.ceil(box[2])), width), min(int(math.ceil(box[3])), height)
+    if x1 - x0 < 4 or y1 - y0 < 4:
+        return 0, 0, 0.0
+    factor = max(1, math.ceil(max(x1 - x0, y1 - y0) / MAX_TEMPLATE))
+    sx0, sy0 = max(x0 - margin, 0), max(y0 - margin, 0)
+    sx1, sy1 = min(x1 + margin, width), min(y1 + margin, height)
+    template = np.asarray(previous.crop((x0, y0, x1, y1)).resize(
+        ((x1 - x0) // factor, (y1 - y0) // factor), Image.BOX), dtype=float)
+    search = np.asarray(current.crop((sx0, sy0, sx1, sy1)).resize(
+        ((sx1 - sx0) // factor, (sy1 - sy0) // factor), Image.BOX), dtype=float)
+    if search.shape[0] < template.shape[0] or search.shape[1] < template.shape[1]:
+        return 0, 0, 0.0
+    scores = match_template(search, template)
+    if scores is None:
+        return 0, 0, 0.0
+    i, j = np.unravel_index(np.argmax(scores), scores.shape)
+    return int(sx0 + j * factor - x0), int(sy0 + i * factor - y0), float(scores[i, j])
+
+
+def propagate(previous_image, image, data, patch_radius=PATCH_RADIUS, search_radius=SEARCH_RADIUS,
+              min_score=MIN_SCORE):
+    """Keypoints and boxes of the previous frame, moved to where they are in `image`
+
+    `data` is the annotation file of the previous frame. Returns
+    {'keypoint': [(x, y, score)], 'bbox': [(x1, y1, x2, y2, score)]} in
+    pixels of `image`; annotations that couldn't be matched with at least
+    `min_score` keep their previous position.
+    """
+    # Float images of high bit depths keep their values, the correlation doesn't depend on the scale
+    current = image if image.mode == "F" else image.convert("L")
+    previous = previous_image if previous_image.mode == "F" else previous_image.convert("L")
+    if previous.size != current.size:
+        previous = previous.resize(current.size, Image.BILINEAR)
+    doc = AnnotationDocument.from_data(data, size=current.size, fmt="annotator")
+
+    results = {'keypoint': [], 'bbox': []}
+    for _, x, y in doc.annotations["keypoint"].values():
+        box = (x - patch_radius, y - patch_radius, x + patch_radius + 1, y + patch_radius + 1)
+        dx, dy, score = track_region(previous, current, box, search_radius)
+        if score < min_score:
+            dx = dy = 0
+        results['keypoint'].append((x + dx, y + dy, score))
+    for _, x1, y1, x2, y2 in doc.annotations["bbox"].values():
+        x1, x2 = sorted((x1, x2))
+        y1, y2 = sorted((y1, y2))
+        # Large boxes move further between frames
+        margin = max(search_radius, int(0.25 * max(x2 - x1, y2 - y1)))
+        dx, dy, score = track_region(previous, current, (x1, y1, x2, y2), margin)
+        if score < min_score:
+            dx = dy = 0
+        results['bbox'].append((x1 + dx, y1 + dy, x2 + dx, y2 + dy, score))
+    return results
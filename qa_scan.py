@@ -0,0 +1,220 @@
+import json
+import os
+
+import numpy as np
+
+import annotation_io
+from annotation_document import FIELDS, KINDS, AnnotationDocument, detect_format
+from jobs import run_chunks
+
+REPORT_NAME = "qa_report.json"
+KIND_INDEX = {kind: i for i, kind in enumerate(KINDS)}
+TOLERANCE = 1e-6  # Slack for normalized coordinates, rounding can land just outside [0, 1]
+MIN_CURVE_POINTS = 3
+
+
+def issue(kind, annotation_id, code, message):
+    return {'kind': kind, 'id': annotation_id, 'code': code, 'message': message}
+
+
+class GeometryBatch:
+    """Annotations of many files gathered into flat arrays, checked with NumPy in one go
+
+    Coordinates are normalized to the image size whatever layout the file
+    has, so one set of range checks covers both annotators. Only the
+    flagged rows are turned back into per-file issues.
+    """
+
+    def __init__(self):
+        self.issues = {}  # file index -> issues
+        self.ids = []  # (file, kind, id)
+        self.next_ids = []  # (file, kind, next id)
+        self.keypoints = []  # (file, id, x, y)
+        self.boxes = []  # (file, id, x1, y1, x2, y2)
+        self.curves = []  # (file, kind, id, point count)
+        self.curve_points = []  # (x, y) of all curves, one after the other
+        self.sizes = []  # (file, saved width, saved height, image width, image height)
+
+    def report(self, file, kind, annotation_id, code, message):
+        self.issues.setdefault(file, []).append(issue(kind, annotation_id, code, message))
+
+    def add(self, file, data, image_size=None):
+        """Gather the annotations of one parsed annotation file"""
+        if not isinstance(data, dict):
+            self.report(file, None, None, "malformed", "Annotation file is not a JSON object")
+            return
+        saved_size = (data.get('image_width'), data.get('image_height'))
+        has_size = all(isinstance(v, (int, float)) and v > 0 for v in saved_size)
+        if has_size and image_size is not None:
+            self.sizes.append((file,) + saved_size + tuple(image_size))
+
+        fmt = detect_format(data)
+        doc = AnnotationDocument()  # The (1, 1) frame keeps normalized coordinates
+        pixel_size = saved_size if has_size else image_size
+        for kind in KINDS:
+            entries = data.get(FIELDS[kind]) or []
+            if not isinstance(entries, list):
+                self.report(file, kind, None, "malformed", f"'{FIELDS[kind]}' is not a list")
+                continue
+            for entry in entries:
+                try:
+                    annotation = doc.parse(kind, entry, fmt, pixel_size)
+                except (KeyError, TypeError, ValueError, ZeroDivisionError) as e:
+                    annotation_id = entry.get('id') if isinstance(entry, dict) else None
+                    self.report(file, kind, annotation_id, "malformed", f"Unreadable entry: {e!r}")
+                    continue
+                annotation_id = annotation[0]
+                if not isinstance(annotation_id, int) or isinstance(annotation_id, bool):
+                    self.report(file, kind, annotation_id, "malformed", f"Id {annotation_id!r} is not an integer")
+                    continue
+                self.ids.append((file, KIND_INDEX[kind], annotation_id))
+                if kind == "keypoint":
+                    self.keypoints.append((file, annotation_id) + tuple(annotation[1:3]))
+                elif kind == "bbox":
+                    self.boxes.append((file, annotation_id) + tuple(annotation[1:5]))
+                else:
+                    points = annotation[1]
+                    self.curves.append((file, KIND_INDEX[kind], annotation_id, len(points)))
+                    self.curve_points.extend(points)
+
+        next_ids = data.get('next_ids') or {}
+        if isinstance(next_ids, dict):
+            for kind, next_id in next_ids.items():
+                if kind in KIND_INDEX and isinstance(next_id, int):
+                    self.next_ids.append((file, KIND_INDEX[kind], next_id))
+
+    def check(self, num_files):
+        """Run all geometry checks, returns file index -> issues"""
+        self._check_points(np.array(self.keypoints, dtype=float).reshape(-1, 4), "keypoint")
+        self._check_boxes(np.array(self.boxes, dtype=float).reshape(-1, 6))
+        self._check_curves(np.array(self.curves, dtype=np.int64).reshape(-1, 4),
+                           np.array(self.curve_points, dtype=float).reshape(-1, 2))
+        self._check_ids(np.array(self.ids, dtype=np.int64).reshape(-1, 3),
+                        np.array(self.next_ids, dtype=np.int64).reshape(-1, 3), num_files)
+        self._check_sizes(np.array(self.sizes, dtype=float).reshape(-1, 5))
+        return self.issues
+
+    def _flag(self, rows, mask, kind, code, message):
+        for row in rows[mask]:
+            self.report(int(row[0]), kind, int(row[1]), code, message(row))
+
+    def _check_points(self, rows, kind):
+        xy = rows[:, 2:]
+        finite = np.isfinite(xy).all(axis=1)
+        outside = ((xy < -TOLERANCE) | (xy > 1 + TOLERANCE)).any(axis=1) & finite
+        self._flag(rows, ~finite, kind, "non_finite", lambda row: "Coordinates are NaN or infinite")
+        self._flag(rows, outside, kind, "out_of_range",
+                   lambda row: f"Point ({row[2]:.4f}, {row[3]:.4f}) is outside the image")
+
+    def _check_boxes(self, rows):
+        corners = rows[:, 2:]
+        finite = np.isfinite(corners).all(axis=1)
+        width = corners[:, 2] - corners[:, 0]
+        height = corners[:, 3] - corners[:, 1]
+        outside = ((corners < -TOLERANCE) | (corners > 1 + TOLERANCE)).any(axis=1) & finite
+        self._flag(rows, ~finite, "bbox", "non_finite", lambda row: "Coordinates are NaN or infinite")
+        self._flag(rows, finite & ((width < 0) | (height < 0)), "bbox", "inverted_bbox",
+                   lambda row: "Second corner is left of or above the first")
+        self._flag(rows, finite & ((np.abs(width) <= TOLERANCE) | (np.abs(height) <= TOLERANCE)),
+                   "bbox", "zero_area_bbox", lambda row: "Box has no area")
+        self._flag(rows, outside, "bbox", "out_of_range",
+                   lambda row: f"Box ({row[2]:.4f}, {row[3]:.4f}, {row[4]:.4f}, {row[5]:.4f}) "
+                               f"is outside the image")
+
+    def _check_curves(self, curves, points):
+        counts = curves[:, 3]
+        # Per-point flags reduced to their curve through the owner of every point
+        owner = np.repeat(np.arange(len(curves)), counts)
+        finite = np.isfinite(points).all(axis=1)
+        outside = ((points < -TOLERANCE) | (points > 1 + TOLERANCE)).any(axis=1) & finite
+        not_finite = np.bincount(owner[~finite], minlength=len(curves)) > 0
+        out_count = np.bincount(owner[outside], minlength=len(curves))
+        for mask, code, message in (
+                (counts < MIN_CURVE_POINTS, "too_few_points", lambda i: f"Only {counts[i]} points"),
+                (not_finite, "non_finite", lambda i: "Coordinates are NaN or infinite"),
+                (out_count > 0, "out_of_range", lambda i: f"{out_count[i]} of {counts[i]} points are outside the image")):
+            for i in np.flatnonzero(mask):
+                file, kind, annotation_id, _ = curves[i]
+                self.report(int(file), KINDS[kind], int(annotation_id), code, message(i))
+
+    def _check_ids(self, ids, next_ids, num_files):
+        if len(ids):
+            rows, counts = np.unique(ids, axis=0, return_counts=True)
+            for file, kind, annotation_id in rows[counts > 1]:
+                self.report(int(file), KINDS[kind], int(annotation_id), "duplicate_id",
+                            "Id is used more than once")
+        # next_ids must be past every id, or new annotations reuse a taken one
+        keys = ids[:, 0] * len(KINDS) + ids[:, 1]
+        highest = np.zeros(num_files * len(KINDS), dtype=np.int64)
+        np.maximum.at(highest, keys, ids[:, 2])
+        taken = highest[next_ids[:, 0] * len(KINDS) + next_ids[:, 1]]
+        stale = next_ids[:, 2] <= taken
+        for (file, kind, next_id), highest_id in zip(next_ids[stale], taken[stale]):
+            self.report(int(file), KINDS[kind], None, "stale_next_id",
+                        f"next_ids is {next_id} but id {highest_id} is taken, new annotations would collide")
+
+    def _check_sizes(self, rows):
+        mismatch = (rows[:, 1] != rows[:, 3]) | (rows[:, 2] != rows[:, 4])
+        for file, width, height, image_width, image_height in rows[mismatch]:
+            self.report(int(file), None, None, "size_mismatch",
+                        f"Saved size {width:.0f}x{height:.0f}, image is {image_width:.0f}x{image_height:.0f}")
+
+
+def scan_chunk(dataset_path, images):
+    """Check the annotation files of some images, runs in a worker process
+
+    Returns the number of annotated images and (image path, issues) of
+    those with issues.
+    """
+    batch = GeometryBatch()
+    annotated = 0
+    for file, img_path in enumerate(images):
+        path = annotation_io.annotation_path(dataset_path, img_path)
+        if not os.path.exists(path):
+            continue
+        annotated += 1
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            batch.report(file, None, None, "unreadable", f"Can't read annotation file: {e}")
+            continue
+        try:
+            # Only the header is read for the size
+            image_size = annotation_io.image_size(img_path)
+        except OSError as e:
+            batch.report(file, None, None, "unreadable", f"Can't read image: {e}")
+            image_size = None
+        batch.add(file, data, image_size)
+    issues = batch.check(len(images))
+    return annotated, [(images[file], issues[file]) for file in sorted(issues)]
+
+
+def qa_scan_job(job, dataset_path, images, workers=None, chunk_size=500):
+    """Check every annotation file of the dataset across a process pool
+
+    The report lists the images with issues in dataset order and is also
+    written to annotations/qa_report.json.
+    """
+    found = {}
+    annotated = 0
+    chunks = [(dataset_path, images[start:start + chunk_size]) for start in range(0, len(images), chunk_size)]
+
+    def scanned(index, result):
+        nonlocal annotated
+        chunk_annotated, chunk_issues = result
+        annotated += chunk_annotated
+        found.update(chunk_issues)
+        job.step(len(chunks[index][1]))
+
+    run_chunks(job, scan_chunk, chunks, scanned, workers)
+
+    entries = [{'image': os.path.basename(img_path), 'path': img_path, 'issues': found[img_path]}
+               for img_path in images if img_path in found]
+    counts = {}
+    for entry in entries:
+        for item in entry['issues']:
+            counts[item['code']] = counts.get(item['code'], 0) + 1
+    report = {'images': len(images), 'annotated': annotated, 'counts': counts, 'entries': entries}
+    annotation_io.write_annotation_file(os.path.join(dataset_path, "annotations", REPORT_NAME), report)
+    return report
@@ -0,0 +1,118 @@
+import functools
+
+import numpy as np
+from PIL import Image, ImageFont, ImageTk
+
+
+@functools.lru_cache(maxsize=None)
+def label_font():
+    """Bitmap font for overlay labels, much faster to render than the FreeType default"""
+    try:
+        return ImageFont.load_default_imagefont()
+    except AttributeError:  # Pillow < 10.1 only has the bitmap font
+        return ImageFont.load_default()
+
+
+def _disk_offsets(radius):
+    """Pixel offsets covered by a filled disk"""
+    r = int(radius)
+    dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+    inside = dx * dx + dy * dy <= radius * radius
+    return dx[inside], dy[inside]
+
+
+def stamp_points(image, points, radius=5, fill=(255, 0, 0), outline=(0, 0, 0)):
+    """Draw many filled circles at once with NumPy, returns the new image"""
+    if not len(points):
+        return image
+    arr = np.array(image)
+    height, width = arr.shape[:2]
+    pts = np.asarray(points, dtype=int).reshape(-1, 2)
+
+    for r, color in ((radius, outline), (radius - 1, fill)):
+        dx, dy = _disk_offsets(r)
+        xs = (pts[:, 0:1] + dx).ravel()
+        ys = (pts[:, 1:2] + dy).ravel()
+        keep = (xs >= 0) & (xs < width) & (ys >= 0) & (ys < height)
+        arr[ys[keep], xs[keep]] = color
+    return Image.fromarray(arr)
+
+
+class TiledOverlay:
+    """Display image with committed annotations composited into it
+
+    The image is split into tiles, each shown through its own PhotoImage.
+    Invalidating a region only re-renders and re-uploads the tiles it
+    touches, so the cost of a change depends on its area and not on how
+    many annotations the image has. `render_fn(image, box)` draws the
+    annotations intersecting `box` (display coordinates) into the tile
+    image, whose top-left corner is at (box[0], box[1]).
+    """
+
+    def __init__(self, canvas, base_image, render_fn, tile_size=256):
+        self.canvas = canvas
+        self.base_image = base_image.convert("RGB")
+        self.render_fn = render_fn
+        self.tile_size = tile_size
+        self.tiles = {}
+        self.dirty = set()
+        self._flush_pending = False
+
+        width, height = self.base_image.size
+        for tx in range(0, (width + tile_size - 1) // tile_size):
+            for ty in range(0, (height + tile_size - 1) // tile_size):
+                box = self.tile_box(tx, ty)
+                photo = ImageTk.PhotoImage(self.base_image.crop(box))
+                item = canvas.create_image(box[0], box[1], anchor="nw", image=photo, tags="overlay_tile")
+                canvas.tag_lower(item)
+                self.tiles[(tx, ty)] = (photo, item)
+                self.dirty.add((tx, ty))
+
+    def tile_box(self, tx, ty):
+        """Display region covered by a tile"""
+        width, height = self.base_image.size
+        size = self.tile_size
+        return (tx * size, ty * size, min((tx + 1) * size, width), min((ty + 1) * size, height))
+
+    def invalidate(self, x1, y1, x2, y2):
+        """Mark the tiles touching a display region for re-rendering"""
+        size = self.tile_size
+        tx1, ty1 = max(int(x1) // size, 0), max(int(y1) // size, 0)
+        tx2, ty2 = int(x2) // size, int(y2) // size
+        for tx in range(tx1, tx2 + 1):
+            for ty in range(ty1, ty2 + 1):
+                if (tx, ty) in self.tiles:
+                    self.dirty.add((tx, ty))
+        self.schedule_flush()
+
+    def set_base_image(self, base_image):
+        """Swap in another rendition of the same image, e.g. with a new contrast"""
+        self.base_image = base_image.convert("RGB")
+        self.invalidate_all()
+
+    def invalidate_all(self):
+        """Mark every tile for re-rendering"""
+        self.dirty.update(self.tiles)
+        self.schedule_flush()
+
+    def schedule_flush(self):
+        """Coalesce invalidations into one render when Tk is idle"""
+        if not self._flush_pending and self.dirty:
+            self._flush_pending = True
+            self.canvas.after_idle(self.flush)
+
+    def flush(self):
+        """Re-render all dirty tiles"""
+        self._flush_pending = False
+        dirty, self.dirty = self.dirty, set()
+        for tile in dirty:
+            box = self.tile_box(*tile)
+            image = self.base_image.crop(box)
+            image = self.render_fn(image, box) or image
+            self.tiles[tile][0].paste(image)
+
+    def destroy(self):
+        """Remove the tile items from the canvas"""
+        self.canvas.delete("overlay_tile")
+        self.tiles = {}
+        self.dirty = set()
@@ -0,0 +1,42 @@
+import json
+import os
+
+SESSION_VERSION = 1
+
+
+def default_session_path():
+    """Per-user session file, in the platform's config directory"""
+    if os.name == "nt":
+        base = os.environ.get("APPDATA") or os.path.expanduser("~")
+    else:
+        base = os.environ.get("XDG_CONFIG_HOME") or os.path.join(os.path.expanduser("~"), ".config")
+    return os.path.join(base, "coco_annotator", "session.json")
+
+
+def read_session(path):
+    """Saved session, or None if there is none or it can't be used"""
+    try:
+        with open(path, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(state, dict) or state.get('version') != SESSION_VERSION:
+        return None
+    return state
+
+
+def write_session(path, state):
+    """Write the session atomically, so a crash while saving keeps the previous one"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(dict(state, version=SESSION_VERSION), f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def neighbours(images, index, before=2, after=8):
+    """Images around `index` in the order they are likely needed: the image itself, then ahead, then behind"""
+    ahead = images[index:index + after + 1]
+    behind = images[max(index - before, 0):index][::-1]
+    return ahead + behind
@@ -0,0 +1,194 @@
+import functools
+import time
+
+import numpy as np
+
+# Smoothing methods selectable in the UI. "auto" uses scipy when it is
+# installed and the pure NumPy Catmull-Rom spline otherwise, both pass
+# through every point; "uniform" and "chaikin" only approximate them.
+METHODS = ("auto", "scipy", "catmull_rom", "uniform", "chaikin")
+
+# Older annotation files name the scipy-or-fallback behaviour "bspline"
+METHOD_ALIASES = {"bspline": "auto"}
+
+# Basis matrices of the uniform B-spline of each degree, rows are powers of t
+_BSPLINE_BASIS = {
+    1: np.array([[1.0, 0.0],
+                 [-1.0, 1.0]]),
+    2: np.array([[1.0, 1.0, 0.0],
+                 [-2.0, 2.0, 0.0],
+                 [1.0, -2.0, 1.0]]) / 2.0,
+    3: np.array([[1.0, 4.0, 1.0, 0.0],
+                 [-3.0, 0.0, 3.0, 0.0],
+                 [3.0, -6.0, 3.0, 0.0],
+                 [-1.0, 3.0, -3.0, 1.0]]) / 6.0,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _scipy_interpolate():
+    """Import scipy.interpolate once, returns None if scipy is not installed"""
+    try:
+        import scipy.interpolate as interpolate
+    except ImportError:
+        return None
+    return interpolate
+
+
+def scipy_available():
+    """Check whether the scipy smoothing path can be used"""
+    return _scipy_interpolate() is not None
+
+
+def resolve_method(method):
+    """Map a method name (or alias) to the implementation that will run"""
+    method = METHOD_ALIASES.get(method, method or "auto")
+    if method not in METHODS:
+        raise ValueError(f"Unknown smoothing method: {method}")
+    if method == "auto" or (method == "scipy" and not scipy_available()):
+        return "scipy" if scipy_available() else "catmull_rom"
+    return method
+
+
+def _as_array(points):
+    """Convert points to a float array without consecutive duplicates"""
+    arr = np.asarray(points, dtype=float).reshape(-1, 2)
+    if len(arr) > 1:
+        keep = np.ones(len(arr), dtype=bool)
+        keep[1:] = np.any(np.diff(arr, axis=0) != 0, axis=1)
+        arr = arr[keep]
+    return arr
+
+
+def chaikin(points, iterations=3, closed=False):
+    """Chaikin corner cutting, every iteration is a single vectorized step"""
+    arr = _as_array(points)
+    if len(arr) < 3:
+        return arr
+
+    for _ in range(iterations):
+        p0 = np.roll(arr, 1, axis=0) if closed else arr[:-1]
+        p1 = arr if closed else arr[1:]
+        q = 0.75 * p0 + 0.25 * p1
+        r = 0.25 * p0 + 0.75 * p1
+        cut = np.empty((2 * len(q), 2))
+        cut[0::2] = q
+        cut[1::2] = r
+        if closed:
+            arr = cut
+        else:
+            # Open curves keep their end points
+            arr = np.vstack([arr[:1], cut, arr[-1:]])
+    return arr
+
+
+def uniform_bspline(points, degree=3, num_points=None):
+    """Evaluate a clamped uniform B-spline with the points as control polygon"""
+    arr = _as_array(points)
+    degree = int(max(1, min(3, degree, len(arr) - 1)))
+    if len(arr) <= degree:
+        return arr
+    if num_points is None:
+        num_points = max(len(arr) * 2, 50)
+
+    # Repeating the end points makes the curve start and end on them
+    ctrl = np.vstack([np.repeat(arr[:1], degree - 1, axis=0), arr,
+                      np.repeat(arr[-1:], degree - 1, axis=0)])
+    spans = len(ctrl) - degree
+
+    u = np.linspace(0.0, spans, num_points)
+    span = np.minimum(u.astype(int), spans - 1)
+    t = u - span
+
+    powers = t[:, None] ** np.arange(degree + 1)
+    weights = powers @ _BSPLINE_BASIS[degree]
+    gathered = ctrl[span[:, None] + np.arange(degree + 1)]
+    return np.einsum("mk,mkd->md", weights, gathered)
+
+
+def catmull_rom(points, num_points=None, alpha=0.5):
+    """Centripetal Catmull-Rom spline through the points, all spans evaluated at once
+
+    The curve passes through every point, so it stays as close to a
+    stroke as its simplified points do. Centripetal parameterization keeps
+    unevenly spaced points from overshooting or looping.
+    """
+    arr = _as_array(points)
+    if len(arr) < 3:
+        return arr
+    if num_points is None:
+        num_points = max(len(arr) * 2, 50)
+
+    # Mirrored end points give the first and last span a tangent without zero-length knot intervals
+    ctrl = np.vstack([2 * arr[:1] - arr[1:2], arr, 2 * arr[-1:] - arr[-2:-1]])
+    spans = len(arr) - 1
+    per_span = max(2, -(-num_points // spans))
+    knots = np.concatenate([[0.0], np.cumsum(np.linalg.norm(np.diff(ctrl, axis=0), axis=1) ** alpha)])
+
+    # Barry-Goldman pyramid, one row per span and one column per sample
+    k = np.stack([knots[i:i + spans] for i in range(4)])[:, :, None]
+    p = np.stack([ctrl[i:i + spans] for i in range(4)])[:, :, None, :]
+    u = np.linspace(0.0, 1.0, per_span, endpoint=False)
+    t = (k[1] + (k[2] - k[1]) * u)[..., None]
+
+    def lerp(i, j, a, b):
+        ki, kj = k[i][..., None], k[j][..., None]
+        return ((kj - t) * a + (t - ki) * b) / (kj - ki)
+
+    a1, a2, a3 = lerp(0, 1, p[0], p[1]), lerp(1, 2, p[1], p[2]), lerp(2, 3, p[2], p[3])
+    b1, b2 = lerp(0, 2, a1, a2), lerp(1, 3, a2, a3)
+    curve = lerp(1, 2, b1, b2).reshape(-1, 2)
+    return np.vstack([curve, arr[-1:]])
+
+
+def scipy_bspline(points, degree=3, num_points=None):
+    """Interpolating B-spline through the points, requires scipy"""
+    interpolate = _scipy_interpolate()
+    if interpolate is None:
+        raise ImportError("scipy is not installed")
+
+    arr = _as_array(points)
+    degree = int(max(1, min(5, degree, len(arr) - 1)))
+    if len(arr) <= degree:
+        return arr
+    if num_points is None:
+        num_points = max(len(arr) * 2, 50)
+
+    tck, _ = interpolate.splprep([arr[:, 0], arr[:, 1]], s=0, k=degree)
+    x_new, y_new = interpolate.splev(np.linspace(0, 1, num_points), tck)
+    return np.column_stack([x_new, y_new])
+
+
+def smooth_points(points, method="auto", degree=3, iterations=3, num_points=None):
+    """Smooth a polyline with the chosen method, returns integer point tuples"""
+    method = resolve_method(method)
+    if method == "chaikin":
+        result = chaikin(points, iterations)
+    elif method == "catmull_rom":
+        result = catmull_rom(points, num_points)
+    elif method == "scipy":
+        result = scipy_bspline(points, degree, num_points)
+    else:
+        result = uniform_bspline(points, degree, num_points)
+    return [(int(round(x)), int(round(y))) for x, y in np.asarray(result)]
+
+
+def benchmark_methods(points, degree=3, num_points=None, repeat=50):
+    """Time every available method on the same points, in seconds per call"""
+    timings = {}
+    for method in METHODS[1:]:
+        if method == "scipy" and not scipy_available():
+            continue
+        start = time.perf_counter()
+        for _ in range(repeat):
+            smooth_points(points, method, degree, num_points=num_points)
+        timings[method] = (time.perf_counter() - start) / repeat
+    return timings
+
+
+if __name__ == "__main__":
+    # Quick comparison on a synthetic wavy stroke
+    t = np.linspace(0, 2 * np.pi, 200)
+    stroke = np.column_stack([300 + 200 * np.cos(t), 300 + 150 * np.sin(t) + 5 * np.sin(9 * t)])
+    for name, seconds in benchmark_methods(stroke).items():
+        print(f"{name:8s} {seconds * 1e3:8.3f} ms")
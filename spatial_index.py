@@ -0,0 +1,188 @@
+import math
+from collections import defaultdict
+
+from stroke_simplify import point_segment_distance
+
+
+def _shape_bounds(shape):
+    """Bounding box of a point, rect or segment shape"""
+    kind = shape[0]
+    if kind == "point":
+        _, x, y = shape
+        return x, y, x, y
+    _, x1, y1, x2, y2 = shape
+    return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+
+
+def _shape_distance(shape, x, y, radius):
+    """Distance from (x, y) to a shape as used for picking"""
+    kind = shape[0]
+    if kind == "point":
+        return math.hypot(x - shape[1], y - shape[2])
+    if kind == "segment":
+        return point_segment_distance((x, y), (shape[1], shape[2]), (shape[3], shape[4]))
+
+    # Rects are picked on their outline, a click inside still counts as a hit
+    # but anything else within the radius is preferred
+    _, x1, y1, x2, y2 = shape
+    inside = x1 <= x <= x2 and y1 <= y <= y2
+    if inside:
+        return min(x - x1, x2 - x, y - y1, y2 - y, radius)
+    dx = max(x1 - x, 0, x - x2)
+    dy = max(y1 - y, 0, y - y2)
+    return math.hypot(dx, dy)
+
+
+class SpatialIndex:
+    """Uniform grid over annotation shapes in image coordinates
+
+    Every annotation is stored under a key such as ("keypoint", 3) with one or
+    more shapes: points, rects and segments. Each shape is registered in every
+    grid cell its bounds touch, so picking and rectangle queries only look at
+    the shapes in the few cells around the query, not at whole outlines.
+    Shapes spanning more than `max_cells` cells (e.g. a bbox covering the
+    whole image) are kept in a short list that is always checked instead of
+    being spread over hundreds of cells.
+    """
+
+    def __init__(self, cell_size=32, max_cells=64):
+        self.cell_size = cell_size
+        self.max_cells = max_cells
+        self._cells = defaultdict(set)
+        self._large = set()
+        self._shapes = {}
+        self._key_cells = {}
+
+    def __len__(self):
+        return len(self._shapes)
+
+    def __contains__(self, key):
+        return key in self._shapes
+
+    def clear(self):
+        """Remove all annotations from the index"""
+        self._cells.clear()
+        self._large.clear()
+        self._shapes.clear()
+        self._key_cells.clear()
+
+    def _cell_range(self, x1, y1, x2, y2):
+        """Cell coordinates covered by a bounding box"""
+        size = self.cell_size
+        return (int(math.floor(x1 / size)), int(math.floor(y1 / size)),
+                int(math.floor(x2 / size)), int(math.floor(y2 / size)))
+
+    def insert(self, key, shapes):
+        """Add or replace the shapes of an annotation"""
+        if key in self._shapes:
+            self.remove(key)
+
+        shapes = list(shapes)
+        cells = set()
+        for i, shape in enumerate(shapes):
+            entry = (key, i)
+            cx1, cy1, cx2, cy2 = self._cell_range(*_shape_bounds(shape))
+            if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > self.max_cells:
+                self._large.add(entry)
+                continue
+            for cx in range(cx1, cx2 + 1):
+                for cy in range(cy1, cy2 + 1):
+                    self._cells[(cx, cy)].add(entry)
+                    cells.add((cx, cy))
+
+        self._shapes[key] = shapes
+        self._key_cells[key] = cells
+
+    def insert_point(self, key, x, y):
+        """Index a single point annotation"""
+        self.insert(key, [("point", x, y)])
+
+    def insert_rect(self, key, x1, y1, x2, y2):
+        """Index a rectangle annotation"""
+        self.insert(key, [("rect", min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))])
+
+    def insert_polyline(self, key, points, closed=False):
+        """Index a polyline annotation as one shape per segment"""
+        if len(points) == 1:
+            self.insert_point(key, *points[0])
+            return
+        pairs = list(zip(points[:-1], points[1:]))
+        if closed and len(points) > 2:
+            pairs.append((points[-1], points[0]))
+        self.insert(key, [("segment", a[0], a[1], b[0], b[1]) for a, b in pairs])
+
+    def remove(self, key):
+        """Remove an annotation, unknown keys are ignored"""
+        if key not in self._shapes:
+            return
+        entries = [(key, i) for i in range(len(self._shapes.pop(key)))]
+        for cell in self._key_cells.pop(key):
+            members = self._cells[cell]
+            members.difference_update(entries)
+            if not members:
+                del self._cells[cell]
+        self._large.difference_update(entries)
+
+    def move(self, key, dx, dy):
+        """Translate all shapes of an annotation"""
+        moved = []
+        for shape in self._shapes.get(key, []):
+            if shape[0] == "point":
+                moved.append(("point", shape[1] + dx, shape[2] + dy))
+            else:
+                moved.append((shape[0], shape[1] + dx, shape[2] + dy, shape[3] + dx, shape[4] + dy))
+        if moved:
+            self.insert(key, moved)
+
+    def bounds(self, key):
+        """Bounding box of an annotation, or None if it is not indexed"""
+        shapes = self._shapes.get(key)
+        if not shapes:
+            return None
+        boxes = [_shape_bounds(shape) for shape in shapes]
+        return (min(b[0] for b in boxes), min(b[1] for b in boxes),
+                max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+    def _candidates(self, x1, y1, x2, y2):
+        """(key, shape index) entries registered in the cells covering a bounding box"""
+        cx1, cy1, cx2, cy2 = self._cell_range(x1, y1, x2, y2)
+        found = set(self._large)
+        if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > len(self._cells):
+            # Query is bigger than the populated grid, walk the cells instead
+            for (cx, cy), members in self._cells.items():
+                if cx1 <= cx <= cx2 and cy1 <= cy <= cy2:
+                    found.update(members)
+            return found
+        for cx in range(cx1, cx2 + 1):
+            for cy in range(cy1, cy2 + 1):
+                members = self._cells.get((cx, cy))
+                if members:
+                    found.update(members)
+        return found
+
+    def nearest(self, x, y, radius):
+        """Find the annotation closest to (x, y) within radius
+
+        Returns (key, distance), or (None, None) if nothing is in range.
+        """
+        best_key, best_dist = None, None
+        for key, i in self._candidates(x - radius, y - radius, x + radius, y + radius):
+            dist = _shape_distance(self._shapes[key][i], x, y, radius)
+            if dist <= radius and (best_dist is None or dist < best_dist):
+                best_key, best_dist = key, dist
+        return best_key, best_dist
+
+    def query_rect(self, x1, y1, x2, y2):
+        """Find all annotations with a shape intersecting the rectangle"""
+        x1, x2 = min(x1, x2), max(x1, x2)
+        y1, y2 = min(y1, y2), max(y1, y2)
+        hits = []
+        seen = set()
+        for key, i in self._candidates(x1, y1, x2, y2):
+            if key in seen:
+                continue
+            sx1, sy1, sx2, sy2 = _shape_bounds(self._shapes[key][i])
+            if sx1 <= x2 and sx2 >= x1 and sy1 <= y2 and sy2 >= y1:
+                hits.append(key)
+                seen.add(key)
+        return hits
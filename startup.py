@@ -0,0 +1,49 @@
+import importlib
+import time
+
+# Import this first, everything before it doesn't count towards startup times
+PROCESS_START = time.perf_counter()
+
+
+class _DeferredModule:
+    """Stand-in for a module, imported on first attribute access"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        module = self._module
+        if module is None:
+            # A regular import, its module locks make first use from several threads safe
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attribute)
+
+    def __repr__(self):
+        return f"<deferred module {self._name!r}>"
+
+
+def lazy_import(name):
+    """Module that is only imported on first attribute access
+
+    Keeps heavy modules like NumPy off the path to the first image. Unlike
+    importlib's LazyLoader nothing half-loaded ever goes into sys.modules,
+    so other threads importing the module meanwhile get the real one.
+    """
+    return _DeferredModule(name)
+
+
+def warm_imports(root, names):
+    """Import modules on the Tk thread, one per idle callback so input is handled in between"""
+    names = list(names)
+
+    def step():
+        if names:
+            importlib.import_module(names.pop(0))
+            root.after_idle(step)
+
+    root.after_idle(step)
+
+
+def elapsed_ms(since=PROCESS_START):
+    return (time.perf_counter() - since) * 1e3
@@ -0,0 +1,67 @@
+import math
+
+
+def point_segment_distance(p, a, b):
+    """Distance from point p to the segment a-b"""
+    ax, ay = a
+    bx, by = b
+    dx, dy = bx - ax, by - ay
+    length_sq = dx * dx + dy * dy
+    if length_sq == 0:
+        return math.hypot(p[0] - ax, p[1] - ay)
+
+    # Project p onto the segment and clamp to its end points
+    t = ((p[0] - ax) * dx + (p[1] - ay) * dy) / length_sq
+    t = max(0.0, min(1.0, t))
+    return math.hypot(p[0] - (ax + t * dx), p[1] - (ay + t * dy))
+
+
+class StreamSimplifier:
+    """Online polyline simplifier that runs while a stroke is being drawn
+
+    Every incoming point is checked against the segment from the last kept
+    vertex to that point. As soon as one of the points in between deviates
+    by more than `tolerance`, the previous point is kept as a vertex and a
+    new run starts from it. This keeps the same error bound as
+    Ramer-Douglas-Peucker but never looks back further than the current run.
+    """
+
+    def __init__(self, tolerance=1.0, max_run=256):
+        self.tolerance = tolerance
+        self.max_run = max_run  # Bounds the per-point cost on very long runs
+        self.points = []
+        self._run = []
+
+    def add(self, x, y):
+        """Feed a new sample, returns True if a vertex was committed"""
+        point = (x, y)
+        if not self.points:
+            self.points.append(point)
+            return True
+
+        if point == (self._run[-1] if self._run else self.points[-1]):
+            return False
+
+        anchor = self.points[-1]
+        for p in self._run:
+            if point_segment_distance(p, anchor, point) > self.tolerance:
+                self._commit()
+                self._run.append(point)
+                return True
+
+        self._run.append(point)
+        if len(self._run) >= self.max_run:
+            self._commit()
+            return True
+        return False
+
+    def _commit(self):
+        """Keep the last point of the current run as a vertex"""
+        self.points.append(self._run[-1])
+        self._run = []
+
+    def finish(self):
+        """Close the stroke and return the simplified vertices"""
+        if self._run:
+            self._commit()
+        return list(self.points)
@@ -0,0 +1,162 @@
+import functools
+import queue
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Task:
+    """Handle of a submitted task
+
+    Long running functions can poll `cancelled` to stop early; results of
+    cancelled tasks are dropped instead of being delivered.
+    """
+
+    def __init__(self, key=None):
+        self.key = key
+        self.future = None
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Cancel the task, a task that has not started yet never runs"""
+        self._cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+
+class TaskRuntime:
+    """Run blocking work on worker threads and deliver results on the Tk thread
+
+    Functions run in a lane: the default lane is a small pool, every other
+    lane is a single worker that runs its tasks in submission order (e.g.
+    "io" so an annotation file is never read while it is still being
+    written). Callbacks and `post`ed calls are queued and executed by the Tk
+    main loop through `root.after`, so they are free to touch widgets while
+    the workers never do.
+
+    Submitting with a `key` cancels the previous task with the same key, so
+    only the result of the latest request (e.g. the image the user navigated
+    to last) is ever delivered.
+    """
+
+    def __init__(self, root, max_workers=4, poll_ms=15):
+        self.root = root
+        self.poll_ms = poll_ms
+        self.max_workers = max_workers
+        self.lanes = {}
+        self.latest = {}  # key -> most recent task submitted with it
+        self.results = queue.Queue()
+        self.active = 0
+        self._polling = False
+
+    def add_lane(self, name, workers):
+        """Create a lane with its own number of workers"""
+        if name not in self.lanes:
+            self.lanes[name] = ThreadPoolExecutor(workers, thread_name_prefix=f"task-{name}")
+
+    def _lane(self, name):
+        """Executor of a lane, created on first use"""
+        if name not in self.lanes:
+            self.add_lane(name, self.max_workers if name == "default" else 1)
+        return self.lanes[name]
+
+    def submit(self, fn, *args, on_done=None, on_error=None, key=None, lane="default", pass_task=False):
+        """Run fn(*args) in a worker, then on_done(result) or on_error(exc) on the Tk thread
+
+        With `pass_task` the Task handle is passed as first argument so the
+        function can check for cancellation and `post` progress.
+        """
+        task = Task(key)
+        if key is not None:
+            previous = self.latest.get(key)
+            if previous is not None:
+                previous.cancel()
+            self.latest[key] = task
+
+        if pass_task:
+            args = (task,) + args
+        self.active += 1
+        task.future = self._lane(lane).submit(self._run, task, fn, args, on_done, on_error)
+        task.future.add_done_callback(lambda future: future.cancelled() and self.results.put((task, None)))
+        self._schedule()
+        return task
+
+    def cancel(self, key):
+        """Cancel the latest task submitted with a key"""
+        task = self.latest.pop(key, None)
+        if task is not None:
+            task.cancel()
+
+    def post(self, fn, *args):
+        """Call fn(*args) on the Tk thread, safe to use from workers"""
+        self.results.put((None, functools.partial(fn, *args)))
+
+    def _run(self, task, fn, args, on_done, on_error):
+        """Worker side: run the function and queue its callback"""
+        if task.cancelled:
+            self.results.put((task, None))
+            return
+        try:
+            result = fn(*args)
+        except Exception as e:
+            callback = functools.partial(on_error or self.report, e)
+        else:
+            callback = functools.partial(on_done, result) if on_done else None
+        self.results.put((task, callback))
+
+    def report(self, error):
+        """Default error handler for tasks without on_error"""
+        traceback.print_exception(type(error), error, error.__traceback__)
+
+    def _schedule(self):
+        """Keep draining the result queue while work is outstanding"""
+        if not self._polling:
+            self._polling = True
+            self.root.after(self.poll_ms, self._drain)
+
+    def _drain(self):
+        """Tk side: deliver finished results and posted calls
+
+        A callback that raises is reported like any Tk callback error and
+        doesn't hold back the ones queued after it.
+        """
+        self._polling = False
+        try:
+            while True:
+                try:
+                    task, callback = self.results.get_nowait()
+                except queue.Empty:
+                    break
+                if task is not None:
+                    self.active -= 1
+                    if self.latest.get(task.key) is task:
+                        del self.latest[task.key]
+                    if task.cancelled:
+                        continue
+                if callback is not None:
+                    try:
+                        callback()
+                    except Exception:
+                        self.root.report_callback_exception(*sys.exc_info())
+        finally:
+            if self.active > 0 or not self.results.empty():
+                self._schedule()
+
+    def shutdown(self):
+        """Stop the workers once the work already submitted is done, without waiting for it
+
+        Keyed tasks only fetch what is about to be shown and are cancelled.
+        Everything else, e.g. saves and lease releases, still runs before
+        the worker threads exit; their callbacks are no longer delivered
+        once the Tk root is destroyed.
+        """
+        for task in list(self.latest.values()):
+            task.cancel()
+        for executor in self.lanes.values():
+            executor.shutdown(wait=False)
+        self.lanes = {}
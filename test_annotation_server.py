@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from PIL import Image
+
+import annotation_io
+from annotation_client import AnnotationClient
+from annotation_server import make_server
+
+
+def keypoint(annotation_id, x=0.5, y=0.5):
+    return {'id': annotation_id, 'x': x, 'y': y}
+
+
+class AnnotationServerTest(unittest.TestCase):
+    """Sync path against a server on a free localhost port"""
+
+    def setUp(self):
+        self.dataset_path = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.dataset_path, "images"))
+        for name in ("a.png", "b.png"):
+            Image.new("RGB", (8, 8)).save(os.path.join(self.dataset_path, "images", name))
+        self.server = make_server(self.dataset_path, port=0)
+        self.store = self.server.store
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.client = AnnotationClient(f"127.0.0.1:{self.server.server_address[1]}")
+        self.seqs = {}
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dataset_path)
+
+    def op(self, client, op, acked=0, **fields):
+        """Operation of a client with its next sequence number"""
+        self.seqs[client] = self.seqs.get(client, 0) + 1
+        return dict(fields, op=op, image="a.png", kind="keypoint", client=client, seq=self.seqs[client], acked=acked)
+
+    def keypoints(self):
+        return {e['id']: e for e in self.client.annotations("a.png")['keypoints']}
+
+    def file_data(self):
+        return annotation_io.read_annotation_file(annotation_io.annotation_path(self.dataset_path, "a.png"))
+
+    def test_add_update_delete(self):
+        results = self.client.apply_ops([self.op("c1", "add", entry=keypoint(1)),
+                                         self.op("c1", "add", entry=keypoint(2))])
+        self.assertEqual([r['id'] for r in results], [1, 2])
+        self.client.apply_ops([self.op("c1", "update", entry=keypoint(1, 0.1, 0.2)),
+                               self.op("c1", "delete", id=2)])
+        self.assertEqual(self.keypoints(), {1: keypoint(1, 0.1, 0.2)})
+
+    def test_resent_batch_is_applied_once(self):
+        batch = [self.op("c1", "add", entry=keypoint(1))]
+        first = self.client.apply_ops(batch)
+        again = self.client.apply_ops(batch)
+        self.assertEqual(first, again)
+        self.assertEqual(list(self.keypoints()), [1])
+
+    def test_renamed_ids_are_translated(self):
+        self.client.apply_ops([self.op("c1", "add", entry=keypoint(1))])
+        # c2 added its own keypoint 1 and keeps using that id until it sees the answer
+        results = self.client.apply_ops([self.op("c2", "add", entry=keypoint(1, 0.9, 0.9))])
+        self.assertEqual(results[0]['id'], 2)
+        self.client.apply_ops([self.op("c2", "update", entry=keypoint(1, 0.8, 0.8))])
+        self.assertEqual(self.keypoints(), {1: keypoint(1), 2: keypoint(2, 0.8, 0.8)})
+        self.client.apply_ops([self.op("c2", "delete", id=1)])
+        self.assertEqual(list(self.keypoints()), [1])
+        # Once the answer was seen c2 uses the new id itself
+        self.client.apply_ops([self.op("c2", "add", acked=2, entry=keypoint(3)),
+                               self.op("c2", "delete", acked=2, id=1)])
+        self.assertEqual(list(self.keypoints()), [3])
+
+    def test_update_of_deleted_annotation_is_rejected(self):
+        self.client.apply_ops([self.op("c1", "add", entry=keypoint(1))])
+        self.client.apply_ops([self.op("c2", "delete", id=1)])
+        results = self.client.apply_ops([self.op("c1", "update", entry=keypoint(1, 0.3, 0.3)),
+                                         self.op("c1", "update", entry=keypoint(99))])
+        self.assertTrue(all('error' in r for r in results))
+        self.assertEqual(self.keypoints(), {})
+        # 99 never went through the allocator, so it can't be given out twice
+        results = self.client.apply_ops([self.op("c1", "add", entry={'x': 0, 'y': 0})])
+        self.assertEqual(results[0]['id'], 2)
+        self.assertEqual(self.client.annotations("a.png")['next_ids']['keypoint'], 3)
+
+    def test_flush_writes_checked_and_drops_clean_documents(self):
+        self.client.apply_ops([self.op("c1", "add", entry=keypoint(1))])
+        self.store.flush()
+        data = self.file_data()
+        self.assertEqual((data['revision'], [e['id'] for e in data['keypoints']]), (1, [1]))
+        self.assertEqual(self.store.docs, {})
+
+    def test_flush_merges_direct_saves(self):
+        self.client.apply_ops([self.op("c1", "add", entry=keypoint(1))])
+        self.store.flush()
+        self.client.apply_ops([self.op("c1", "add", entry=keypoint(2))])
+        # An annotator working on the files saves meanwhile
+        data = self.file_data()
+        data['keypoints'].append(keypoint(5))
+        annotation_io.write_annotation_file_checked(annotation_io.annotation_path(self.dataset_path, "a.png"),
+                                                    data, 1)
+        self.store.flush()
+        self.store.flush()
+        data = self.file_data()
+        self.assertEqual(data['revision'], 3)
+        self.assertEqual(sorted(e['id'] for e in data['keypoints']), [1, 2, 5])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import numpy as np
+from PIL import Image
+
+CODES = 1 << 16  # Values of high bit depth images are quantized to at most this many levels
+AUTO_PERCENTILES = (0.5, 99.5)  # The automatic window clips this much of the histogram on each side
+
+
+class Windowing:
+    """Display image whose window/level and gamma can change without decoding it again
+
+    The values of the image are quantized once to integer codes, 8-bit
+    images are their own codes. Rendering with other settings only builds a
+    lookup table with one entry per code and indexes it with the cached
+    codes, which takes milliseconds at display size.
+    """
+
+    def __init__(self, image):
+        if image.mode not in ("L", "RGB", "F"):
+            image = image.convert("RGB")
+        values = np.asarray(image)
+        if values.dtype == np.uint8:
+            self.codes, self.offset, self.step = values, 0.0, 1.0
+            self.histogram = np.bincount(values.ravel(), minlength=256)
+        else:
+            finite = np.isfinite(values)
+            valid = values[finite]
+            lo, hi = (float(valid.min()), float(valid.max())) if len(valid) else (0.0, 0.0)
+            # Integer data keeps one code per value when the range allows it
+            exact = hi - lo < CODES and not np.any(np.mod(valid, 1))
+            self.offset = lo
+            self.step = 1.0 if exact else max((hi - lo) / (CODES - 1), np.finfo(np.float32).tiny)
+            self.codes = np.rint((np.where(finite, values, lo) - lo) / self.step).astype(np.uint16)
+            self.histogram = np.bincount(self.codes.ravel(), minlength=int(round((hi - lo) / self.step)) + 1)
+        self._lut_settings = None
+        self._lut = None
+
+    @property
+    def high_bit_depth(self):
+        return self.codes.dtype != np.uint8
+
+    @property
+    def minimum(self):
+        return self.offset
+
+    @property
+    def maximum(self):
+        return self.offset + self.step * (len(self.histogram) - 1)
+
+    def auto_settings(self):
+        """(window, level, gamma) showing the image as is, or its percentile range for high bit depths"""
+        if not self.high_bit_depth:
+            return 255.0, 127.5, 1.0
+        cumulative = np.cumsum(self.histogram)
+        lo_code, hi_code = np.searchsorted(cumulative, cumulative[-1] * np.array(AUTO_PERCENTILES) / 100)
+        lo, hi = self.offset + self.step * lo_code, self.offset + self.step * hi_code
+        if hi <= lo:
+            hi = lo + self.step
+        return hi - lo, (hi + lo) / 2, 1.0
+
+    def lut(self, window, level, gamma=1.0):
+        """8-bit display value of every code: the window around the level stretched over 0-255"""
+        values = self.offset + self.step * np.arange(len(self.histogram), dtype=np.float64)
+        scaled = np.clip((values - (level - window / 2)) / max(window, self.step), 0, 1)
+        if gamma != 1.0:
+            scaled **= 1 / gamma
+        return (scaled * 255 + 0.5).astype(np.uint8)
+
+    def render(self, window, level, gamma=1.0):
+        """Display image with these settings, an L or RGB image of the cached size"""
+        settings = (window, level, gamma)
+        if settings != self._lut_settings:
+            self._lut = self.lut(*settings)
+            self._lut_settings = settings
+        return Image.fromarray(self._lut[self.codes])
@@ -0,0 +1,202 @@
+import os
+import sqlite3
+import time
+
+from leases import LeaseManager, default_owner
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    name TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'open',
+    owner TEXT,
+    claimed_at REAL,
+    done_at REAL
+);
+CREATE INDEX IF NOT EXISTS images_status ON images (status, name);
+"""
+
+
+class WorkQueue:
+    """Images of a dataset handed out to annotators in batches
+
+    Backed by a SQLite file that all annotators open. Every image is open,
+    claimed by one annotator or done. `claim` hands out a batch of open
+    images in one short transaction, and claims that were not renewed
+    within `claim_timeout` seconds go back to the queue, e.g. when an
+    annotator crashed. Annotators only talk to the queue once per batch,
+    so adding annotators doesn't slow anyone down.
+
+    SQLite relies on file locking, which many network file systems don't
+    implement reliably. The queue file must be on a local disk and is only
+    for annotators on that machine. Use ClaimFileQueue across machines.
+    Methods do blocking I/O and are meant to run in a worker; each call
+    opens its own connection, so they can run on any thread.
+    """
+
+    def __init__(self, db_path, owner=None, batch_size=20, claim_timeout=1800.0):
+        self.db_path = db_path
+        self.owner = owner or default_owner()
+        self.batch_size = batch_size
+        self.claim_timeout = claim_timeout
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    def _connect(self):
+        db = sqlite3.connect(self.db_path, timeout=30.0, isolation_level=None)
+        return _Transaction(db)
+
+    def populate(self, names, done=()):
+        """Add images that are not in the queue yet, `done` ones are already annotated"""
+        done = set(done)
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany("INSERT OR IGNORE INTO images (name, status, done_at) VALUES (?, ?, ?)",
+                           [(name, "done" if name in done else "open", now if name in done else None)
+                            for name in names])
+
+    def claim(self, count=None):
+        """Claim a batch of open images, returns their names in order"""
+        count = count or self.batch_size
+        now = time.time()
+        with self._connect() as db:
+            db.execute("BEGIN IMMEDIATE")
+            # Claims that timed out go back to the queue first
+            db.execute("UPDATE images SET status = 'open', owner = NULL, claimed_at = NULL "
+                       "WHERE status = 'claimed' AND claimed_at < ?", (now - self.claim_timeout,))
+            names = [row[0] for row in db.execute(
+                "SELECT name FROM images WHERE status = 'open' ORDER BY name LIMIT ?", (count,))]
+            db.executemany("UPDATE images SET status = 'claimed', owner = ?, claimed_at = ? WHERE name = ?",
+                           [(self.owner, now, name) for name in names])
+        return names
+
+    def renew(self):
+        """Heartbeat for our claims, so they don't time out while we work"""
+        with self._connect() as db:
+            db.execute("UPDATE images SET claimed_at = ? WHERE status = 'claimed' AND owner = ?",
+                       (time.time(), self.owner))
+
+    def complete(self, name):
+        """Mark an image as annotated"""
+        with self._connect() as db:
+            db.execute("UPDATE images SET status = 'done', done_at = ? WHERE name = ?", (time.time(), name))
+
+    def release(self, names=None):
+        """Return our unfinished claims to the queue, all of them or just `names`"""
+        query = ("UPDATE images SET status = 'open', owner = NULL, claimed_at = NULL "
+                 "WHERE status = 'claimed' AND owner = ?")
+        with self._connect() as db:
+            if names is None:
+                db.execute(query, (self.owner,))
+            else:
+                db.executemany(query + " AND name = ?", [(self.owner, name) for name in names])
+
+    def stats(self):
+        """Number of images per status"""
+        with self._connect() as db:
+            counts = dict(db.execute("SELECT status, COUNT(*) FROM images GROUP BY status"))
+        return {status: counts.get(status, 0) for status in ("open", "claimed", "done")}
+
+
+class ClaimFileQueue:
+    """Work queue of claim files in the dataset, for annotators on different machines
+
+    Same interface as WorkQueue. A claim is a lease (see leases.py) in
+    annotations/.queue/claims: a lock file created with O_EXCL, which also
+    works on NFS, renewed with the heartbeat and taken over once it
+    expired. Finished images get an empty marker in annotations/.queue/done.
+    Which images exist and which were annotated before is passed to
+    `populate` by every annotator, nothing else is shared.
+    """
+
+    def __init__(self, queue_dir, owner=None, batch_size=20, claim_timeout=1800.0):
+        self.claims = LeaseManager(os.path.join(queue_dir, "claims"), owner, ttl=claim_timeout)
+        self.owner = self.claims.owner
+        self.done_dir = os.path.join(queue_dir, "done")
+        self.batch_size = batch_size
+        self.names = []
+        self.done = set()
+        os.makedirs(self.done_dir, exist_ok=True)
+
+    def _done(self):
+        return self.done | set(os.listdir(self.done_dir))
+
+    def populate(self, names, done=()):
+        self.names = list(names)
+        self.done = set(done)
+
+    def _claimed(self):
+        """Names with a claim file, one directory listing instead of a lookup per image"""
+        try:
+            files = os.listdir(self.claims.lock_dir)
+        except FileNotFoundError:
+            return set()
+        return {f[:-len(".lock")] for f in files if f.endswith(".lock")}
+
+    def claim(self, count=None):
+        """Claim a batch of open images, returns their names in order
+
+        Images with a claim file are skipped without touching it, so the
+        cost of a claim doesn't grow with the number of annotators. Only
+        when too few unclaimed images are left are the claims of others
+        read, to take over the expired ones.
+        """
+        count = count or self.batch_size
+        done = self._done()
+        claimed = self._claimed()
+        names = []
+        for expired_only in (False, True):
+            for name in self.names:
+                if len(names) >= count:
+                    return names
+                if name in done or name in self.claims.held or (name in claimed) != expired_only:
+                    continue
+                if expired_only:
+                    record = self.claims.read(name)
+                    if record is not None and record.get('expires', 0) > time.time():
+                        continue
+                # Still fails if another annotator claimed it since the listing
+                if self.claims.acquire(name)[0]:
+                    names.append(name)
+        return names
+
+    def renew(self):
+        self.claims.renew()
+
+    def complete(self, name):
+        open(os.path.join(self.done_dir, name), 'a').close()
+        self.claims.release(name)
+
+    def release(self, names=None):
+        if names is None:
+            self.claims.release_all()
+        else:
+            for name in names:
+                self.claims.release(name)
+
+    def stats(self):
+        done = self._done() & set(self.names)
+        now = time.time()
+        claimed = 0
+        for name in (set(self.names) - done) & self._claimed():
+            record = self.claims.read(name)
+            if record is not None and record.get('expires', 0) > now:
+                claimed += 1
+        return {'open': len(self.names) - len(done) - claimed, 'claimed': claimed, 'done': len(done)}
+
+
+class _Transaction:
+    """Connection context that commits on success, rolls back on errors and always closes"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if self.db.in_transaction:
+                self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.db.close()